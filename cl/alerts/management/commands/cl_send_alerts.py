@@ -1,21 +1,36 @@
 import datetime
+import time
 import traceback
+from collections import OrderedDict, defaultdict
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings
-from django.contrib.auth.models import User
 from django.core.mail import EmailMultiAlternatives
 from django.template import loader
 from django.utils.timezone import now
 
-from cl.alerts.models import FREQUENCY, RealTimeQueue, ITEM_TYPES
+from cl.alerts.matching import AlertIndex
+from cl.alerts.models import Alert, FREQUENCY, RealTimeQueue, ITEM_TYPES
+from cl.audio.models import Audio
 from cl.lib import search_utils
 from cl.lib.command_utils import VerboseCommand, logger
-from cl.lib.scorched_utils import ExtraSolrInterface
+from cl.lib.scorched_utils import get_solr_interface
 from cl.lib.search_utils import regroup_snippets
 from cl.search.forms import SearchForm
+from cl.search.models import Opinion
 from cl.stats.utils import tally_stat
 
 
+SOLR_URLS = {
+    'o': settings.SOLR_OPINION_URL,
+    'oa': settings.SOLR_AUDIO_URL,
+}
+ITEM_MODELS = {
+    'o': Opinion,
+    'oa': Audio,
+}
+
+
 class InvalidDateError(Exception):
     pass
 
@@ -68,12 +83,12 @@ class Command(VerboseCommand):
 
     def __init__(self, *args, **kwargs):
         super(Command, self).__init__(*args, **kwargs)
-        self.connections = {
-            'o': ExtraSolrInterface(settings.SOLR_OPINION_URL, mode='r'),
-            'oa': ExtraSolrInterface(settings.SOLR_AUDIO_URL, mode='r'),
-        }
+        self.connections = dict((item_type, get_solr_interface(url, mode='r'))
+                                for item_type, url in SOLR_URLS.items())
         self.options = {}
         self.valid_ids = {}
+        self.rt_candidates = {}
+        self.cleaned_data = {}
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -90,121 +105,300 @@ class Command(VerboseCommand):
             help='Simulate the emails that would be sent using the console '
                  'backend.',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='The number of queries to run in Solr at once.',
+        )
+
+    def build_query(self, alert, rate):
+        """Work out the Solr parameters for an alert.
 
-    def run_query(self, alert, rate):
-        results = []
-        error = False
-        cd = {}
+        :return: A tuple of whether the alert has an error, the type of item
+        it searches, and the Solr parameters to send. The parameters are None
+        if the alert can't have any results.
+        """
         try:
             logger.info("Now running the query: %s\n" % alert.query)
-
-            # Set up the data
-            data = search_utils.get_string_to_dict(alert.query)
-            try:
-                del data['filed_before']
-            except KeyError:
-                pass
-            data['order_by'] = 'score desc'
-            logger.info("  Data sent to SearchForm is: %s\n" % data)
-            search_form = SearchForm(data)
-            if search_form.is_valid():
-                cd = search_form.cleaned_data
-
-                if rate == 'rt' and len(self.valid_ids[cd['type']]) == 0:
-                    # Bail out. No results will be found if no valid_ids.
-                    return error, cd['type'], results
-
-                cut_off_date = get_cut_off_date(rate)
-                if cd['type'] == 'o':
-                    cd['filed_after'] = cut_off_date
-                elif cd['type'] == 'oa':
-                    cd['argued_after'] = cut_off_date
-                main_params = search_utils.build_main_query(cd, facet=False)
-                main_params.update({
-                    'rows': '20',
-                    'start': '0',
-                    'hl.tag.pre': '<em><strong>',
-                    'hl.tag.post': '</strong></em>',
-                    'caller': 'cl_send_alerts',
-                })
-
-                if rate == 'rt':
-                    main_params['fq'].append('id:(%s)' % ' OR '.join(
-                        [str(i) for i in self.valid_ids[cd['type']]]
-                    ))
-                results = self.connections[
-                    cd['type']
-                ].query().add_extra(
-                    **main_params
-                ).execute()
-                regroup_snippets(results)
-
-            else:
-                logger.info("  Query for alert %s was invalid\n"
-                            "  Errors from the SearchForm: %s\n" %
-                            (alert.query, search_form.errors))
-                error = True
+            cd = self.get_cleaned_data(alert)
+            if cd is None:
+                return True, None, None
+            cd = cd.copy()
+
+            if rate == 'rt' and not self.rt_candidates.get(alert.pk):
+                # Bail out. None of the new items can match this alert.
+                return False, cd['type'], None
+
+            cut_off_date = get_cut_off_date(rate)
+            if cd['type'] == 'o':
+                cd['filed_after'] = cut_off_date
+            elif cd['type'] == 'oa':
+                cd['argued_after'] = cut_off_date
+            main_params = search_utils.build_main_query(cd, facet=False)
+            main_params.update({
+                'rows': '20',
+                'start': '0',
+                'hl.tag.pre': '<em><strong>',
+                'hl.tag.post': '</strong></em>',
+                'caller': 'cl_send_alerts',
+            })
+
+            if rate == 'rt':
+                # Solr confirms which of the candidates really match.
+                main_params['fq'].append('id:(%s)' % ' OR '.join(
+                    [str(i) for i in self.rt_candidates[alert.pk]]
+                ))
         except:
             traceback.print_exc()
             logger.info("  Search for this alert failed: %s\n" %
                         alert.query)
-            error = True
+            return True, None, None
+        return False, cd['type'], main_params
 
+    def get_cleaned_data(self, alert):
+        """Validate an alert's query with the SearchForm, once per run.
+
+        :return: The cleaned data of the form, or None if it's invalid.
+        """
+        if alert.pk in self.cleaned_data:
+            return self.cleaned_data[alert.pk]
+        data = search_utils.get_string_to_dict(alert.query)
+        try:
+            del data['filed_before']
+        except KeyError:
+            pass
+        data['order_by'] = 'score desc'
+        logger.info("  Data sent to SearchForm is: %s\n" % data)
+        search_form = SearchForm(data)
+        if search_form.is_valid():
+            cd = search_form.cleaned_data
+        else:
+            logger.info("  Query for alert %s was invalid\n"
+                        "  Errors from the SearchForm: %s\n" %
+                        (alert.query, search_form.errors))
+            cd = None
+        self.cleaned_data[alert.pk] = cd
+        return cd
+
+    def match_rt_alerts(self, alerts):
+        """Find the new items that each real-time alert might match.
+
+        The alerts are indexed by the terms and filters they require, and
+        each new item is checked against only the alerts it could match, so
+        that Solr only gets queried for alerts that have candidates.
+
+        :param alerts: An iterable of real-time alerts.
+        :return: A dict mapping alert pks to lists of the ids of candidate
+        items.
+        """
+        t1 = time.time()
+        index = AlertIndex()
+        for alert in alerts:
+            try:
+                cd = self.get_cleaned_data(alert)
+            except Exception:
+                traceback.print_exc()
+                continue
+            if cd is not None:
+                index.add(alert.pk, cd)
+
+        candidates = defaultdict(list)
+        item_count = 0
+        for item_type, ids in self.valid_ids.items():
+            for item in ITEM_MODELS[item_type].objects.filter(pk__in=ids):
+                item_count += 1
+                try:
+                    search_dict = item.as_search_dict()
+                except Exception:
+                    traceback.print_exc()
+                    # Let Solr check it against every alert of its type.
+                    search_dict = None
+                if search_dict is None:
+                    alert_pks = index.get_all(item_type)
+                else:
+                    alert_pks = index.get_candidates(item_type, search_dict)
+                for alert_pk in alert_pks:
+                    candidates[alert_pk].append(item.pk)
+        logger.info("Matched %s new items to %s candidate alerts in %.2fs." %
+                    (item_count, len(candidates), time.time() - t1))
+        return candidates
+
+    @staticmethod
+    def execute_query(args):
+        """Send a query to Solr. This is run in the threads of the query
+        stage, each of which reuses its own connection to each core.
+
+        :param args: A tuple of the query's key, the type of item it
+        searches, and its Solr parameters.
+        :return: A tuple of the key, whether the query failed, the results,
+        and the number of seconds the query took.
+        """
+        key, alert_type, main_params = args
+        t1 = time.time()
+        try:
+            results = get_solr_interface(
+                SOLR_URLS[alert_type], mode='r',
+            ).query().add_extra(**main_params).execute()
+            regroup_snippets(results)
+        except:
+            traceback.print_exc()
+            logger.info("  Search failed with parameters: %s\n" % main_params)
+            return key, True, [], time.time() - t1
         logger.info("  There were %s results\n" % len(results))
+        return key, False, results, time.time() - t1
 
-        return error, cd.get('type'), results
+    def get_alerts_by_user(self, rate):
+        """Get the alerts for a rate, grouped by their users, leaving out
+        users that can't get them.
 
-    def send_emails(self, rate):
-        """Send out an email to every user whose alert has a new hit for a
-        rate.
+        :return: An OrderedDict mapping users to lists of their alerts.
         """
-        users = User.objects.filter(
-            alerts__rate=rate,
-        ).distinct()
-
-        alerts_sent_count = 0
-        for user in users:
-            alerts = user.alerts.filter(rate=rate)
+        alerts = Alert.objects.filter(rate=rate).select_related(
+            'user__profile',
+        ).order_by('user_id', 'rate', 'query')
+        alerts_by_user = OrderedDict()
+        for alert in alerts:
+            alerts_by_user.setdefault(alert.user, []).append(alert)
+
+        for user, alerts in alerts_by_user.items():
             logger.info("\n\nAlerts for user '%s': %s\n"
                         "%s\n" % (user, alerts, '*' * 40))
-
             not_donated_enough = user.profile.total_donated_last_year < \
                 settings.MIN_DONATION['rt_alerts']
             if not_donated_enough and rate == 'rt':
                 logger.info('\n\nUser: %s has not donated enough for their %s '
                             'RT alerts to be sent.\n' % (user, len(alerts)))
-                continue
+                del alerts_by_user[user]
+        return alerts_by_user
 
-            hits = []
+    def send_emails(self, rate):
+        """Send out an email to every user whose alert has a new hit for a
+        rate.
+
+        This runs as a pipeline. Alerts that have the same type and Solr
+        parameters, like identical queries from different users, are grouped
+        so each distinct query is run only once. Queries run in a pool of
+        threads, and as soon as every query that a user needs is done, their
+        email is rendered and sent by another thread while queries continue.
+        """
+        t1 = time.time()
+        stats = defaultdict(int)
+        queries = OrderedDict()
+        users_by_key = defaultdict(list)
+        keys_by_user = {}
+        alerts_by_user = self.get_alerts_by_user(rate)
+        if rate == 'rt':
+            self.rt_candidates = self.match_rt_alerts(
+                alert for alerts in alerts_by_user.values()
+                for alert in alerts
+            )
+        for user, alerts in alerts_by_user.items():
+            keys_by_user[user] = []
             for alert in alerts:
-                error, alert_type, results = self.run_query(alert, rate)
-                if error:
+                stats['alerts'] += 1
+                error, alert_type, main_params = self.build_query(alert, rate)
+                if error or main_params is None:
+                    keys_by_user[user].append(None)
                     continue
+                key = (alert_type, repr(sorted(main_params.items())))
+                queries.setdefault(key, main_params)
+                if user not in users_by_key[key]:
+                    users_by_key[key].append(user)
+                keys_by_user[user].append(key)
+
+        results = {}
+        # The number of users whose emails still need each query's results,
+        # so results can be let go of once they've all been built.
+        users_left = dict((key, len(users)) for key, users in
+                          users_by_key.items())
+        hit_alert_pks = []
+        sends = []
+        query_pool = ThreadPool(self.options['workers'])
+        email_pool = ThreadPool(1)
+        t2 = time.time()
+        try:
+            jobs = [(key, key[0], main_params) for key, main_params in
+                    queries.items()]
+            for key, error, key_results, seconds in query_pool.imap_unordered(
+                    self.execute_query, jobs):
+                stats['queries'] += 1
+                stats['failed'] += error
+                stats['query_seconds'] += seconds
+                results[key] = key_results
+                for user in users_by_key.pop(key):
+                    if any(k in users_by_key for k in keys_by_user[user]):
+                        # Still waiting on some of the user's queries.
+                        continue
+                    hits = self.get_hits(alerts_by_user[user],
+                                         keys_by_user[user], results)
+                    for k in set(keys_by_user[user]) - {None}:
+                        users_left[k] -= 1
+                        if not users_left[k]:
+                            del results[k]
+                    if hits:
+                        hit_alert_pks.extend(alert.pk for alert, _, _ in hits)
+                        sends.append(email_pool.apply_async(
+                            send_alert,
+                            (user.profile, hits, self.options['simulate']),
+                        ))
+                    else:
+                        logger.info("  No hits. Not sending mail for %s.\n" %
+                                    user)
+            query_stage_seconds = time.time() - t2
+        finally:
+            query_pool.close()
+            query_pool.join()
+            email_pool.close()
+            email_pool.join()
 
-                # hits is a multi-dimensional array. It consists of alerts,
-                # paired with a list of document dicts, of the form:
-                # [[alert1, [{hit1}, {hit2}, {hit3}]], [alert2, ...]]
-                try:
-                    if len(results) > 0:
-                        hits.append([alert, alert_type, results])
-                        alert.date_last_hit = now()
-                        alert.save()
-                except Exception as e:
-                    traceback.print_exc()
-                    logger.info("  Search failed on this alert: %s\n%s\n" %
-                                (alert.query, e))
-
-            if len(hits) > 0:
+        alerts_sent_count = 0
+        for send in sends:
+            try:
+                send.get()
                 alerts_sent_count += 1
-                send_alert(user.profile, hits, self.options['simulate'])
-            elif self.options['verbosity'] >= 1:
-                logger.info("  No hits. Not sending mail for this cl.\n")
+            except Exception:
+                traceback.print_exc()
+                logger.info("  Unable to send an alert email.\n")
+        Alert.objects.filter(pk__in=hit_alert_pks).update(date_last_hit=now())
 
         if not self.options['simulate']:
             tally_stat('alerts.sent.%s' % rate, inc=alerts_sent_count)
             logger.info("Sent %s %s email alerts." %
                         (alerts_sent_count, rate))
 
+        total_seconds = time.time() - t1
+        logger.info(
+            "Ran %s distinct queries for %s alerts in %.1fs, at %.1f queries "
+            "per second with %s threads. Queries took %.2fs on average, and "
+            "%s failed. Rendered and sent %s emails. The whole run took "
+            "%.1fs." % (
+                stats['queries'], stats['alerts'], query_stage_seconds,
+                stats['queries'] / (query_stage_seconds or 1),
+                self.options['workers'],
+                stats['query_seconds'] / (stats['queries'] or 1),
+                stats['failed'],
+                alerts_sent_count, total_seconds,
+            ))
+
+    @staticmethod
+    def get_hits(alerts, keys, results):
+        """Pair a user's alerts with the results of their queries.
+
+        :param alerts: A list of the user's alerts.
+        :param keys: A list of the keys of their queries, in the same order,
+        with None for alerts that couldn't be run.
+        :param results: A dict mapping keys to results.
+        :return: A multi-dimensional list of alerts, paired with a list of
+        document dicts, of the form:
+            [[alert1, type, [{hit1}, {hit2}, {hit3}]], [alert2, ...]]
+        """
+        hits = []
+        for alert, key in zip(alerts, keys):
+            if key is not None and len(results[key]) > 0:
+                hits.append([alert, key[0], results[key]])
+        return hits
+
     def clean_rt_queue(self):
         """Clean out any items in the RealTime queue once they've been run or
         if they are stale.
@@ -0,0 +1,206 @@
+"""Match new items against real-time alerts without asking Solr about every
+alert.
+
+Real-time alerts used to be run as Solr queries limited to the ids of every
+new item, so each run cost a query per alert no matter how few alerts could
+match. Instead, the alerts are parsed once into an index of what they
+require: the courts and precedential statuses they are limited to, and the
+terms their queries must contain. Each new item is then checked against
+only the alerts it could match, and Solr is asked about those alerts alone.
+
+This index is a prefilter, so it must never rule out an alert that Solr
+would match. Anything it can't be sure about, like fielded or boolean
+queries, puts no requirements on items. Solr stems terms, so terms are
+compared by a short prefix that stemming doesn't change, and short terms,
+whose stems are less predictable, are not required at all. Solr also adds
+synonyms to the text it indexes, like "street" wherever "St." appears, so
+items get the keys of the synonyms of their words too.
+"""
+import os
+import re
+from collections import defaultdict
+
+from django.utils.encoding import force_text
+
+# Queries with these characters or words use Solr syntax that this module
+# doesn't parse. Solr treats lowercase operators as operators too.
+complex_query_re = re.compile(r'[-+!(){}\[\]^~*?:\\/|&]|\b(?:OR|NOT|TO)\b',
+                              re.I)
+term_re = re.compile(r'[a-z]+')
+# Words in items, including the delimiters inside them, like "e-mail", which
+# Solr may index as "email" as well as "e" and "mail".
+word_re = re.compile(r'[a-z0-9]+(?:[^a-z0-9\s]+[a-z0-9]+)*')
+# Terms shorter than this aren't required, because their stems can be shorter
+# than the prefix, and they include most stop words.
+MIN_TERM_LENGTH = 6
+PREFIX_LENGTH = 3
+# The synonyms that the text field is indexed with. See schema.xml.
+SYNONYMS_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'Solr',
+                             'conf', 'lang', 'synonyms_en.txt')
+
+
+def parse_synonyms(lines):
+    """Parse Solr's synonym format into the terms that each term adds.
+
+    Lines like "st => state,street" replace the terms on the left with the
+    ones on the right. Lines like "sec,section" make every term on them add
+    all of the others. Phrases on the left are keyed by their first word,
+    which is enough for a prefilter.
+
+    :param lines: The lines of a synonyms file.
+    :return: A dict mapping lowercase words to sets of the lowercase terms
+    that Solr adds when it indexes them.
+    """
+    synonyms = defaultdict(set)
+    for line in lines:
+        line = line.split('#', 1)[0].strip().lower()
+        if not line:
+            continue
+        if '=>' in line:
+            sources, targets = line.split('=>', 1)
+            sources = sources.split(',')
+            targets = targets.split(',')
+        else:
+            sources = targets = line.split(',')
+        targets = set(term for target in targets
+                      for term in target.split())
+        for source in sources:
+            words = source.split()
+            if words:
+                synonyms[words[0]].update(targets)
+    return dict(synonyms)
+
+
+_synonyms = None
+
+
+def get_synonyms():
+    global _synonyms
+    if _synonyms is None:
+        with open(SYNONYMS_PATH) as f:
+            _synonyms = parse_synonyms(force_text(f.read()).splitlines())
+    return _synonyms
+
+
+def get_required_keys(q):
+    """Get the keys of the terms that every match of a query must contain.
+
+    Numbers are left out, since Solr may join or split them differently than
+    they were typed.
+
+    :param q: The text of a query, as typed by a user.
+    :return: A frozenset of keys. It's empty if the query has no terms that
+    are certain to be required, such as when it uses boolean operators.
+    """
+    if not q or complex_query_re.search(q):
+        return frozenset()
+    return frozenset(t[:PREFIX_LENGTH] for t in term_re.findall(q.lower())
+                     if len(t) >= MIN_TERM_LENGTH)
+
+
+def get_item_keys(search_dict, synonyms=None):
+    """Get the keys of every term in the text fields of a search dict, and of
+    the synonyms that Solr indexes along with them.
+
+    :param search_dict: The item's search dict.
+    :param synonyms: A dict from parse_synonyms. Defaults to the ones the
+    text field is indexed with.
+    """
+    if synonyms is None:
+        synonyms = get_synonyms()
+    # Synonyms of symbols like the section sign, which aren't part of any
+    # word.
+    symbols = [s for s in synonyms if not word_re.match(s)]
+    keys = set()
+    added = set()
+    for value in search_dict.values():
+        if isinstance(value, (list, tuple)):
+            values = value
+        else:
+            values = [value]
+        for v in values:
+            if not isinstance(v, basestring):
+                continue
+            text = force_text(v).lower()
+            for word in word_re.findall(text):
+                terms = term_re.findall(word)
+                for term in terms:
+                    keys.add(term[:PREFIX_LENGTH])
+                keys.add(''.join(terms)[:PREFIX_LENGTH])
+                for token in [word] + terms:
+                    added.update(synonyms.get(token, ()))
+            for symbol in symbols:
+                if symbol in text:
+                    added.update(synonyms[symbol])
+    for term in added:
+        keys.add(''.join(term_re.findall(term))[:PREFIX_LENGTH])
+    return keys
+
+
+def get_selected(cd, prefix):
+    """Get the values of the checkboxes an alert is limited to.
+
+    :return: A set of values, or None if every box is checked, like
+    get_selected_field_string, or if none are.
+    """
+    selected = set(k[len(prefix):] for k, v in cd.items()
+                   if k.startswith(prefix) and v is True)
+    if not selected or len(selected) == cd.get('_%scount' % prefix):
+        return None
+    return selected
+
+
+class AlertIndex(object):
+    """A reverse index of alerts, for finding the alerts an item might match.
+
+    Alerts are filed under one of their required term keys, or under None if
+    they have none, so an item only has to look at the alerts filed under the
+    terms it contains.
+    """
+
+    def __init__(self):
+        self.alerts = {}
+
+    def add(self, alert_pk, cd):
+        """Add an alert to the index.
+
+        :param alert_pk: The pk of the alert.
+        :param cd: The cleaned data of the alert's SearchForm.
+        """
+        required = get_required_keys(cd.get('q'))
+        # Any required key will do. Sorting keeps the index the same from run
+        # to run.
+        anchor = sorted(required)[-1] if required else None
+        self.alerts.setdefault((cd['type'], anchor), []).append((
+            alert_pk,
+            required,
+            get_selected(cd, 'court_'),
+            get_selected(cd, 'stat_') if cd['type'] == 'o' else None,
+        ))
+
+    def get_candidates(self, item_type, search_dict):
+        """Get the alerts that an item might match.
+
+        :param item_type: The type of the item, 'o' or 'oa'.
+        :param search_dict: The item's search dict.
+        :return: A set of alert pks.
+        """
+        keys = get_item_keys(search_dict)
+        candidates = set()
+        for anchor in list(keys) + [None]:
+            for alert_pk, required, courts, statuses in self.alerts.get(
+                    (item_type, anchor), []):
+                if courts is not None and \
+                        search_dict.get('court_id') not in courts:
+                    continue
+                if statuses is not None and \
+                        search_dict.get('status') not in statuses:
+                    continue
+                if required <= keys:
+                    candidates.add(alert_pk)
+        return candidates
+
+    def get_all(self, item_type):
+        """Get every alert for a type of item."""
+        return set(alert[0] for (t, _), alerts in self.alerts.items()
+                   if t == item_type for alert in alerts)
@@ -1,8 +1,11 @@
+import mock
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
-from django.test import Client, TestCase
+from django.test import Client, SimpleTestCase, TestCase
 from timeout_decorator import timeout_decorator
 
+from cl.alerts.management.commands.cl_send_alerts import Command
+from cl.alerts.matching import AlertIndex
 from cl.alerts.models import Alert
 from cl.tests.base import BaseSeleniumTest, SELENIUM_TIMEOUT
 
@@ -40,6 +43,109 @@ class AlertTest(TestCase):
         self.client.logout()
 
 
+class AlertHitsTest(SimpleTestCase):
+    def test_alerts_share_the_results_of_their_query(self):
+        """Are the results of a grouped query given to each of its alerts?"""
+        shared, empty = ('o', 'shared'), ('oa', 'empty')
+        results = {shared: [{'id': 1}], empty: []}
+        a, b, c, d = Alert(name='a'), Alert(name='b'), Alert(name='c'), \
+            Alert(name='d')
+        hits = Command.get_hits([a, b, c, d], [shared, None, empty, shared],
+                                results)
+        self.assertEqual(hits, [
+            [a, 'o', [{'id': 1}]],
+            [d, 'o', [{'id': 1}]],
+        ])
+
+
+class AlertPipelineTest(TestCase):
+    fixtures = ['test_court.json', 'authtest_data.json']
+
+    @staticmethod
+    def execute_query(args):
+        """Answer queries for 'shared' with a hit, and others with none."""
+        key, alert_type, main_params = args
+        results = [{'id': 1}] if 'shared' in main_params['q'] else []
+        return key, False, results, 0.0
+
+    @mock.patch('cl.alerts.management.commands.cl_send_alerts.send_alert')
+    def test_shared_queries_are_run_once(self, send_alert):
+        """Are identical alerts of different users run as one query, and
+        does each user get one email with the shared results?"""
+        pandora = User.objects.get(username='pandora')
+        other = User.objects.get(username='unconfirmed_email')
+        shared = [Alert.objects.create(user=user, name='shared',
+                                       query='q=shared', rate='dly')
+                  for user in (pandora, other)]
+        no_hits = Alert.objects.create(user=pandora, name='no hits',
+                                       query='q=nothing', rate='dly')
+
+        with mock.patch('cl.alerts.management.commands.cl_send_alerts.'
+                        'get_solr_interface'):
+            command = Command()
+        command.options = {'workers': 2, 'simulate': True}
+        with mock.patch.object(Command, 'execute_query',
+                               side_effect=self.execute_query) as execute, \
+                mock.patch.object(Command, 'get_hits',
+                                  side_effect=Command.get_hits) as get_hits:
+            command.send_emails('dly')
+
+        self.assertEqual(2, execute.call_count)
+        self.assertEqual(2, send_alert.call_count)
+        hits_by_user = dict((c[0][0].user, c[0][1])
+                            for c in send_alert.call_args_list)
+        self.assertEqual({pandora, other}, set(hits_by_user.keys()))
+        for user, alert in zip((pandora, other), shared):
+            self.assertEqual([[alert, 'o', [{'id': 1}]]],
+                             hits_by_user[user])
+        self.assertIs(hits_by_user[pandora][0][2],
+                      hits_by_user[other][0][2])
+        # Results are let go of once every user who needs them has them.
+        self.assertEqual({}, get_hits.call_args[0][2])
+
+        hit_pks = set(Alert.objects.exclude(date_last_hit=None).values_list(
+            'pk', flat=True))
+        self.assertEqual(set(alert.pk for alert in shared), hit_pks)
+        self.assertNotIn(no_hits.pk, hit_pks)
+
+
+class AlertIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.index = AlertIndex()
+        self.index.add(1, {'type': 'o', 'q': 'arbitration contracts',
+                           'court_scotus': True, 'court_ca1': False,
+                           '_court_count': 2})
+        self.index.add(2, {'type': 'o', 'q': 'fish OR chips'})
+        self.index.add(3, {'type': 'o', 'q': 'running emails'})
+        self.index.add(4, {'type': 'oa', 'q': 'arbitration'})
+        self.item = {
+            'id': 5,
+            'court_id': 'scotus',
+            'text': u'The arbitrator ruled on the contract. He runs an e-mail '
+                    u'server.',
+        }
+
+    def test_candidates_match_terms_and_filters(self):
+        """Are alerts ruled out only when they certainly can't match?"""
+        self.assertEqual(self.index.get_candidates('o', self.item),
+                         {1, 2, 3})
+        self.item['court_id'] = 'ca1'
+        self.assertEqual(self.index.get_candidates('o', self.item), {2, 3})
+        self.item['text'] = u'Nothing to see here.'
+        self.assertEqual(self.index.get_candidates('o', self.item), {2})
+        self.assertEqual(self.index.get_candidates('oa', self.item), set())
+
+    def test_synonyms_are_matched(self):
+        """Do items match alerts for the synonyms Solr indexes them with, like
+        "street" for "St."?"""
+        self.index.add(6, {'type': 'o', 'q': 'streets'})
+        self.index.add(7, {'type': 'o', 'q': 'trustee'})
+        self.item['text'] = u'It happened on Main St.'
+        self.assertEqual(self.index.get_candidates('o', self.item), {2, 6})
+        self.item['text'] = u'Smith, Tr., filed a motion.'
+        self.assertEqual(self.index.get_candidates('o', self.item), {2, 7})
+
+
 class AlertSeleniumTest(BaseSeleniumTest):
     fixtures = ['test_court.json', 'authtest_data.json']
 
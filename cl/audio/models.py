@@ -176,7 +176,7 @@ class Audio(models.Model):
         :param commit: Should a commit be performed after adding it?
         """
         super(Audio, self).save(*args, **kwargs)
-        if index:
+        if index and not settings.INDEX_CHANGE_LOG_ENABLED:
             from cl.search.tasks import add_or_update_audio_files
             add_or_update_audio_files.delay([self.pk], force_commit)
 
@@ -186,8 +186,9 @@ class Audio(models.Model):
         """
         id_cache = self.pk
         super(Audio, self).delete(*args, **kwargs)
-        from cl.search.tasks import delete_items
-        delete_items.delay([id_cache], settings.SOLR_AUDIO_URL)
+        if not settings.INDEX_CHANGE_LOG_ENABLED:
+            from cl.search.tasks import delete_items
+            delete_items.delay([id_cache], settings.SOLR_AUDIO_URL)
 
     def as_search_dict(self):
         """Create a dict that can be ingested by Solr"""
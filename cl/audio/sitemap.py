@@ -12,4 +12,5 @@ def oral_argument_sitemap_maker(request):
         'monthly',
         ['mp3'],
         'absolute_url',
+        section='oral-arguments',
     )
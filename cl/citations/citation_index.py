@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# encoding utf-8
+"""A local, file-backed index of the citations in the database.
+
+Matching citations against Solr takes at least one HTTP query per citation,
+which adds up to hundreds of millions of queries when the entire collection is
+processed. Most citations can be resolved without Solr, because they match
+exactly one precedential opinion. This module builds a sorted file mapping
+normalized citations to the opinions that have them, and looks citations up in
+it via binary search over a read-only memory map. Since the file is
+memory-mapped, every worker process on a server shares a single copy of it in
+the page cache.
+
+Each line of the file looks like:
+
+    <normalized citation>\t<opinion id>\t<cluster id>\t<date filed>\t<court>
+"""
+import heapq
+import mmap
+import os
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+
+from cl.lib.db_tools import queryset_generator
+from cl.search.models import Opinion, OpinionCluster
+
+citation_re = re.compile(r'^\s*(\d+)\s+(.+?)\s+(\S+)\s*$')
+
+
+def normalize_citation(volume, reporter, page):
+    """Make a key for a citation that ignores differences in spacing,
+    punctuation and case in its reporter, so that "410 U. S. 113" and
+    "410 U.S. 113" are the same key.
+
+    :param volume: The volume of the citation.
+    :param reporter: The reporter abbreviation of the citation.
+    :param page: The page of the citation.
+    :return: The key, as a utf-8 encoded str.
+    """
+    reporter = re.sub(r'[\s.,]+', '', reporter).lower()
+    return (u'%s %s %s' % (volume, reporter, page)).encode('utf-8')
+
+
+def normalize_citation_string(citation_string):
+    """Make a key for a citation stored in one of the citation fields of an
+    OpinionCluster.
+
+    :param citation_string: A string like "410 U.S. 113".
+    :return: The key, or None if the string doesn't look like a citation.
+    """
+    # Drop parentheticals like "(test 1795)".
+    citation_string = re.sub(r'\(.*?\)', '', citation_string)
+    m = citation_re.match(citation_string)
+    if m is None:
+        return None
+    return normalize_citation(*m.groups())
+
+
+def get_index_lines():
+    """Yield a line for each citation of each precedential opinion, in a single
+    pass over the database.
+    """
+    cite_fields = ['cluster__%s' % f for f in
+                   OpinionCluster().citation_fields]
+    qs = Opinion.objects.filter(
+        cluster__precedential_status='Published',
+    ).values(
+        'id',
+        'cluster_id',
+        'cluster__date_filed',
+        'cluster__docket__court_id',
+        *cite_fields
+    )
+    for row in queryset_generator(qs, chunksize=10000):
+        date_filed = row['cluster__date_filed']
+        keys = set()
+        for field in cite_fields:
+            if row[field]:
+                keys.add(normalize_citation_string(row[field]))
+        keys.discard(None)
+        for key in keys:
+            yield '%s\t%s\t%s\t%s\t%s\n' % (
+                key,
+                row['id'],
+                row['cluster_id'],
+                date_filed.toordinal() if date_filed else 0,
+                row['cluster__docket__court_id'].encode('utf-8'),
+            )
+
+
+def write_sorted_runs(lines, directory, run_size):
+    """Split lines into sorted files of at most run_size lines each.
+
+    :return: A list of the paths of the files.
+    """
+    paths = []
+    run = []
+    for line in lines:
+        run.append(line)
+        if len(run) >= run_size:
+            paths.append(write_run(run, directory))
+            run = []
+    if run or not paths:
+        paths.append(write_run(run, directory))
+    return paths
+
+
+def write_run(run, directory):
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.run')
+    with os.fdopen(fd, 'wb') as f:
+        f.writelines(sorted(run))
+    return path
+
+
+def build_citation_index(path=None, run_size=1000000):
+    """Build the citation index and atomically move it into place.
+
+    There are tens of millions of citations, too many to sort in memory, so
+    they are sorted in runs of run_size lines, which are then merged.
+
+    :param path: Where to save the index. Defaults to the
+    CITATION_INDEX_PATH setting.
+    :param run_size: The most lines to hold in memory at once.
+    :return: The number of citations in the index.
+    """
+    path = path or settings.CITATION_INDEX_PATH
+    run_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        run_paths = write_sorted_runs(get_index_lines(), run_dir, run_size)
+        runs = [open(run_path, 'rb') for run_path in run_paths]
+        count = 0
+        tmp_path = '%s.tmp' % path
+        try:
+            with open(tmp_path, 'wb') as f:
+                # Tab sorts before every character allowed in a key, so
+                # sorting the lines also sorts them by key.
+                for line in heapq.merge(*runs):
+                    f.write(line)
+                    count += 1
+        finally:
+            for run in runs:
+                run.close()
+        os.rename(tmp_path, path)
+    finally:
+        shutil.rmtree(run_dir)
+    return count
+
+
+class IndexedCitation(object):
+    """An opinion that has a citation in the index."""
+    def __init__(self, line):
+        _, opinion_id, cluster_id, date_filed, court_id = line.split('\t')
+        self.opinion_id = int(opinion_id)
+        self.cluster_id = int(cluster_id)
+        self.date_filed_ordinal = int(date_filed)
+        self.court_id = court_id.decode('utf-8')
+
+
+class CitationIndex(object):
+    """A read-only view of a citation index file."""
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files can't be memory-mapped.
+                self.mm = ''
+            else:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _find_first(self, key):
+        """Binary search for the offset of the first line with a key greater
+        than or equal to key.
+
+        lo and hi are always at the start of a line. Each pass looks at the
+        line containing the midpoint and moves one of them past or to it.
+        """
+        lo, hi = 0, len(self.mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.mm.rfind('\n', 0, mid) + 1
+            if self.mm[start:self.mm.find('\t', start)] < key:
+                lo = self.mm.find('\n', mid) + 1
+            else:
+                hi = start
+        return lo
+
+    def lookup(self, key):
+        """Get the opinions that have a citation.
+
+        :param key: A key made by normalize_citation.
+        :return: A list of IndexedCitation objects.
+        """
+        results = []
+        prefix = key + '\t'
+        position = self._find_first(key)
+        while self.mm[position:position + len(prefix)] == prefix:
+            end = self.mm.find('\n', position)
+            results.append(IndexedCitation(self.mm[position:end]))
+            position = end + 1
+        return results
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+
+
+_citation_index = None
+
+
+def get_citation_index(path=None):
+    """Get the citation index for this process, reopening it if the file was
+    rebuilt since it was last opened.
+
+    :param path: The path of the index. Defaults to the CITATION_INDEX_PATH
+    setting.
+    :return: A CitationIndex, or None if the index hasn't been built.
+    """
+    global _citation_index
+    path = path or settings.CITATION_INDEX_PATH
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _citation_index is None or _citation_index.path != path or \
+            _citation_index.mtime != mtime:
+        if _citation_index is not None:
+            _citation_index.close()
+        _citation_index = CitationIndex(path)
+    return _citation_index
@@ -0,0 +1,122 @@
+import re
+import time
+from collections import defaultdict
+
+from juriscraper.lib.html_utils import get_visible_text
+from reporters_db import EDITIONS, VARIATIONS_ONLY
+
+from cl.citations import reporter_tokenizer
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.search.models import Opinion
+
+# The lengths, in characters, that opinions are grouped by in the results.
+LENGTH_BUCKETS = (10000, 100000)
+
+
+def get_legacy_reporter_re():
+    """The tokenizer's previous approach: one alternation of every reporter,
+    from longest to shortest.
+    """
+    regex_list = EDITIONS.keys() + VARIATIONS_ONLY.keys()
+    regex_list.sort(key=len, reverse=True)
+    return re.compile("\s(%s)\s" % '|'.join(map(re.escape, regex_list)))
+
+
+def legacy_find_reporters(text, reporter_re):
+    """Tokenize a text and find the indexes of its reporters the way
+    get_citations used to.
+    """
+    if re.match('\d+\-[A-Za-z]+\-\d+', text):
+        words = text.split('-')
+    else:
+        words = []
+        for string in reporter_re.split(text):
+            if string in EDITIONS.keys() + VARIATIONS_ONLY.keys():
+                words.append(string)
+            else:
+                words.extend(reporter_tokenizer._tokenize(string))
+    indexes = [i for i in xrange(1, len(words) - 1) if
+               words[i] in (EDITIONS.keys() + VARIATIONS_ONLY.keys())]
+    return words, indexes
+
+
+def find_reporters(text):
+    words = reporter_tokenizer.tokenize(text)
+    indexes = [i for i in xrange(1, len(words) - 1) if
+               words[i] in reporter_tokenizer.REPORTER_STRINGS]
+    return words, indexes
+
+
+def get_text(opinion):
+    """Get the text of an opinion the same way get_document_citations does."""
+    html = opinion.html_columbia or opinion.html_lawbox or opinion.html
+    if html:
+        return get_visible_text(html)
+    return opinion.plain_text
+
+
+def get_bucket(text):
+    for limit in LENGTH_BUCKETS:
+        if len(text) < limit:
+            return '< %s chars' % limit
+    return '>= %s chars' % LENGTH_BUCKETS[-1]
+
+
+class Command(VerboseCommand):
+    help = ('Compare the speed of finding reporters in opinions with the '
+            'previous, regex-based tokenizer and with the current one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=500,
+            help="The number of opinions to use as the corpus.",
+        )
+        parser.add_argument(
+            '--start-id',
+            type=int,
+            default=0,
+            help="Use opinions starting at this id.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        opinions = Opinion.objects.filter(
+            pk__gte=options['start_id'],
+        ).order_by('pk')[:options['count']]
+        texts = [t for t in (get_text(o) for o in opinions) if t]
+        logger.info("Benchmarking with %s opinions." % len(texts))
+        reporter_re = get_legacy_reporter_re()
+
+        # Maps buckets to [chars, legacy seconds, current seconds, count]
+        results = defaultdict(lambda: [0, 0, 0, 0])
+        mismatches = 0
+        for text in texts:
+            t1 = time.time()
+            legacy = legacy_find_reporters(text, reporter_re)
+            t2 = time.time()
+            current = find_reporters(text)
+            t3 = time.time()
+            if legacy != current:
+                mismatches += 1
+            result = results[get_bucket(text)]
+            result[0] += len(text)
+            result[1] += t2 - t1
+            result[2] += t3 - t2
+            result[3] += 1
+
+        for bucket, (chars, legacy, current, count) in sorted(results.items()):
+            logger.info(
+                "  %s: %s opinions, legacy %.0f chars/sec, current %.0f "
+                "chars/sec, %.1fx faster" % (
+                    bucket, count,
+                    chars / (legacy or 1),
+                    chars / (current or 1),
+                    legacy / (current or 1),
+                ))
+        if mismatches:
+            logger.warn("  Tokens or reporters differed for %s opinions." %
+                        mismatches)
+        else:
+            logger.info("  Tokens and reporters were identical.")
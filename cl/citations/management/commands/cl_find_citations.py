@@ -2,6 +2,7 @@
 import time
 import sys
 
+from cl.citations.citation_index import build_citation_index
 from cl.citations.tasks import update_document
 from cl.lib import sunburnt
 from cl.lib.argparse_types import valid_date_time
@@ -74,6 +75,17 @@ class Command(VerboseCommand):
                   "'concurrently'."),
         )
 
+        parser.add_argument(
+            '--citation-index',
+            action='store_true',
+            default=False,
+            help="Build a local index of every citation in the database "
+                 "before starting, and match citations against it instead of "
+                 "Solr. Solr is only queried for citations that match more "
+                 "than one opinion. Building the index takes a pass over the "
+                 "opinions table, so this is worthwhile for large runs.",
+        )
+
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
         both_list_and_endpoints = (options.get('doc_id') is not None and
@@ -91,6 +103,12 @@ class Command(VerboseCommand):
                                'everything.')
 
         self.index = options['index']
+        self.use_citation_index = options['citation_index']
+        if self.use_citation_index:
+            logger.info("Building citation index at %s" %
+                        settings.CITATION_INDEX_PATH)
+            count = build_citation_index()
+            logger.info("Indexed %s citations." % count)
         self.si = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='rw')
 
         # Use query chaining to build the query
@@ -141,7 +159,8 @@ class Command(VerboseCommand):
         throttle = CeleryThrottle(min_items=500)
         for doc in documents:
             throttle.maybe_wait()
-            update_document.delay(doc, index_during_subtask)
+            update_document.delay(doc, index_during_subtask,
+                                  self.use_citation_index)
             processed_count += 1
             self.log_progress(processed_count, doc.pk)
 
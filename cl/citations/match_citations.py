@@ -6,8 +6,10 @@ from datetime import date, datetime
 from django.conf import settings
 from reporters_db import REPORTERS
 
+from cl.citations.citation_index import normalize_citation
 from cl.citations.find_citations import strip_punct
 from cl.lib import sunburnt
+from cl.lib.scorched_utils import get_solr_interface
 
 DEBUG = True
 
@@ -92,6 +94,50 @@ def get_years_from_reporter(citation):
     return start_year, end_year
 
 
+def get_year_range(citation, citing_doc=None):
+    """Get the years a citation could have been filed in."""
+    if citation.year:
+        return citation.year, citation.year
+    start_year, end_year = get_years_from_reporter(citation)
+    if citing_doc is not None and citing_doc.cluster.date_filed:
+        end_year = min(end_year, citing_doc.cluster.date_filed.year)
+    return start_year, end_year
+
+
+def match_citation_locally(citation, citation_index, citing_doc=None):
+    """Try to match a citation using the local citation index instead of Solr.
+
+    This applies the same filters as the first query in match_citation, so it
+    can settle citations that Solr would match to exactly one opinion.
+    Citations with no local match are left for match_citation too, since
+    Solr's analyzed phrase match on the citation field is looser than the
+    normalized keys of the index, as are ambiguous ones.
+
+    :param citation: A Citation object.
+    :param citation_index: A CitationIndex object.
+    :param citing_doc: The Opinion the citation was found in, if any.
+    :return: A list of dicts, each with the 'id' of a matching opinion, like
+    the results of a Solr query, or None if the citation needs to be matched
+    with Solr.
+    """
+    start_year, end_year = get_year_range(citation, citing_doc)
+    start = date(start_year, 1, 1).toordinal()
+    end = date(end_year, 12, 31).toordinal()
+    key = normalize_citation(citation.volume, citation.reporter, citation.page)
+    results = []
+    for item in citation_index.lookup(key):
+        if citing_doc is not None and item.opinion_id == citing_doc.pk:
+            continue
+        if not start <= item.date_filed_ordinal <= end:
+            continue
+        if citation.court and item.court_id != citation.court:
+            continue
+        results.append({'id': item.opinion_id})
+    if len(results) != 1:
+        return None
+    return results
+
+
 def match_citation(citation, citing_doc=None):
     """For a citation object, try to match it to an item in the database using
     a variety of heuristics.
@@ -99,8 +145,11 @@ def match_citation(citation, citing_doc=None):
     Returns:
       - a Solr Result object with the results, or an empty list if no hits
     """
-    # TODO: Create shared solr connection for all queries
-    conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
+    conn = get_solr_interface(
+        settings.SOLR_OPINION_URL,
+        mode='r',
+        interface_class=sunburnt.SolrInterface,
+    )
     main_params = {
         'q': '*',
         'fq': [
@@ -112,12 +161,7 @@ def match_citation(citation, citing_doc=None):
         # Eliminate self-cites.
         main_params['fq'].append('-id:%s' % citing_doc.pk)
     # Set up filter parameters
-    if citation.year:
-        start_year = end_year = citation.year
-    else:
-        start_year, end_year = get_years_from_reporter(citation)
-        if citing_doc is not None and citing_doc.cluster.date_filed:
-            end_year = min(end_year, citing_doc.cluster.date_filed.year)
+    start_year, end_year = get_year_range(citation, citing_doc)
     main_params['fq'].append(
         'dateFiled:%s' % build_date_range(start_year, end_year)
     )
@@ -8,12 +8,16 @@ import re
 
 from reporters_db import EDITIONS, VARIATIONS_ONLY
 
-# We need to build a REGEX that has all the variations and the reporters in
-# order from longest to shortest.
-REGEX_LIST = EDITIONS.keys() + VARIATIONS_ONLY.keys()
-REGEX_LIST.sort(key=len, reverse=True)
-REGEX_STR = '|'.join(map(re.escape, REGEX_LIST))
-REPORTER_RE = re.compile("\s(%s)\s" % REGEX_STR)
+TOKEN_RE = re.compile(r'\S+')
+
+# Every string that can be a reporter, and the longest number of tokens in any
+# of them (e.g. "U. S." has two).
+REPORTER_STRINGS = frozenset(EDITIONS.keys() + VARIATIONS_ONLY.keys())
+MAX_REPORTER_TOKENS = max(len(TOKEN_RE.findall(s)) for s in REPORTER_STRINGS)
+# The first token of every reporter. Most tokens aren't in this set, so it is
+# the only lookup they need.
+REPORTER_FIRST_TOKENS = frozenset(TOKEN_RE.findall(s)[0] for s in
+                                  REPORTER_STRINGS)
 
 
 def normalize_variation(string):
@@ -24,7 +28,7 @@ def normalize_variation(string):
     which is best. Usually, this can be accomplished using the year of the
     item.
     """
-    if string in VARIATIONS_ONLY.keys():
+    if string in VARIATIONS_ONLY:
         if len(VARIATIONS_ONLY[string]) == 1:
             # Simple case
             return VARIATIONS_ONLY[string][0]
@@ -39,27 +43,63 @@ def normalize_variation(string):
         return string
 
 
+def find_reporters(text):
+    """Find the spans of the reporters in a text in a single pass over its
+    tokens.
+
+    A reporter must have whitespace on each side of it, and a whitespace
+    character can only border one reporter. When reporters overlap, the one
+    that starts first wins, and at the same start, the longest wins.
+
+    :param text: The text to search.
+    :return: A list of (start, end) tuples, in order.
+    """
+    tokens = [(m.start(), m.end()) for m in TOKEN_RE.finditer(text)]
+    spans = []
+    # A reporter must start after its leading whitespace character, which
+    # can't be the trailing whitespace of the previous reporter.
+    min_start = 1
+    for i, (start, end) in enumerate(tokens):
+        if start < min_start or text[start:end] not in REPORTER_FIRST_TOKENS:
+            continue
+        for j in xrange(min(i + MAX_REPORTER_TOKENS, len(tokens)) - 1, i - 1,
+                        -1):
+            candidate_end = tokens[j][1]
+            if candidate_end < len(text) and \
+                    text[start:candidate_end] in REPORTER_STRINGS:
+                spans.append((start, candidate_end))
+                min_start = candidate_end + 2
+                break
+    return spans
+
+
 def tokenize(text):
-    """Tokenize text using regular expressions in the following steps:
-        - Split the text by the occurrences of patterns which match a federal
-          reporter, including the reporter strings as part of the resulting
-          list.
-        - Perform simple tokenization (whitespace split) on each of the
-          non-reporter strings in the list.
+    """Tokenize text in the following steps:
+        - Find the spans of the text that are reporters, keeping each of them
+          as a single word.
+        - Perform simple tokenization (whitespace split) on the text between
+          them.
 
        Example:
        >>>tokenize('See Roe v. Wade, 410 U. S. 113 (1973)')
-       ['See', 'Roe', 'v.', 'Wade,', '410', 'U.S.', '113', '(1973)']
+       ['See', 'Roe', 'v.', 'Wade,', '410', 'U. S.', '113', '(1973)']
     """
     # if the text looks likes the corner-case 'digit-REPORTER-digit', splitting
     # by spaces doesn't work
     if re.match('\d+\-[A-Za-z]+\-\d+', text):
         return text.split('-')
     # otherwise, we just split on spaces to find words
-    strings = REPORTER_RE.split(text)
+    strings = []
+    position = 0
+    for start, end in find_reporters(text):
+        # Leave out the whitespace on either side of the reporter.
+        strings.append(text[position:start - 1])
+        strings.append(text[start:end])
+        position = end + 1
+    strings.append(text[position:])
     words = []
     for string in strings:
-        if string in EDITIONS.keys() + VARIATIONS_ONLY.keys():
+        if string in REPORTER_STRINGS:
             words.append(string)
         else:
             # Normalize spaces
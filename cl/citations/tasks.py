@@ -1,9 +1,18 @@
 import re
+from collections import defaultdict
 from httplib import ResponseNotReady
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils.timezone import now
+
 from cl.celery import app
 from cl.citations import find_citations, match_citations
-from cl.search.models import Opinion, OpinionsCited
+from cl.citations.citation_index import get_citation_index
+from cl.search.models import Opinion, OpinionCluster, OpinionsCited, \
+    IndexChange
+from cl.search.tasks import add_or_update_opinions
 
 # This is the distance two reporter abbreviations can be from each other if they
 # are considered parallel reporters. For example, "22 U.S. 44, 46 (13 Atl. 33)"
@@ -81,67 +90,146 @@ def create_cited_html(opinion, citations):
     return new_html.encode('utf-8')
 
 
+def apply_citation_count_deltas(deltas):
+    """Change the citation counts of many clusters with a single UPDATE.
+
+    :param deltas: A dict mapping cluster ids to the amount their citation
+    counts should change by.
+    """
+    cluster_ids_by_delta = defaultdict(list)
+    for cluster_id, delta in deltas.items():
+        if delta:
+            cluster_ids_by_delta[delta].append(cluster_id)
+    if not cluster_ids_by_delta:
+        return
+    OpinionCluster.objects.filter(
+        pk__in=[pk for pks in cluster_ids_by_delta.values() for pk in pks],
+    ).update(
+        citation_count=F('citation_count') + Case(
+            *[When(pk__in=pks, then=Value(delta)) for delta, pks in
+              cluster_ids_by_delta.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        ),
+        # update() skips auto_now, and cl_update_index --datetime finds
+        # changed items by this field.
+        date_modified=now(),
+    )
+
+
+def update_citation_graph(opinion, cited_opinion_ids, index=True):
+    """Replace the opinions that an opinion cites, writing only the edges that
+    changed.
+
+    The citation counts of the clusters that gained or lost a citation are
+    updated in bulk, and their opinions are sent to Solr in a single batch.
+
+    :param opinion: The citing Opinion.
+    :param cited_opinion_ids: A set of the ids of the opinions it cites.
+    :param index: Whether to update Solr with the new citation counts.
+    :return: A set of the ids of the clusters whose citation counts changed.
+    """
+    old_ids = set(OpinionsCited.objects.filter(
+        citing_opinion_id=opinion.pk,
+    ).values_list('cited_opinion_id', flat=True))
+    added_ids = cited_opinion_ids - old_ids
+    removed_ids = old_ids - cited_opinion_ids
+
+    deltas = defaultdict(int)
+    for opinion_id, cluster_id in Opinion.objects.filter(
+            pk__in=added_ids | removed_ids).values_list('pk', 'cluster_id'):
+        deltas[cluster_id] += 1 if opinion_id in added_ids else -1
+    changed_cluster_ids = set(k for k, v in deltas.items() if v)
+
+    with transaction.atomic():
+        OpinionsCited.objects.filter(
+            citing_opinion_id=opinion.pk,
+            cited_opinion_id__in=removed_ids,
+        ).delete()
+        OpinionsCited.objects.bulk_create([
+            OpinionsCited(citing_opinion_id=opinion.pk, cited_opinion_id=pk)
+            for pk in added_ids
+        ])
+        apply_citation_count_deltas(deltas)
+        if settings.INDEX_CHANGE_LOG_ENABLED:
+            # Bulk updates don't send signals, so log the changes here.
+            IndexChange.objects.bulk_create([
+                IndexChange(item_type='search.OpinionCluster', item_pk=pk,
+                            reason=IndexChange.SAVE)
+                for pk in changed_cluster_ids
+            ])
+
+    if index and changed_cluster_ids and \
+            not settings.INDEX_CHANGE_LOG_ENABLED:
+        add_or_update_opinions.delay(list(Opinion.objects.filter(
+            cluster_id__in=changed_cluster_ids,
+        ).values_list('pk', flat=True)))
+    return changed_cluster_ids
+
+
 @app.task(bind=True, max_retries=5, ignore_result=True)
-def update_document(self, opinion, index=True):
+def update_document(self, opinion, index=True, use_citation_index=False):
     """Get the citations for an item and save it and add it to the index if
-    requested."""
+    requested.
+
+    If use_citation_index is True and the citation index has been built,
+    citations are looked up in it first, and Solr is only queried for the
+    ambiguous ones.
+    """
     citations = get_document_citations(opinion)
+    citation_index = None
+    if use_citation_index:
+        citation_index = get_citation_index()
 
-    # List used so we can do one simple update to the citing opinion.
-    opinions_cited = set()
+    # Pairs of citations and the id of the opinion they matched.
+    matched_citations = []
     for citation in citations:
-        try:
-            matches = match_citations.match_citation(
+        matches = None
+        if citation_index is not None:
+            matches = match_citations.match_citation_locally(
                 citation,
-                citing_doc=opinion
+                citation_index,
+                citing_doc=opinion,
             )
-        except ResponseNotReady as e:
-            # Threading problem in httplib, which is used in the Solr query.
-            raise self.retry(exc=e, countdown=2)
+        if matches is None:
+            try:
+                matches = match_citations.match_citation(
+                    citation,
+                    citing_doc=opinion
+                )
+            except ResponseNotReady as e:
+                # Threading problem in httplib, which is used in the Solr
+                # query.
+                raise self.retry(exc=e, countdown=2)
 
         # TODO: Figure out what to do if there's more than one
         if len(matches) == 1:
-            match_id = matches[0]['id']
-            try:
-                matched_opinion = Opinion.objects.get(pk=match_id)
-
-                # Increase citation count for matched cluster if it hasn't
-                # already been cited by this opinion.
-                if matched_opinion not in opinion.opinions_cited.all():
-                    matched_opinion.cluster.citation_count += 1
-                    matched_opinion.cluster.save(index=index)
-
-                # Add citation match to the citing opinion's list of cases it
-                # cites. opinions_cited is a set so duplicates aren't an issue
-                opinions_cited.add(matched_opinion.pk)
-
-                # URL field will be used for generating inline citation html
-                citation.match_url = matched_opinion.cluster.get_absolute_url()
-                citation.match_id = matched_opinion.pk
-            except Opinion.DoesNotExist:
-                # No Opinions returned. Press on.
-                continue
-            except Opinion.MultipleObjectsReturned:
-                # Multiple Opinions returned. Press on.
-                continue
+            matched_citations.append((citation, int(matches[0]['id'])))
         else:
             # No match found for citation
             #create_stub([citation])
             pass
 
+    matched_opinions = Opinion.objects.select_related('cluster').in_bulk(
+        [match_id for _, match_id in matched_citations]
+    )
+    # Set used so we can do one simple update to the citing opinion.
+    opinions_cited = set()
+    for citation, match_id in matched_citations:
+        matched_opinion = matched_opinions.get(match_id)
+        if matched_opinion is None:
+            # The match is in Solr but not the DB. Press on.
+            continue
+        opinions_cited.add(matched_opinion.pk)
+
+        # URL field will be used for generating inline citation html
+        citation.match_url = matched_opinion.cluster.get_absolute_url()
+        citation.match_id = matched_opinion.pk
+
     # Only update things if we found citations
     if citations:
         opinion.html_with_citations = create_cited_html(opinion, citations)
-
-        # Nuke existing citations
-        OpinionsCited.objects.filter(citing_opinion_id=opinion.pk).delete()
-
-        # Create the new ones.
-        OpinionsCited.objects.bulk_create([
-            OpinionsCited(citing_opinion_id=opinion.pk,
-                          cited_opinion_id=pk) for
-            pk in opinions_cited
-        ])
+        update_citation_graph(opinion, opinions_cited, index=index)
 
     # Update Solr if requested. In some cases we do it at the end for
     # performance reasons.
@@ -149,6 +237,6 @@ def update_document(self, opinion, index=True):
 
 
 @app.task(ignore_result=True)
-def update_document_by_id(opinion_id, index=True):
+def update_document_by_id(opinion_id, index=True, use_citation_index=False):
     op = Opinion.objects.get(pk=opinion_id)
-    update_document(op, index=index)
+    update_document(op, index=index, use_citation_index=use_citation_index)
@@ -1,21 +1,30 @@
 # coding=utf-8
+import os
+import shutil
+import tempfile
 from datetime import date
 
 from django.core.management import call_command
 from django.core.urlresolvers import reverse
-from django.test import TestCase, SimpleTestCase
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.utils.timezone import now
 from lxml import etree
 from reporters_db import REPORTERS
 
+from cl.citations.citation_index import build_citation_index, \
+    normalize_citation, normalize_citation_string, CitationIndex
 from cl.citations.find_citations import get_citations, is_date_in_reporter, \
     Citation
 from cl.citations.management.commands.cl_add_parallel_citations import \
     identify_parallel_citations, make_edge_list
-from cl.citations.match_citations import match_citation
-from cl.citations.reporter_tokenizer import tokenize
-from cl.citations.tasks import update_document, create_cited_html
+from cl.citations.match_citations import match_citation, \
+    match_citation_locally
+from cl.citations.reporter_tokenizer import tokenize, find_reporters
+from cl.citations.tasks import update_document, create_cited_html, \
+    update_citation_graph
 from cl.lib.test_helpers import IndexedSolrTestCase
-from cl.search.models import Opinion, OpinionsCited, OpinionCluster
+from cl.search.models import Opinion, OpinionsCited, OpinionCluster, \
+    IndexChange
 
 
 def remove_citations_from_imported_fixtures():
@@ -42,6 +51,12 @@ class CiteTest(TestCase):
         self.assertEqual(tokenize('Failed to recognize 1993 Ct. Sup. 5243-P'),
                          ['Failed', 'to', 'recognize', '1993', 'Ct. Sup.',
                           '5243-P'])
+        # Reporters need whitespace on both sides, and adjacent reporters
+        # can't share it.
+        self.assertEqual(tokenize('U.S. 1 U.S. F.2d 2'),
+                         ['U.S.', '1', 'U.S.', 'F.2d', '2'])
+        self.assertEqual(find_reporters('U.S. 1 U.S. F.2d 2'), [(7, 11)])
+        self.assertEqual(find_reporters('1 U.S.'), [])
 
     def test_find_citations(self):
         """Can we find and make Citation objects from strings?"""
@@ -310,6 +325,108 @@ class MatchingTest(IndexedSolrTestCase):
         self.assertEqual([], results)
 
 
+@override_settings(INDEX_CHANGE_LOG_ENABLED=True)
+class CitationGraphTest(TestCase):
+    fixtures = ['test_court.json', 'judge_judy.json',
+                'test_objects_search.json']
+
+    def setUp(self):
+        remove_citations_from_imported_fixtures()
+        IndexChange.objects.all().delete()
+        self.citing = Opinion.objects.get(pk=3)
+
+    def assertCitationCounts(self, expected):
+        self.assertEqual(expected, dict(
+            OpinionCluster.objects.values_list('pk', 'citation_count')))
+
+    def test_updating_the_graph(self):
+        """Are only the changed edges written, and are counts adjusted in
+        both directions?
+        """
+        before = now()
+        changed = update_citation_graph(self.citing, {2, 4, 5}, index=False)
+        self.assertEqual({1, 2}, changed)
+        self.assertCitationCounts({1: 2, 2: 1, 3: 0})
+        # So that cl_update_index --datetime finds them.
+        self.assertEqual({1, 2}, set(OpinionCluster.objects.filter(
+            date_modified__gte=before,
+        ).values_list('pk', flat=True)))
+        self.assertEqual(2, IndexChange.objects.filter(
+            item_type='search.OpinionCluster').count())
+
+        changed = update_citation_graph(self.citing, {1, 4}, index=False)
+        self.assertEqual({2}, changed)
+        self.assertCitationCounts({1: 2, 2: 0, 3: 0})
+        self.assertEqual({1, 4}, set(OpinionsCited.objects.filter(
+            citing_opinion=self.citing,
+        ).values_list('cited_opinion_id', flat=True)))
+
+    def test_unchanged_graph(self):
+        """If nothing changed, are the counts left alone?"""
+        update_citation_graph(self.citing, {2}, index=False)
+        IndexChange.objects.all().delete()
+
+        changed = update_citation_graph(self.citing, {2}, index=False)
+        self.assertEqual(set(), changed)
+        self.assertCitationCounts({1: 0, 2: 1, 3: 0})
+        self.assertFalse(IndexChange.objects.exists())
+
+
+class CitationIndexTest(TestCase):
+    fixtures = ['test_court.json', 'judge_judy.json',
+                'test_objects_search.json']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'citation-index.txt')
+        build_citation_index(self.path)
+        self.index = CitationIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_normalizing_citations(self):
+        """Do differently formatted citations get the same key?"""
+        self.assertEqual(normalize_citation(410, 'U. S.', '113'),
+                         normalize_citation_string('410 U.S. 113'))
+        self.assertEqual(normalize_citation(1, 'Yeates', '1'),
+                         normalize_citation_string('1 Yeates 1 (test 1795)'))
+        self.assertIsNone(normalize_citation_string('44'))
+
+    def test_lookup(self):
+        """Can precedential opinions be found by their citations?"""
+        results = self.index.lookup(normalize_citation(9, 'F.', '1'))
+        self.assertEqual([2], [r.opinion_id for r in results])
+        self.assertEqual('test', results[0].court_id)
+        results = self.index.lookup(normalize_citation(22, 'Fed.', '1'))
+        self.assertEqual([3], [r.opinion_id for r in results])
+        # Every cluster has this citation, but errata aren't indexed.
+        results = self.index.lookup(normalize_citation(33, 'state', '1'))
+        self.assertEqual({2, 3}, {r.opinion_id for r in results})
+
+    def test_matching_locally(self):
+        """Do local matches agree with Solr's?"""
+        citation = get_citations('9 F. 1 (1795)')[0]
+        self.assertEqual([{'id': 2}],
+                         match_citation_locally(citation, self.index))
+        # Citations without a local match are left for Solr, whether they
+        # were filtered out by year or aren't in the index at all. See
+        # test_citation_matching_issue621.
+        citation = get_citations('9 F. 1 (1796)')[0]
+        self.assertIsNone(match_citation_locally(citation, self.index))
+        citation = get_citations('1 F. 9 (1795)')[0]
+        self.assertIsNone(match_citation_locally(citation, self.index))
+
+    def test_building_from_several_runs(self):
+        """Is the index sorted when it's merged from several sorted runs?"""
+        count = build_citation_index(self.path, run_size=2)
+        with open(self.path) as f:
+            lines = f.readlines()
+        self.assertEqual(count, len(lines))
+        self.assertEqual(sorted(lines), lines)
+
+
 class CitationFeedTest(IndexedSolrTestCase):
 
     def _tree_has_content(self, content, expected_count):
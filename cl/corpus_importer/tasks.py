@@ -30,8 +30,10 @@ from rest_framework.status import (
 
 from cl.celery import app
 from cl.custom_filters.templatetags.text_filters import best_case_name
+from cl.lib.http_pool import get_session, mount_pooled_adapter
 from cl.lib.pacer import PacerXMLParser, lookup_and_save, get_blocked_status, \
-    map_pacer_to_cl_id, map_cl_to_pacer_id, get_first_missing_de_number
+    map_pacer_to_cl_id, map_cl_to_pacer_id, get_first_missing_de_number, \
+    get_pacer_url
 from cl.lib.recap_utils import get_document_filename, get_bucket_name
 from cl.recap.models import FjcIntegratedDatabase, PacerHtmlFiles, DOCKET
 from cl.recap.tasks import update_docket_metadata, add_parties_and_attorneys, \
@@ -53,7 +55,7 @@ def download_recap_item(self, url, filename, clobber=False):
     try:
         if os.path.isfile(location) and not clobber:
             raise IOError("    IOError: File already exists at %s" % location)
-        r = requests.get(
+        r = get_session(url).get(
             url,
             stream=True,
             timeout=60,
@@ -113,6 +115,7 @@ def parse_recap_docket(self, filename, debug=False):
 def get_free_document_report(self, court_id, start, end, session):
     """Get structured results from the PACER free document report"""
     report = FreeOpinionReport(court_id, session)
+    mount_pooled_adapter(session, get_pacer_url(court_id), retry_statuses=())
     try:
         report.query(start, end, sort='case_number')
     except (ConnectionError, ChunkedEncodingError, ReadTimeoutError,
@@ -140,6 +143,7 @@ def get_and_save_free_document_report(self, court_id, start, end, session):
     :return: None
     """
     report = FreeOpinionReport(court_id, session)
+    mount_pooled_adapter(session, get_pacer_url(court_id), retry_statuses=())
     try:
         report.query(start, end, sort='case_number')
     except (ConnectionError, ChunkedEncodingError, ReadTimeoutError,
@@ -260,6 +264,9 @@ def get_and_process_pdf(self, data, session, row_pk, index=False):
     result = data['result']
     rd = RECAPDocument.objects.get(pk=data['rd_pk'])
     report = FreeOpinionReport(data['pacer_court_id'], session)
+    # Bad statuses are retried by the task, so only retry connection errors.
+    mount_pooled_adapter(session, get_pacer_url(data['pacer_court_id']),
+                         retry_statuses=())
     try:
         r = report.download_pdf(result.pacer_case_id, result.pacer_doc_id)
     except (ConnectTimeout, ConnectionError, ReadTimeout, ReadTimeoutError,
@@ -1,5 +1,9 @@
 from datetime import timedelta
 
+from django.db.models import Case, Max, Min, Value, When
+
+from cl.lib.utils import chunks
+
 
 def queryset_generator(queryset, chunksize=1000):
     """
@@ -73,3 +77,67 @@ def queryset_generator_by_date(queryset, date_field, start_date, end_date,
         top_date = top_date + chunksize
         for row in queryset.filter(**keywords):
             yield row
+
+
+def get_pk_ranges(queryset, count):
+    """Split the primary key space of a queryset into contiguous ranges.
+
+    The ranges are split evenly by primary key, not by number of rows, which
+    avoids an expensive count or ordered scan of the table. Gaps in the key
+    space mean that some ranges can have more rows than others.
+
+    :param queryset: The queryset whose primary keys should be split.
+    :param count: The number of ranges to create.
+    :return: A list of (first_pk, last_pk) tuples, inclusive on both ends. If
+    the queryset is empty, returns an empty list.
+    """
+    pks = queryset.aggregate(Min('pk'), Max('pk'))
+    lowest_pk, highest_pk = pks['pk__min'], pks['pk__max']
+    if lowest_pk is None:
+        return []
+
+    span = highest_pk - lowest_pk + 1
+    count = max(1, min(count, span))
+    step = span // count
+    ranges = []
+    for i in range(count):
+        first_pk = lowest_pk + i * step
+        if i == count - 1:
+            last_pk = highest_pk
+        else:
+            last_pk = first_pk + step - 1
+        ranges.append((first_pk, last_pk))
+    return ranges
+
+
+def bulk_update(objs, fields, batch_size=500):
+    """Save some fields of many objects of one model with a single UPDATE per
+    batch, instead of one per object.
+
+    Like bulk_create, this doesn't call save() or send the pre_save and
+    post_save signals, so auto_now fields aren't updated unless they are set
+    and included in fields.
+
+    :param objs: A list of saved objects of the same model.
+    :param fields: The names of the fields to save.
+    :param batch_size: The most objects to update in one query.
+    :return: The number of rows updated.
+    """
+    if not objs:
+        return 0
+    model = type(objs[0])
+    model_fields = [model._meta.get_field(name) for name in fields]
+    updated = 0
+    for batch in chunks(objs, batch_size):
+        values = {}
+        for field in model_fields:
+            values[field.attname] = Case(
+                *[When(pk=obj.pk, then=Value(getattr(obj, field.attname),
+                                             output_field=field))
+                  for obj in batch],
+                output_field=field
+            )
+        updated += model.objects.filter(
+            pk__in=[obj.pk for obj in batch],
+        ).update(**values)
+    return updated
@@ -0,0 +1,111 @@
+"""Keep a directory of cache files under a size limit, without scanning it on
+every write.
+
+The size of each cache is tracked approximately in a file inside it, which
+writers add the size of each new file to. Only when that total crosses the
+limit is the directory scanned, the least recently modified files deleted,
+and the total reset to the real size. Eviction goes down to a fraction of the
+limit, so that scans happen rarely, not on every write once the cache is
+full.
+
+Overwritten and evicted files can make the total drift from the real size,
+but it only ever drifts upwards, which makes scans happen earlier than they
+need to, never later.
+
+Files are written to a temporary directory inside the cache and then moved
+into place. Eviction leaves that directory alone, so files aren't deleted
+while they're being written.
+"""
+import fcntl
+import os
+import tempfile
+
+from cl.lib.utils import mkdir_p
+
+SIZE_FILE_NAME = '.size'
+TEMP_DIR_NAME = '.tmp'
+# After evicting, the cache is this fraction of its limit.
+LOW_WATER_MARK = 0.9
+
+
+def get_size_path(cache_dir):
+    return os.path.join(cache_dir, SIZE_FILE_NAME)
+
+
+def make_temp_file(cache_dir):
+    """Make a temporary file to write a cache file to before moving it into
+    place, where eviction won't delete it.
+
+    :param cache_dir: The cache directory.
+    :return: A tuple of an open file descriptor and the path of the file, as
+    returned by tempfile.mkstemp.
+    """
+    temp_dir = os.path.join(cache_dir, TEMP_DIR_NAME)
+    mkdir_p(temp_dir)
+    return tempfile.mkstemp(dir=temp_dir)
+
+
+def record_write(cache_dir, size, max_bytes):
+    """Add the size of a new file to a cache's total, evicting old files if
+    the total is over the limit.
+
+    :param cache_dir: The cache directory, which must exist.
+    :param size: The size of the file that was written, in bytes.
+    :param max_bytes: The size limit of the cache.
+    :return: The number of files deleted.
+    """
+    with open(get_size_path(cache_dir), 'a+') as f:
+        # Writers in other processes wait here, so the total isn't lost to
+        # concurrent updates, and only one of them evicts.
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        try:
+            total = int(f.read() or 0)
+        except ValueError:
+            total = max_bytes
+        total += size
+        deleted = 0
+        if total > max_bytes:
+            deleted, total = evict(cache_dir, int(max_bytes * LOW_WATER_MARK))
+        f.seek(0)
+        f.truncate()
+        f.write(str(total))
+    return deleted
+
+
+def evict(cache_dir, max_bytes):
+    """Delete the least recently modified files until the cache is no bigger
+    than max_bytes.
+
+    :return: A tuple of the number of files deleted and the size of the
+    cache afterwards.
+    """
+    entries = []
+    total = 0
+    for root, dirnames, filenames in os.walk(cache_dir):
+        if root == cache_dir and TEMP_DIR_NAME in dirnames:
+            # Files that are still being written.
+            dirnames.remove(TEMP_DIR_NAME)
+        for filename in filenames:
+            if filename == SIZE_FILE_NAME:
+                continue
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Deleted by another process.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    deleted = 0
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+        deleted += 1
+    return deleted, total
@@ -0,0 +1,100 @@
+"""A content-addressed cache of extracted text, stored on local disk.
+
+The same file often gets extracted more than once. RECAP documents are
+uploaded again, and free documents on PACER are downloaded by several
+importers. Extracting them can mean running pdftotext, antiword or wpd2html,
+and OCR can take minutes per document. This cache maps a file's sha1 to the
+results of extracting it, so that identical files are only extracted once.
+
+Entries are JSON files. Reading an entry updates its modification time, and
+when the cache grows beyond its size limit, the least recently used entries
+are deleted. See cl.lib.disk_cache.
+"""
+import hashlib
+import json
+import os
+
+from django.conf import settings
+
+from cl.lib.disk_cache import make_temp_file, record_write
+from cl.lib.utils import mkdir_p
+
+
+def get_file_sha1(path):
+    """Get the sha1 of a file without reading it into memory all at once.
+
+    :param path: The path to the file.
+    :return: The hex digest of the file's sha1.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def get_entry_path(cache_dir, namespace, sha1):
+    # Spread entries across subdirectories, so no one directory gets huge.
+    return os.path.join(cache_dir, namespace, sha1[:2], '%s.json' % sha1)
+
+
+def get_cached_extraction(namespace, sha1, cache_dir=None):
+    """Get the results of extracting a file, if they are in the cache.
+
+    :param namespace: Which kind of extraction the results came from, like
+    "opinion" or "recap". Different kinds may clean up text differently, so
+    they are kept apart.
+    :param sha1: The sha1 of the file.
+    :param cache_dir: The cache directory. Defaults to the
+    EXTRACTION_CACHE_DIR setting.
+    :return: The dict that was cached, or None if there isn't one or the cache
+    is disabled.
+    """
+    cache_dir = cache_dir or settings.EXTRACTION_CACHE_DIR
+    if not cache_dir or not sha1:
+        return None
+    path = get_entry_path(cache_dir, namespace, sha1)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        # Mark the entry as recently used.
+        os.utime(path, None)
+    except (IOError, OSError, ValueError):
+        return None
+    return data
+
+
+def cache_extraction(namespace, sha1, data, cache_dir=None, max_bytes=None):
+    """Save the results of extracting a file, evicting old entries if the
+    cache has grown too big.
+
+    :param namespace: See get_cached_extraction.
+    :param sha1: The sha1 of the file.
+    :param data: A dict of JSON serializable values.
+    :param cache_dir: The cache directory. Defaults to the
+    EXTRACTION_CACHE_DIR setting.
+    :param max_bytes: The size limit of the cache. Defaults to the
+    EXTRACTION_CACHE_MAX_BYTES setting.
+    :return: True if the results were cached, else False.
+    """
+    cache_dir = cache_dir or settings.EXTRACTION_CACHE_DIR
+    if not cache_dir or not sha1:
+        return False
+    try:
+        content = json.dumps(data)
+    except UnicodeDecodeError:
+        # Text that isn't valid utf-8 isn't worth caching.
+        return False
+
+    path = get_entry_path(cache_dir, namespace, sha1)
+    mkdir_p(os.path.dirname(path))
+    # Write to a temporary file and move it into place, so that other
+    # processes never read half an entry.
+    fd, tmp_path = make_temp_file(cache_dir)
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    os.rename(tmp_path, path)
+
+    record_write(cache_dir, len(content),
+                 max_bytes or settings.EXTRACTION_CACHE_MAX_BYTES)
+    return True
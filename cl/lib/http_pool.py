@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import threading
+from urlparse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from cl.lib.disk_cache import make_temp_file, record_write
+
+# The most connections kept open to a single host.
+POOL_MAXSIZE = 4
+
+# How failed requests are retried. Sleeps between retries grow as
+# backoff_factor * 2 ** (retry number - 1) seconds.
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (502, 503, 504)
+
+
+def make_retry(statuses=RETRY_STATUSES):
+    """Make the retry policy used by pooled adapters.
+
+    :param statuses: The HTTP statuses to retry, in addition to connection
+    errors. Pass an empty tuple if the caller handles bad statuses itself.
+    """
+    return Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=statuses,
+    )
+
+
+def get_prefix(url):
+    """Get the part of a URL that requests uses to pick an adapter, e.g.
+    "https://www.example.com/".
+    """
+    parsed = urlparse(url)
+    return '%s://%s/' % (parsed.scheme, parsed.netloc)
+
+
+_adapters = {}
+_adapters_lock = threading.Lock()
+_adapters_pid = None
+
+
+def get_adapter(url, key=None, adapter_factory=None,
+                retry_statuses=RETRY_STATUSES):
+    """Get the pooled adapter for a host, making it if needed.
+
+    Connection pools live in adapters rather than in sessions, and they are
+    thread safe. Sharing one adapter per host across requests, sessions and
+    threads means keep-alive connections get reused, instead of every
+    download paying for a new TCP and TLS handshake.
+
+    :param url: A URL on the host.
+    :param key: Adapters made by different factories must be kept apart, so
+    callers that pass adapter_factory should also pass a key for it, like a
+    court id.
+    :param adapter_factory: A function that returns a new HTTPAdapter, for
+    hosts that need special handling. Defaults to a plain HTTPAdapter.
+    :param retry_statuses: The HTTP statuses to retry. See make_retry.
+    :return: An HTTPAdapter.
+    """
+    global _adapters_pid
+    cache_key = (get_prefix(url), key, tuple(retry_statuses))
+    with _adapters_lock:
+        if _adapters_pid != os.getpid():
+            # Connections can't be shared with a parent process.
+            _adapters.clear()
+            _adapters_pid = os.getpid()
+        adapter = _adapters.get(cache_key)
+        if adapter is None:
+            if adapter_factory is None:
+                adapter = HTTPAdapter(pool_maxsize=POOL_MAXSIZE)
+            else:
+                adapter = adapter_factory()
+            adapter.max_retries = make_retry(retry_statuses)
+            _adapters[cache_key] = adapter
+    return adapter
+
+
+def mount_pooled_adapter(session, url, **kwargs):
+    """Make a session use the pooled adapter for a URL's host.
+
+    :param session: A requests Session, or a subclass of one, such as a
+    PacerSession.
+    :param url: A URL on the host.
+    :param kwargs: Passed to get_adapter.
+    :return: The session.
+    """
+    session.mount(get_prefix(url), get_adapter(url, **kwargs))
+    return session
+
+
+def get_session(url, adapter=None, **kwargs):
+    """Get a session that uses the pooled adapter for a URL's host.
+
+    Sessions are cheap to make and not safe to share across threads, so each
+    caller gets its own, while the connections underneath are shared.
+
+    :param url: A URL on the host the session will be used for.
+    :param adapter: An adapter to use for the host instead of looking it up.
+    :param kwargs: Passed to get_adapter.
+    :return: A requests Session.
+    """
+    session = requests.Session()
+    if adapter is not None:
+        session.mount(get_prefix(url), adapter)
+    else:
+        mount_pooled_adapter(session, url, **kwargs)
+    return session
+
+
+def get_cache_paths(cache_dir, url):
+    name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return (os.path.join(cache_dir, '%s.json' % name),
+            os.path.join(cache_dir, '%s.body' % name))
+
+
+def conditional_get(session, url, cache_dir, max_bytes=None, **kwargs):
+    """GET a URL, using a local cache of earlier responses and conditional
+    requests so that unchanged content isn't downloaded again.
+
+    Responses with an ETag or a Last-Modified header are saved in cache_dir.
+    Later requests for the same URL send If-None-Match or If-Modified-Since,
+    and a 304 Not Modified response is answered from the cache. When the
+    cache grows beyond max_bytes, the least recently used responses are
+    deleted. See cl.lib.disk_cache.
+
+    :param session: The session to make the request with.
+    :param url: The URL to get.
+    :param cache_dir: The directory for cached responses.
+    :param max_bytes: The size limit of the cache. Defaults to the
+    HTTP_CACHE_MAX_BYTES setting.
+    :param kwargs: Passed to session.get.
+    :return: A requests Response. Responses answered from the cache have a
+    status of 200 and a from_cache attribute of True.
+    """
+    meta_path, body_path = get_cache_paths(cache_dir, url)
+    headers = dict(kwargs.pop('headers', None) or {})
+    conditional_headers = dict(headers)
+    meta = None
+    if os.path.isfile(body_path):
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (IOError, ValueError):
+            pass
+    if meta is not None:
+        if meta.get('etag'):
+            conditional_headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            conditional_headers['If-Modified-Since'] = meta['last_modified']
+
+    r = session.get(url, headers=conditional_headers, **kwargs)
+    r.from_cache = False
+    if r.status_code == requests.codes.not_modified and meta is not None:
+        try:
+            with open(body_path, 'rb') as f:
+                content = f.read()
+        except IOError:
+            # The body was evicted since it was checked for, so ask for the
+            # whole response.
+            r = session.get(url, headers=headers, **kwargs)
+            r.from_cache = False
+        else:
+            r._content = content
+            r.status_code = requests.codes.ok
+            r.from_cache = True
+            # Mark the response as recently used.
+            for path in (meta_path, body_path):
+                try:
+                    os.utime(path, None)
+                except OSError:
+                    pass
+            return r
+
+    if r.status_code == requests.codes.ok and \
+            (r.headers.get('ETag') or r.headers.get('Last-Modified')):
+        # Write to temporary files and move them into place, so that other
+        # processes never read half a file.
+        size = 0
+        for path, mode, content in (
+                (body_path, 'wb', r.content),
+                (meta_path, 'w', json.dumps({
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                }))):
+            fd, tmp_path = make_temp_file(cache_dir)
+            with os.fdopen(fd, mode) as f:
+                f.write(content)
+            os.rename(tmp_path, path)
+            size += len(content)
+        record_write(cache_dir, size,
+                     max_bytes or settings.HTTP_CACHE_MAX_BYTES)
+    return r
@@ -56,6 +56,11 @@ def map_cl_to_pacer_id(cl_id):
         return cl_to_pacer_ids.get(cl_id, cl_id)
 
 
+def get_pacer_url(pacer_court_id):
+    """Get the root URL of a court's PACER site."""
+    return 'https://ecf.%s.uscourts.gov/' % pacer_court_id
+
+
 def lookup_and_save(new, debug=False):
     """Merge new docket info into the database.
 
@@ -0,0 +1,165 @@
+"""Pagerank over a sparse, compressed representation of a citation graph.
+
+Holding a graph as a list of Python tuples takes around a hundred bytes per
+edge, before igraph makes its own copy. Here, edges are read in chunks into
+numpy arrays and turned into compressed sparse rows (CSR), indexed by the
+cited node, which takes eight bytes per edge and node. Pagerank is then
+computed by power iteration, which can start from the scores of an earlier
+run. When only a few edges have changed since then, it converges in a few
+iterations instead of dozens.
+
+Scores match igraph's: nodes are numbered from zero to the largest id in the
+graph, and the scores of nodes without outgoing edges are spread evenly
+across all nodes.
+"""
+import os
+
+import numpy as np
+
+DAMPING = 0.85
+MAX_ITERATIONS = 100
+# The largest total change in scores between two iterations that counts as
+# converged.
+TOLERANCE = 1e-10
+
+
+class CSRGraph(object):
+    def __init__(self, indptr, indices, out_degree):
+        """
+        :param indptr: The edges into node i are indices[indptr[i]:indptr[i +
+        1]].
+        :param indices: The citing node of each edge, grouped by cited node.
+        :param out_degree: The number of edges out of each node.
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.out_degree = out_degree
+
+    @property
+    def node_count(self):
+        return len(self.out_degree)
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + \
+            self.out_degree.nbytes
+
+
+def make_csr_graph(edge_chunks):
+    """Build a CSRGraph from chunks of (citing, cited) edges.
+
+    :param edge_chunks: An iterable of lists of (citing, cited) pairs of
+    non-negative ints.
+    :return: A CSRGraph.
+    """
+    sources, targets = [], []
+    for chunk in edge_chunks:
+        if len(chunk) == 0:
+            continue
+        a = np.array(chunk, dtype=np.int64).reshape(-1, 2)
+        sources.append(a[:, 0].astype(np.int32))
+        targets.append(a[:, 1].astype(np.int32))
+    if not sources:
+        empty = np.zeros(0, dtype=np.int32)
+        return CSRGraph(np.zeros(1, dtype=np.int64), empty, empty)
+    sources = np.concatenate(sources)
+    targets = np.concatenate(targets)
+
+    node_count = int(max(sources.max(), targets.max())) + 1
+    out_degree = np.bincount(sources, minlength=node_count).astype(np.int32)
+    in_degree = np.bincount(targets, minlength=node_count)
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(in_degree, out=indptr[1:])
+    # Group the citing nodes by the node they cite.
+    indices = sources[np.argsort(targets, kind='mergesort')]
+    return CSRGraph(indptr, indices, out_degree)
+
+
+def pagerank(graph, initial=None, damping=DAMPING,
+             max_iterations=MAX_ITERATIONS, tolerance=TOLERANCE):
+    """Compute the pagerank of every node in a graph.
+
+    :param graph: A CSRGraph.
+    :param initial: Scores to start from, such as those of an earlier run, as
+    an array with a score for every node. Defaults to even scores.
+    :return: A tuple of an array of scores, which sum to one, and the number
+    of iterations it took.
+    """
+    n = graph.node_count
+    if n == 0:
+        return np.zeros(0), 0
+    if initial is None or initial.sum() <= 0:
+        scores = np.full(n, 1.0 / n)
+    else:
+        scores = initial / initial.sum()
+
+    dangling = graph.out_degree == 0
+    out_degree = np.where(dangling, 1, graph.out_degree).astype(np.float64)
+    has_in_edges = graph.indptr[1:] > graph.indptr[:-1]
+    starts = graph.indptr[:-1][has_in_edges]
+
+    iterations = 0
+    for iterations in range(1, max_iterations + 1):
+        contributions = (scores / out_degree)[graph.indices]
+        incoming = np.zeros(n)
+        if len(contributions):
+            incoming[has_in_edges] = np.add.reduceat(contributions, starts)
+        leaked = scores[dangling].sum()
+        new_scores = damping * incoming + \
+            (damping * leaked + 1.0 - damping) / n
+        change = np.abs(new_scores - scores).sum()
+        scores = new_scores
+        if change < tolerance:
+            break
+    return scores, iterations
+
+
+def read_scores(path, node_count):
+    """Read the scores of a pagerank file, to start a new run from.
+
+    :param path: The path of a file of "pk=score" lines.
+    :param node_count: The number of nodes in the new graph.
+    :return: An array of scores, with the average of the old scores for
+    nodes that weren't in the file, or None if there is no file.
+    """
+    if not os.path.exists(path):
+        return None
+    scores = np.full(node_count, np.nan)
+    with open(path) as f:
+        for line in f:
+            pk, _, score = line.partition('=')
+            pk = int(pk)
+            if pk < node_count:
+                scores[pk] = float(score)
+    known = ~np.isnan(scores)
+    if not known.any():
+        return None
+    scores[~known] = scores[known].mean()
+    return scores
+
+
+def write_scores(path, scores, pks):
+    """Write a pagerank file that Solr can use.
+
+    Solr uses a file of the form:
+
+        1=0.387789712299
+        2=0.214810626172
+        3=0.397399661529
+
+    The IDs must be sorted for performance, and every ID should be listed.
+    The file is written to a temporary file and then moved into place, so Solr
+    never reads half a file.
+
+    :param path: Where to write the file.
+    :param scores: An array of scores, indexed by pk.
+    :param pks: The pks to write, in ascending order. Pks beyond the end of
+    the scores, which have no citations, get the lowest score.
+    """
+    min_value = scores.min() if len(scores) else 0.0
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        for pk in pks:
+            score = scores[pk] if pk < len(scores) else min_value
+            f.write('{}={}\n'.format(pk, float(score)))
+    os.rename(temp_path, path)
@@ -0,0 +1,299 @@
+"""Fast, partial parsing of PDFs.
+
+PyPDF2 parses a PDF's entire cross-reference structure in pure Python before
+it can say anything about the file. To count pages, only a few objects are
+needed: the trailer, which points to the document catalog, the catalog, which
+points to the root of the page tree, and the root of the page tree, which has
+the number of pages. This module finds those objects through the file's
+cross-reference tables or streams, reading the file through a memory map so
+that only the parts that are looked at get read from disk.
+
+Files that don't fit this approach, like those using filters other than
+FlateDecode for their cross-reference streams, raise a PDFParseError, and
+callers should fall back to a full parser.
+"""
+import mmap
+import re
+import zlib
+
+
+class PDFParseError(Exception):
+    pass
+
+
+startxref_re = re.compile(r'startxref\s+(\d+)')
+subsection_re = re.compile(r'\s*(\d+)\s+(\d+)[ \t]*(?:\r\n|\r|\n)')
+entry_re = re.compile(r'\s*(\d{10})\s(\d{5})\s([nf])')
+trailer_re = re.compile(r'\s*trailer')
+object_re = re.compile(r'\s*(\d+)\s+(\d+)\s+obj')
+stream_re = re.compile(r'stream(?:\r\n|\n|\r)')
+root_re = re.compile(r'/Root\s+(\d+)\s+(\d+)\s+R')
+prev_re = re.compile(r'/Prev\s+(\d+)')
+pages_re = re.compile(r'/Pages\s+(\d+)\s+(\d+)\s+R')
+# A direct /Count, and not a reference to an object holding it.
+count_re = re.compile(r'/Count\s+(\d+)\b(?!\s+\d+\s+R)')
+
+
+def get_int(name, text, default=None):
+    m = re.search(r'/%s\s+(\d+)\b(?!\s+\d+\s+R)' % name, text)
+    if m is None:
+        if default is None:
+            raise PDFParseError("No /%s found." % name)
+        return default
+    return int(m.group(1))
+
+
+def get_ints(name, text):
+    m = re.search(r'/%s\s*\[([\d\s]*)\]' % name, text)
+    if m is None:
+        return None
+    return [int(i) for i in m.group(1).split()]
+
+
+def unpredict(data, columns, predictor):
+    """Undo the PNG predictors that cross-reference streams are often encoded
+    with.
+
+    :param data: The decompressed stream.
+    :param columns: The number of bytes in each row, from /DecodeParms.
+    :param predictor: The /Predictor, from /DecodeParms.
+    :return: The stream without its predictors, as a bytearray.
+    """
+    if predictor == 1:
+        return bytearray(data)
+    if predictor < 10:
+        raise PDFParseError("TIFF predictors are not supported.")
+    data = bytearray(data)
+    result = bytearray()
+    previous = bytearray(columns)
+    for i in range(0, len(data) - columns, columns + 1):
+        kind, row = data[i], data[i + 1:i + 1 + columns]
+        for j in range(columns):
+            left = row[j - 1] if j else 0
+            up = previous[j]
+            if kind == 1:
+                row[j] = (row[j] + left) & 0xff
+            elif kind == 2:
+                row[j] = (row[j] + up) & 0xff
+            elif kind == 3:
+                row[j] = (row[j] + (left + up) // 2) & 0xff
+            elif kind == 4:
+                up_left = previous[j - 1] if j else 0
+                p = left + up - up_left
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - up_left)
+                if pa <= pb and pa <= pc:
+                    row[j] = (row[j] + left) & 0xff
+                elif pb <= pc:
+                    row[j] = (row[j] + up) & 0xff
+                else:
+                    row[j] = (row[j] + up_left) & 0xff
+            elif kind != 0:
+                raise PDFParseError("Unknown PNG predictor: %s" % kind)
+        result.extend(row)
+        previous = row
+    return result
+
+
+def read_stream(mm, start):
+    """Read the dictionary and the decompressed data of a stream object.
+
+    :param mm: The PDF, as an mmap or a str.
+    :param start: The offset just after "obj".
+    :return: A tuple of the dictionary, as a str, and the data.
+    """
+    # The dictionaries of the streams read here are short.
+    m = stream_re.search(mm, start, start + 4096)
+    if m is None or 'endobj' in mm[start:m.start()]:
+        raise PDFParseError("Expected a stream at %s." % start)
+    dictionary = mm[start:m.start()]
+    if '/FlateDecode' not in dictionary:
+        raise PDFParseError("Unsupported stream filter at %s." % start)
+    length = get_int('Length', dictionary, 0)
+    if length:
+        end = m.end() + length
+    else:
+        # The /Length is an indirect object. Since decompression stops at the
+        # end of the compressed data, it isn't really needed anyway.
+        end = mm.find('endstream', m.end())
+        if end == -1:
+            raise PDFParseError("Stream at %s never ends." % start)
+    try:
+        data = zlib.decompressobj().decompress(mm[m.end():end])
+    except zlib.error:
+        raise PDFParseError("Bad stream at %s." % start)
+    return dictionary, data
+
+
+def read_xref_table(mm, offset, entries):
+    """Read a classic cross-reference table and return its trailer."""
+    pos = offset + 4
+    while True:
+        m = subsection_re.match(mm, pos)
+        if m is None:
+            break
+        start, count = int(m.group(1)), int(m.group(2))
+        pos = m.end()
+        for number in range(start, start + count):
+            m = entry_re.match(mm, pos)
+            if m is None:
+                raise PDFParseError("Bad entry in cross-reference table.")
+            pos = m.end()
+            # Newer tables take precedence over older ones.
+            if m.group(3) == 'n' and number not in entries:
+                entries[number] = ('n', int(m.group(1)), int(m.group(2)))
+    if trailer_re.match(mm, pos) is None:
+        raise PDFParseError("No trailer after cross-reference table.")
+    end = mm.find('startxref', pos)
+    return mm[pos:end if end != -1 else len(mm)]
+
+
+def read_xref_stream(mm, offset, entries):
+    """Read a cross-reference stream and return its dictionary."""
+    m = object_re.match(mm, offset)
+    if m is None:
+        raise PDFParseError("No cross-reference at %s." % offset)
+    dictionary, data = read_stream(mm, m.end())
+    widths = get_ints('W', dictionary)
+    if not widths or len(widths) != 3:
+        raise PDFParseError("Bad /W in cross-reference stream.")
+    row_width = sum(widths)
+    data = unpredict(data, get_int('Columns', dictionary, row_width),
+                     get_int('Predictor', dictionary, 1))
+    index = get_ints('Index', dictionary) or [0, get_int('Size', dictionary)]
+
+    pos = 0
+    for start, count in zip(index[::2], index[1::2]):
+        for number in range(start, start + count):
+            row = data[pos:pos + row_width]
+            if len(row) < row_width:
+                raise PDFParseError("Cross-reference stream is too short.")
+            pos += row_width
+            fields = []
+            i = 0
+            for width in widths:
+                value = 0
+                for byte in row[i:i + width]:
+                    value = (value << 8) + byte
+                fields.append(value)
+                i += width
+            # A missing type field defaults to 1.
+            kind = fields[0] if widths[0] else 1
+            if number in entries:
+                continue
+            if kind == 1:
+                entries[number] = ('n', fields[1], fields[2])
+            elif kind == 2:
+                entries[number] = ('c', fields[1], fields[2])
+    return dictionary
+
+
+def read_xrefs(mm):
+    """Read the cross-reference sections of a PDF, starting with the newest
+    and following the /Prev links of their trailers back to the oldest.
+
+    :param mm: The PDF, as an mmap or a str.
+    :return: A tuple of a dict and the (number, generation) of the document
+    catalog. The dict maps object numbers to either ('n', offset, generation)
+    for objects in the file, or to ('c', stream number, index) for objects
+    compressed into object streams.
+    """
+    matches = list(startxref_re.finditer(mm, max(0, len(mm) - 1024)))
+    if not matches:
+        raise PDFParseError("No startxref found.")
+    offset = int(matches[-1].group(1))
+
+    entries = {}
+    root = None
+    seen = set()
+    while offset is not None:
+        if offset in seen or offset >= len(mm):
+            raise PDFParseError("Bad cross-reference offset: %s" % offset)
+        seen.add(offset)
+        if mm[offset:offset + 4] == 'xref':
+            trailer = read_xref_table(mm, offset, entries)
+            m = re.search(r'/XRefStm\s+(\d+)', trailer)
+            if m is not None:
+                # A hybrid file, with some objects only in a stream.
+                read_xref_stream(mm, int(m.group(1)), entries)
+        else:
+            trailer = read_xref_stream(mm, offset, entries)
+        if root is None:
+            m = root_re.search(trailer)
+            if m is not None:
+                root = (int(m.group(1)), int(m.group(2)))
+        m = prev_re.search(trailer)
+        offset = int(m.group(1)) if m is not None else None
+
+    if root is None:
+        raise PDFParseError("No /Root in the trailer.")
+    return entries, root
+
+
+def get_object(mm, entries, number, generation):
+    """Get the text of an object, without its "obj" and "endobj".
+
+    :param mm: The PDF, as an mmap or a str.
+    :param entries: A dict from read_xrefs.
+    :param number: The object number.
+    :param generation: The generation number.
+    :return: A str.
+    """
+    try:
+        kind, a, b = entries[number]
+    except KeyError:
+        raise PDFParseError("Object %s is not in the cross-reference "
+                            "sections." % number)
+    if kind == 'c':
+        # Compressed into the a-th object stream, at index b.
+        dictionary, data = read_stream(
+            mm, get_object_start(mm, entries, a, 0))
+        first = get_int('First', dictionary)
+        header = [int(i) for i in data[:first].split()]
+        offsets = header[1::2] + [len(data) - first]
+        if header[b * 2:b * 2 + 1] != [number]:
+            raise PDFParseError("Object %s is not in its object "
+                                "stream." % number)
+        return data[first + offsets[b]:first + offsets[b + 1]]
+
+    start = get_object_start(mm, entries, number, generation)
+    end = mm.find('endobj', start)
+    if end == -1:
+        raise PDFParseError("Object %s never ends." % number)
+    return mm[start:end]
+
+
+def get_object_start(mm, entries, number, generation):
+    """Get the offset just after the "obj" of an object in the file."""
+    kind, offset, gen = entries.get(number, (None, None, None))
+    m = object_re.match(mm, offset) if kind == 'n' else None
+    if m is None or gen != generation or int(m.group(1)) != number:
+        raise PDFParseError("Object %s is not where the cross-reference "
+                            "section says it is." % number)
+    return m.end()
+
+
+def count_pages(path):
+    """Count the pages of a PDF by reading the /Count of its page tree.
+
+    :param path: The path to the PDF.
+    :return: The number of pages. Raises PDFParseError if the PDF can't be
+    read this way, and IOError if the file can't be opened.
+    """
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise PDFParseError("Empty file.")
+    try:
+        entries, root = read_xrefs(mm)
+        catalog = get_object(mm, entries, *root)
+        m = pages_re.search(catalog)
+        if m is None:
+            raise PDFParseError("No /Pages in the document catalog.")
+        pages = get_object(mm, entries, int(m.group(1)), int(m.group(2)))
+        m = count_re.search(pages)
+        if m is None:
+            raise PDFParseError("No /Count in the root of the page tree.")
+        return int(m.group(1))
+    finally:
+        mm.close()
@@ -1,6 +1,21 @@
+import os
+import threading
+import time
+
+from django.core.cache import cache
 from scorched import SolrInterface
 from scorched.search import Options, SolrSearch
 
+# How long, in seconds, a cached Solr interface is used before its schema is
+# fetched again. This lets processes notice cores that were reloaded or
+# swapped by another process.
+SOLR_INTERFACE_MAX_AGE = 10 * 60
+# The cache key of a counter that is bumped whenever every core's interfaces
+# are cleared. Each core also has a counter of its own, under this key with
+# its URL appended. Every thread and process checks these, so clearing
+# reaches all of them.
+SOLR_INTERFACE_GENERATION_KEY = 'solr-interface-generation'
+
 
 class ExtraSolrInterface(SolrInterface):
     """Extends the SolrInterface class so that it uses the ExtraSolrSearch
@@ -72,3 +87,86 @@ class ExtraOptions(Options):
 
     def options(self):
         return self.option_dict
+
+
+_solr_interfaces = threading.local()
+
+
+def _get_solr_interface_cache():
+    """Get this thread's cache of Solr interfaces, making a new one if the
+    process has forked since it was made.
+    """
+    pid = os.getpid()
+    if getattr(_solr_interfaces, 'pid', None) != pid:
+        _solr_interfaces.pid = pid
+        _solr_interfaces.cache = {}
+    return _solr_interfaces.cache
+
+
+def _get_generation_keys(url):
+    return [SOLR_INTERFACE_GENERATION_KEY,
+            '%s:%s' % (SOLR_INTERFACE_GENERATION_KEY, url)]
+
+
+def _get_generation(url):
+    """Get how many times the interfaces for a core have been cleared, in
+    any process.
+
+    :return: A tuple of the counts for every core and for this one.
+    """
+    keys = _get_generation_keys(url)
+    counts = cache.get_many(keys)
+    return tuple(counts.get(key, 0) for key in keys)
+
+
+def get_solr_interface(url, mode='r', interface_class=None):
+    """Get a cached Solr interface for a core, making it if needed.
+
+    Making a Solr interface fetches and parses the schema of the core over
+    HTTP before any query can be sent. Interfaces made by this function are
+    kept for reuse, along with their parsed schema and their keep-alive HTTP
+    connection. They are cached per process and per thread because the HTTP
+    clients they use are not thread safe. Each call checks the shared counters
+    that clear_solr_interfaces bumps, which costs a cache lookup but is far
+    cheaper than fetching the schema.
+
+    :param url: The URL of the Solr core.
+    :param mode: 'r', 'w' or 'rw', as for the interface class.
+    :param interface_class: The class of the interface to make. Defaults to
+    ExtraSolrInterface. The sunburnt SolrInterface can also be used.
+    :return: An instance of interface_class.
+    """
+    interface_class = interface_class or ExtraSolrInterface
+    interfaces = _get_solr_interface_cache()
+    key = (interface_class, url, mode)
+    generation = _get_generation(url)
+    si, date_created, si_generation = interfaces.get(key, (None, None, None))
+    if si is None or si_generation != generation or \
+            time.time() - date_created > SOLR_INTERFACE_MAX_AGE:
+        si = interface_class(url, mode=mode)
+        interfaces[key] = (si, time.time(), generation)
+    return si
+
+
+def clear_solr_interfaces(url=None):
+    """Forget cached Solr interfaces in every thread and process, so that the
+    next ones are made with a fresh schema. Use this after reloading or
+    swapping a core.
+
+    This thread's interfaces are dropped at once. Others are dropped the next
+    time they are asked for, when the bumped counter no longer matches.
+
+    :param url: The URL of the core to forget. If None, forget all of them.
+    """
+    interfaces = _get_solr_interface_cache()
+    for key in list(interfaces.keys()):
+        if url is None or key[1] == url:
+            del interfaces[key]
+
+    if url is None:
+        key = SOLR_INTERFACE_GENERATION_KEY
+    else:
+        key = _get_generation_keys(url)[1]
+    # incr() fails on missing keys, and add() is a no-op on existing ones.
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
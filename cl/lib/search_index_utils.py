@@ -1,5 +1,9 @@
 from datetime import date, datetime, time
 
+from django.utils.encoding import force_text
+from django.utils.formats import date_format
+from django.utils.html import conditional_escape
+
 
 def solr_list(m2m_list, field):
     new_list = []
@@ -47,3 +51,19 @@ def normalize_search_dicts(d):
         else:
             new_dict[k] = v
     return new_dict
+
+
+def render_text_value(value):
+    """Render a value the way that `{{ value }}` would in a Django template,
+    escaping it unless it is marked safe.
+    """
+    return conditional_escape(force_text(value))
+
+
+def render_date_value(value, fmt="j F Y"):
+    """Render a date the way that `{{ value|date:fmt }}` would in a Django
+    template.
+    """
+    if value in (None, ''):
+        return u''
+    return conditional_escape(date_format(value, fmt))
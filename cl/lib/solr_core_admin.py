@@ -6,6 +6,7 @@ import shutil
 import lxml
 import requests
 
+from cl.lib.scorched_utils import clear_solr_interfaces
 from cl.lib.sunburnt import SolrError
 
 
@@ -65,6 +66,8 @@ def delete_solr_core(core_name, delete_index=True, delete_data=True,
     if r.status_code != 200:
         raise Exception("Problem deleting core. Got status_code of %s. Check "
                         "the Solr logs for details." % r.status_code)
+    # Cached interfaces to the core now have a stale schema and connection.
+    clear_solr_interfaces()
 
 
 def swap_solr_core(current_core, desired_core):
@@ -83,6 +86,8 @@ def swap_solr_core(current_core, desired_core):
     if r.status_code != 200:
         print "Problem swapping cores. Got status_code of %s. Check the Solr " \
               "logs for details." % r.status_code
+    # Cached interfaces to the cores now have stale schemas.
+    clear_solr_interfaces()
 
 
 def get_solr_core_status(core='all'):
@@ -5,17 +5,32 @@ import datetime
 import re
 
 import os
+import shutil
 import tempfile
+import threading
 
+import mock
+from requests import Response
+
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.urlresolvers import reverse
 from django.test import TestCase, SimpleTestCase
 from django.test import override_settings
 from rest_framework.status import HTTP_503_SERVICE_UNAVAILABLE, HTTP_200_OK
 
-from cl.lib.db_tools import queryset_generator
+from cl.lib.db_tools import queryset_generator, get_pk_ranges
+from cl.lib.disk_cache import evict, get_size_path, make_temp_file
+from cl.lib.extraction_cache import cache_extraction, \
+    get_cached_extraction, get_entry_path
+from cl.lib.http_pool import conditional_get, get_adapter, get_cache_paths, \
+    get_session
 from cl.lib.mime_types import lookup_mime_type
 from cl.lib.model_helpers import make_upload_path
+from cl.lib.scorched_utils import get_solr_interface, \
+    clear_solr_interfaces
+from cl.lib.pagerank import make_csr_graph, pagerank
+from cl.lib.pdf_utils import PDFParseError, count_pages
 from cl.lib.pacer import normalize_attorney_role, normalize_attorney_contact,\
     normalize_us_state, make_address_lookup_key
 from cl.lib.search_utils import make_fq
@@ -81,6 +96,250 @@ class TestDBTools(TestCase):
         print('✓')
 
 
+class TestPkRanges(TestCase):
+    fixtures = ['test_objects_search.json', 'judge_judy.json']
+
+    def test_pk_ranges_cover_everything(self):
+        """Are the ranges contiguous, and do they cover every item?"""
+        for count in [1, 2, 4, 100]:
+            ranges = get_pk_ranges(Opinion.objects.all(), count)
+            self.assertLessEqual(len(ranges), count)
+            for (_, last_pk), (next_pk, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(last_pk + 1, next_pk)
+            self.assertEqual(
+                sum(Opinion.objects.filter(pk__gte=first_pk,
+                                           pk__lte=last_pk).count()
+                    for first_pk, last_pk in ranges),
+                Opinion.objects.count(),
+            )
+
+    def test_pk_ranges_empty_queryset(self):
+        """Does an empty queryset produce no ranges?"""
+        self.assertEqual(get_pk_ranges(Opinion.objects.none(), 4), [])
+
+
+class TestSolrInterfaceCache(SimpleTestCase):
+    class FakeSolrInterface(object):
+        def __init__(self, url, mode=''):
+            self.url = url
+            self.mode = mode
+
+    def tearDown(self):
+        clear_solr_interfaces()
+
+    def get(self, url, mode='r'):
+        return get_solr_interface(url, mode=mode,
+                                  interface_class=self.FakeSolrInterface)
+
+    def test_interfaces_are_reused(self):
+        """Are interfaces reused for the same core and mode only?"""
+        si = self.get('http://solr/a')
+        self.assertIs(si, self.get('http://solr/a'))
+        self.assertIsNot(si, self.get('http://solr/a', mode='w'))
+        self.assertIsNot(si, self.get('http://solr/b'))
+
+    def test_clearing_interfaces(self):
+        """Are interfaces made again after they are cleared?"""
+        a = self.get('http://solr/a')
+        b = self.get('http://solr/b')
+        clear_solr_interfaces('http://solr/a')
+        self.assertIsNot(a, self.get('http://solr/a'))
+        self.assertIs(b, self.get('http://solr/b'))
+
+    def test_clearing_interfaces_in_other_threads(self):
+        """Does clearing interfaces in one thread reach the others?"""
+        a = self.get('http://solr/a')
+        t = threading.Thread(target=clear_solr_interfaces,
+                             args=('http://solr/a',))
+        t.start()
+        t.join()
+        self.assertIsNot(a, self.get('http://solr/a'))
+
+
+class TestHttpPool(SimpleTestCase):
+    def test_adapters_are_shared_per_host(self):
+        """Do requests to the same host share an adapter and its pool?"""
+        adapter = get_adapter('https://example.com/a.pdf')
+        self.assertIs(adapter, get_adapter('https://example.com/b/c.pdf'))
+        self.assertIsNot(adapter, get_adapter('https://example.org/a.pdf'))
+        self.assertIsNot(adapter, get_adapter('https://example.com/a.pdf',
+                                              retry_statuses=()))
+        session = get_session('https://example.com/')
+        self.assertIs(adapter, session.get_adapter('https://example.com/d'))
+
+    def test_conditional_get(self):
+        """Are unchanged responses answered from the cache?"""
+        def make_response(status_code, content='', headers=None):
+            r = Response()
+            r.status_code = status_code
+            r._content = content
+            r.headers.update(headers or {})
+            return r
+
+        cache_dir = tempfile.mkdtemp()
+        try:
+            url = 'https://example.com/a.pdf'
+            session = mock.Mock()
+            session.get.return_value = make_response(
+                200, 'content', {'ETag': '"1"'})
+            r = conditional_get(session, url, cache_dir, max_bytes=1000)
+            self.assertFalse(r.from_cache)
+
+            session.get.return_value = make_response(304)
+            r = conditional_get(session, url, cache_dir, max_bytes=1000)
+            self.assertEqual(
+                '"1"', session.get.call_args[1]['headers']['If-None-Match'])
+            self.assertTrue(r.from_cache)
+            self.assertEqual(200, r.status_code)
+            self.assertEqual('content', r.content)
+
+            # Responses beyond the size limit evict the oldest ones.
+            session.get.return_value = make_response(
+                200, 'x' * 1000, {'ETag': '"2"'})
+            conditional_get(session, 'https://example.com/b.pdf', cache_dir,
+                            max_bytes=1000)
+            session.get.return_value = make_response(304)
+            r = conditional_get(session, url, cache_dir, max_bytes=1000)
+            self.assertNotIn('If-None-Match',
+                             session.get.call_args[1]['headers'])
+            self.assertFalse(r.from_cache)
+
+            # If the body is evicted after it's checked for, the whole
+            # response is asked for again.
+            url = 'https://example.com/c.pdf'
+            session.get.return_value = make_response(
+                200, 'content', {'ETag': '"3"'})
+            conditional_get(session, url, cache_dir, max_bytes=1000)
+            os.remove(get_cache_paths(cache_dir, url)[1])
+            session.get.side_effect = [
+                make_response(304),
+                make_response(200, 'new content', {'ETag': '"4"'}),
+            ]
+            with mock.patch('cl.lib.http_pool.os.path.isfile',
+                            return_value=True):
+                r = conditional_get(session, url, cache_dir, max_bytes=1000)
+            self.assertEqual('"3"', session.get.call_args_list[-2][1][
+                'headers']['If-None-Match'])
+            self.assertNotIn('If-None-Match',
+                             session.get.call_args[1]['headers'])
+            self.assertEqual('new content', r.content)
+            self.assertFalse(r.from_cache)
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+class TestExtractionCache(SimpleTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_round_trip(self):
+        """Are extractions cached by namespace and sha1?"""
+        sha1 = 'a' * 40
+        self.assertIsNone(get_cached_extraction('recap', sha1, self.cache_dir))
+        self.assertTrue(cache_extraction('recap', sha1, {'content': u'Text'},
+                                         self.cache_dir, max_bytes=1000))
+        self.assertEqual({'content': u'Text'},
+                         get_cached_extraction('recap', sha1, self.cache_dir))
+        self.assertIsNone(get_cached_extraction('opinion', sha1,
+                                                self.cache_dir))
+
+    def test_least_recently_used_are_evicted(self):
+        """When the cache is full, are the least recently used entries
+        deleted?"""
+        sha1s = [c * 40 for c in 'abc']
+        for i, sha1 in enumerate(sha1s[:2]):
+            cache_extraction('recap', sha1, {'content': u'x' * 50},
+                             self.cache_dir, max_bytes=150)
+            # Make the entries' ages unambiguous.
+            path = get_entry_path(self.cache_dir, 'recap', sha1)
+            os.utime(path, (i, i))
+        # Using the older entry makes the other one the least recent.
+        get_cached_extraction('recap', sha1s[0], self.cache_dir)
+        cache_extraction('recap', sha1s[2], {'content': u'x' * 50},
+                         self.cache_dir, max_bytes=150)
+        self.assertIsNotNone(get_cached_extraction('recap', sha1s[0],
+                                                   self.cache_dir))
+        self.assertIsNone(get_cached_extraction('recap', sha1s[1],
+                                                self.cache_dir))
+        self.assertIsNotNone(get_cached_extraction('recap', sha1s[2],
+                                                   self.cache_dir))
+
+    def test_cache_is_only_scanned_when_full(self):
+        """Is the cache's size tracked without scanning it on every write?"""
+        with mock.patch('cl.lib.disk_cache.os.walk') as walk:
+            for c in 'ab':
+                cache_extraction('recap', c * 40, {'content': u'x' * 50},
+                                 self.cache_dir, max_bytes=150)
+            self.assertFalse(walk.called)
+        with open(get_size_path(self.cache_dir)) as f:
+            self.assertEqual(130, int(f.read()))
+
+    def test_temp_files_are_not_evicted(self):
+        """Are files that are still being written left alone by eviction?"""
+        fd, tmp_path = make_temp_file(self.cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            f.write('x' * 50)
+        self.assertEqual((0, 0), evict(self.cache_dir, 0))
+        self.assertTrue(os.path.isfile(tmp_path))
+
+
+class TestPdfUtils(SimpleTestCase):
+    def test_count_pages(self):
+        """Can we count the pages of PDFs with cross-reference tables and
+        with cross-reference streams?"""
+        test_dir = os.path.join(settings.MEDIA_ROOT, 'test')
+        expected = (
+            ('search/opinion_pdf_image_based.pdf', 1),
+            ('search/opinion_pdf_text_based.pdf', 30),
+            ('pdf/2013/06/12/in_re_motion_for_consent_to_disclosure_of_'
+             'court_records.pdf', 1),
+        )
+        for path, count in expected:
+            self.assertEqual(count, count_pages(os.path.join(test_dir, path)))
+
+    def test_unparseable_pdf(self):
+        """Do PDFs that can't be parsed raise PDFParseError?"""
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write('%PDF-1.4 Not really a PDF.')
+            f.flush()
+            with self.assertRaises(PDFParseError):
+                count_pages(f.name)
+
+
+class TestPagerank(SimpleTestCase):
+    def setUp(self):
+        # Node 4 is cited but cites nothing, and node 0 isn't in the graph at
+        # all, so both are dangling.
+        self.graph = make_csr_graph([[(1, 2), (1, 3), (2, 3)],
+                                     [(3, 1), (3, 4)]])
+        # From igraph.
+        self.expected = [0.080226065283, 0.215221377550, 0.171695150747,
+                         0.317636028870, 0.215221377550]
+
+    def assertScores(self, scores):
+        for pk, (score, expected) in enumerate(zip(scores, self.expected)):
+            self.assertAlmostEqual(score, expected, places=8,
+                                   msg="Wrong score for node %s" % pk)
+
+    def test_cold_start(self):
+        """Do the scores match igraph's, with dangling nodes spread evenly?"""
+        scores, iterations = pagerank(self.graph)
+        self.assertScores(scores)
+        self.assertAlmostEqual(1.0, scores.sum())
+        self.assertGreater(iterations, 10)
+
+    def test_warm_start(self):
+        """Do runs that start from the last scores converge faster, to the
+        same scores?"""
+        cold_scores, cold_iterations = pagerank(self.graph)
+        scores, iterations = pagerank(self.graph, initial=cold_scores * 2)
+        self.assertScores(scores)
+        self.assertLess(iterations, cold_iterations)
+
+
 class TestStringUtils(TestCase):
     def test_trunc(self):
         """Does trunc give us the results we expect?"""
@@ -11,6 +11,7 @@ def opinion_sitemap_maker(request):
         'monthly',
         ['pdf', 'doc', 'wpd'],
         'absolute_url',
+        section='opinions',
     )
 
 
@@ -22,4 +23,5 @@ def recap_sitemap_maker(request):
         'weekly',
         [],
         'docket_absolute_url',
+        section='recap',
     )
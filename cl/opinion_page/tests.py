@@ -1,11 +1,19 @@
+import gzip
+import io
+import shutil
+import tempfile
+
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.test import TestCase, override_settings
+from lxml import etree
 from rest_framework.status import HTTP_200_OK, HTTP_404_NOT_FOUND, \
     HTTP_302_FOUND
 
 from cl.lib import sunburnt
 from cl.lib.test_helpers import SitemapTest
+from cl.search.management.commands.cl_make_sitemaps import make_section
+from cl.search.models import Opinion
 from cl.sitemap import make_sitemap_solr_params
 
 
@@ -129,3 +137,52 @@ class OpinionSitemapTest(SitemapTest):
         # Class attributes are set, just run the test in super.
         self.expected_item_count = self.get_expected_item_count()
         super(OpinionSitemapTest, self).does_the_sitemap_have_content()
+
+
+class StaticOpinionSitemapTest(TestCase):
+    fixtures = ['test_objects_search.json', 'judge_judy.json']
+
+    def setUp(self):
+        self.sitemap_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            SITEMAP_DIR=self.sitemap_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.sitemap_dir)
+
+    def count_urls(self, content):
+        return len(etree.fromstring(content).xpath(
+            '//s:url',
+            namespaces={'s': 'http://www.sitemaps.org/schemas/sitemap/0.9'},
+        ))
+
+    def test_made_sitemaps_are_served(self):
+        """Are the files made by cl_make_sitemaps served, gzipped or not?"""
+        self.assertEqual(make_section('opinions'), 1)
+        expected_count = sum(
+            2 if o.local_path and not o.local_path.name.endswith('.xml')
+            else 1 for o in Opinion.objects.all()
+        )
+
+        url = reverse('opinion_sitemap')
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, HTTP_200_OK)
+        self.assertEqual(self.count_urls(r.content), expected_count)
+
+        r = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(r['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', r['Vary'])
+        content = gzip.GzipFile(fileobj=io.BytesIO(r.content)).read()
+        self.assertEqual(self.count_urls(content), expected_count)
+
+        r = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(r.has_header('Content-Encoding'))
+        self.assertEqual(self.count_urls(r.content), expected_count)
+
+        r = self.client.get(url, {'p': 2})
+        self.assertEqual(r.status_code, HTTP_404_NOT_FOUND)
+
+        # Later runs only redo the last page.
+        self.assertEqual(make_section('opinions'), 1)
@@ -22,6 +22,7 @@ from cl.lib.bot_detector import is_bot
 from cl.lib.import_lib import map_citations_to_models
 from cl.lib.model_helpers import suppress_autotime
 from cl.lib.ratelimiter import ratelimit_if_not_whitelisted
+from cl.lib.scorched_utils import get_solr_interface
 from cl.lib.search_utils import make_get_string
 from cl.lib.string_utils import trunc
 from cl.people_db.models import AttorneyOrganization, Role
@@ -219,7 +220,11 @@ def view_opinion(request, pk, _):
         favorite_form = FavoriteForm(instance=fave)
 
     # Get the citing results from Solr for speed.
-    conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
+    conn = get_solr_interface(
+        settings.SOLR_OPINION_URL,
+        mode='r',
+        interface_class=sunburnt.SolrInterface,
+    )
     q = {
         'q': 'cites:({ids})'.format(
             ids=' OR '.join([str(pk) for pk in
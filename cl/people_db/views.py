@@ -6,6 +6,7 @@ from django.shortcuts import get_object_or_404, render
 
 from cl.lib import magic
 from cl.lib.bot_detector import is_bot
+from cl.lib.scorched_utils import get_solr_interface
 from cl.lib.sunburnt import SolrInterface
 from cl.people_db.models import Person, FinancialDisclosure
 from cl.stats.utils import tally_stat
@@ -47,7 +48,11 @@ def view_person(request, pk, slug):
     positions = judicial_positions + other_positions
 
     # Use Solr to get relevant opinions that the person wrote
-    conn = SolrInterface(settings.SOLR_OPINION_URL, mode='r')
+    conn = get_solr_interface(
+        settings.SOLR_OPINION_URL,
+        mode='r',
+        interface_class=SolrInterface,
+    )
     q = {
         'q': 'author_id:{p} OR panel_ids:{p}'.format(p=person.pk),
         'fl': ['id', 'court_id', 'caseName', 'absolute_url', 'court',
@@ -61,7 +66,11 @@ def view_person(request, pk, slug):
     authored_opinions = conn.raw_query(**q).execute()
 
     # Use Solr to get the oral arguments for the judge
-    conn = SolrInterface(settings.SOLR_AUDIO_URL, mode='r')
+    conn = get_solr_interface(
+        settings.SOLR_AUDIO_URL,
+        mode='r',
+        interface_class=SolrInterface,
+    )
     q = {
         'q': 'panel_ids:{p}'.format(p=person.pk),
         'fl': ['id', 'absolute_url', 'caseName', 'court_id', 'dateArgued',
@@ -0,0 +1,222 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Count, Min
+from django.utils.timezone import now
+
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.recap.models import ProcessingQueue, DOCKET, DOCKET_HISTORY_REPORT, \
+    APPELLATE_DOCKET, ATTACHMENT_PAGE, APPELLATE_ATTACHMENT_PAGE, PDF, \
+    UPLOAD_TYPES
+from cl.recap.tasks import process_recap_upload
+
+DOCKET_TYPES = (DOCKET, DOCKET_HISTORY_REPORT, APPELLATE_DOCKET)
+# Dockets go first, so that the entries that attachment pages and PDFs belong
+# to exist by the time they are processed.
+DISPATCH_ORDER = (DOCKET, DOCKET_HISTORY_REPORT, APPELLATE_DOCKET,
+                  ATTACHMENT_PAGE, APPELLATE_ATTACHMENT_PAGE, PDF)
+
+
+def get_case_key(pq):
+    if not pq.pacer_case_id:
+        return None
+    return pq.court_id, pq.pacer_case_id
+
+
+def plan_uploads(pqs, busy_cases):
+    """Work out which queued uploads to process, and in what order.
+
+    Uploads of the same case's docket are processed one at a time, in the
+    order they were uploaded. A newer upload can't simply replace an older
+    one, since docket reports are often run for a range of dates or
+    documents, or with parties left out, so each upload may have entries
+    that the others lack. Attachment pages and PDFs of a case whose docket is
+    waiting to be processed, or is being processed right now, are held back
+    so that they aren't processed before their docket entries exist.
+
+    :param pqs: The ProcessingQueue items that are awaiting processing, in the
+    order they were uploaded.
+    :param busy_cases: A set of (court_id, pacer_case_id) tuples for dockets
+    that are being processed now, or that are waiting behind one that is.
+    :return: A tuple of two lists. The first has the items to process, in
+    order. The second has the items to hold back for a later pass.
+    """
+    to_process, held = [], []
+    docket_cases = set()
+    for pq in pqs:
+        key = get_case_key(pq)
+        if pq.upload_type not in DOCKET_TYPES or key is None:
+            continue
+        if key in busy_cases or key in docket_cases:
+            held.append(pq)
+        else:
+            to_process.append(pq)
+        docket_cases.add(key)
+
+    # Cases that have a docket waiting or in progress are busy until it's
+    # done.
+    for pq in pqs:
+        key = get_case_key(pq)
+        if pq.upload_type in DOCKET_TYPES and key is not None:
+            continue
+        if key is not None and (key in busy_cases or key in docket_cases):
+            held.append(pq)
+        else:
+            to_process.append(pq)
+
+    to_process.sort(key=lambda pq: (
+        DISPATCH_ORDER.index(pq.upload_type)
+        if pq.upload_type in DISPATCH_ORDER else len(DISPATCH_ORDER),
+        pq.pk,
+    ))
+    held.sort(key=lambda pq: pq.pk)
+    return to_process, held
+
+
+def get_busy_cases(max_age):
+    """Get the cases that have a docket being processed right now.
+
+    :param max_age: A timedelta. Dockets that have been in progress for longer
+    than this are assumed to have crashed, and don't hold anything back.
+    """
+    return set(ProcessingQueue.objects.filter(
+        status=ProcessingQueue.PROCESSING_IN_PROGRESS,
+        upload_type__in=DOCKET_TYPES,
+        date_modified__gte=now() - max_age,
+    ).exclude(pacer_case_id='').values_list('court_id', 'pacer_case_id'))
+
+
+def get_queue_metrics():
+    """Get the depth of the queue and how long its oldest item has been
+    waiting, by upload type.
+
+    :return: A dict mapping the name of each upload type to a dict with the
+    number of items awaiting processing and the timedelta that the oldest of
+    them has waited.
+    """
+    rows = ProcessingQueue.objects.filter(
+        status=ProcessingQueue.AWAITING_PROCESSING,
+    ).values('upload_type').annotate(
+        depth=Count('pk'),
+        oldest=Min('date_created'),
+    ).order_by()
+    current_time = now()
+    metrics = {}
+    for upload_type, name in UPLOAD_TYPES:
+        metrics[name] = {'depth': 0, 'max_wait': timedelta(0)}
+    names = dict(UPLOAD_TYPES)
+    for row in rows:
+        metrics[names[row['upload_type']]] = {
+            'depth': row['depth'],
+            'max_wait': current_time - row['oldest'],
+        }
+    return metrics
+
+
+def get_wait_times(pqs):
+    """Get how long the items of a batch waited before being processed.
+
+    :return: A dict mapping the name of each upload type in the batch to a
+    tuple of the mean and the longest timedelta its items waited.
+    """
+    current_time = now()
+    waits = defaultdict(list)
+    for pq in pqs:
+        waits[pq.get_upload_type_display()].append(
+            current_time - pq.date_created)
+    return dict((name, (sum(w, timedelta(0)) / len(w), max(w)))
+                for name, w in waits.items())
+
+
+class Command(VerboseCommand):
+    help = ('Process the uploads that are waiting in the RECAP processing '
+            'queue, dockets first and one at a time per case. Used when the '
+            'RECAP_SCHEDULE_UPLOADS setting is on.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--daemon',
+            action='store_true',
+            default=False,
+            help="Run forever, waiting for new uploads when there are none.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="The number of uploads to consider at a time.",
+        )
+        parser.add_argument(
+            '--wait',
+            type=int,
+            default=5,
+            help="In daemon mode, the number of seconds to wait between "
+                 "passes over the queue.",
+        )
+        parser.add_argument(
+            '--max-docket-seconds',
+            type=int,
+            default=30 * 60,
+            help="How long a docket can be in progress before uploads that "
+                 "depend on it are no longer held back.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        max_age = timedelta(seconds=options['max_docket_seconds'])
+        after_pk = 0
+        # Cases with a docket that was dispatched or held earlier in this
+        # pass, so later uploads of them wait too.
+        waiting_cases = set()
+        while True:
+            # Page through the queue, so that held items at its front don't
+            # hide the items behind them.
+            pqs = list(ProcessingQueue.objects.filter(
+                status=ProcessingQueue.AWAITING_PROCESSING,
+                pk__gt=after_pk,
+            ).order_by('pk')[:options['batch_size']])
+            to_process, held = plan_uploads(
+                pqs, get_busy_cases(max_age) | waiting_cases)
+            waiting_cases.update(get_case_key(pq) for pq in to_process + held
+                                 if pq.upload_type in DOCKET_TYPES)
+
+            self.process_uploads(to_process)
+            logger.info("Processed %s uploads and held back %s." %
+                        (len(to_process), len(held)))
+            self.log_metrics(to_process)
+
+            if len(pqs) == options['batch_size']:
+                after_pk = pqs[-1].pk
+                continue
+            # The end of the queue. Start the next pass from the front, where
+            # the held items are.
+            if not options['daemon']:
+                break
+            after_pk = 0
+            waiting_cases = set()
+            time.sleep(options['wait'])
+
+    @staticmethod
+    def process_uploads(pqs):
+        for pq in pqs:
+            # Claim the item, so that the next pass doesn't process it again
+            # before its task starts. update() skips auto_now, and
+            # get_busy_cases goes by date_modified, so set it here.
+            claimed = ProcessingQueue.objects.filter(
+                pk=pq.pk,
+                status=ProcessingQueue.AWAITING_PROCESSING,
+            ).update(status=ProcessingQueue.PROCESSING_IN_PROGRESS,
+                     date_modified=now())
+            if claimed:
+                process_recap_upload(pq)
+
+    @staticmethod
+    def log_metrics(processed):
+        for name, (mean, longest) in sorted(get_wait_times(processed).items()):
+            logger.info("  %s: waited %s on average, %s at most." %
+                        (name, mean, longest))
+        for name, m in sorted(get_queue_metrics().items()):
+            if m['depth']:
+                logger.info("  %s: %s waiting, the oldest for %s." %
+                            (name, m['depth'], m['max_wait']))
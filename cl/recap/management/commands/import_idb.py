@@ -1,11 +1,12 @@
-import io
 import os
 import re
-import sys
+from collections import deque
+from multiprocessing import Pool
 
 from datetime import date
 from dateutil import parser
 from django.core.management import CommandError
+from django.db import connections
 
 from cl.lib.command_utils import VerboseCommand, logger
 from cl.recap.constants import (
@@ -15,6 +16,62 @@ from cl.recap.constants import (
 from cl.recap.models import FjcIntegratedDatabase
 from cl.search.models import Court
 
+# Lines in IDB files end with \r\n. Lone \n characters can be inside values.
+LINE_END = b'\r\n'
+
+
+def iter_lines(f, start_offset=0, block_size=1 << 20):
+    """Read the lines of a file, keeping track of where each one ends.
+
+    :param f: A file opened in binary mode.
+    :param start_offset: The byte offset to start reading at. It should be at
+    the start of a line.
+    :param block_size: How many bytes to read at a time.
+    :return: Yields tuples of the byte offset just after each line, and the
+    line, without its line ending.
+    """
+    f.seek(start_offset)
+    offset = start_offset
+    remainder = b''
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        lines = (remainder + block).split(LINE_END)
+        remainder = lines.pop()
+        for line in lines:
+            offset += len(line) + len(LINE_END)
+            yield offset, line
+    if remainder:
+        yield offset + len(remainder), remainder
+
+
+def close_db_connections():
+    """Close DB connections so they are not shared across forked processes."""
+    for conn in connections.all():
+        conn.close()
+
+
+_parsers = {}
+
+
+def parse_chunk(args):
+    """Parse a chunk of lines into row dicts. This is run in worker processes
+    when the --processes option is used.
+
+    :param args: A tuple of the filetype, the column headers, and a list of the
+    raw lines.
+    :return: A list of row dicts, with everything except their courts
+    normalized. Rows that shouldn't be imported are left out.
+    """
+    filetype, col_headers, lines = args
+    if filetype not in _parsers:
+        command = Command()
+        command.filetype = filetype
+        command.build_field_data()
+        _parsers[filetype] = command
+    return _parsers[filetype].parse_lines(lines, col_headers)
+
 
 class Command(VerboseCommand):
     help = 'Import a tab-separated file as produced by FJC for their IDB'
@@ -34,9 +91,24 @@ class Command(VerboseCommand):
             type=int,
         )
         parser.add_argument(
-            '--start-line',
-            help="The line to start on. Useful for crashed scripts.",
-            default=-1,
+            '--start-offset',
+            help="The byte offset to start at. Each batch logs the offset "
+                 "after its last line, so crashed imports can be resumed "
+                 "from there.",
+            default=0,
+            type=int,
+        )
+        parser.add_argument(
+            '--batch-size',
+            help="The number of rows to insert at a time.",
+            default=5000,
+            type=int,
+        )
+        parser.add_argument(
+            '--processes',
+            help="The number of processes to parse lines with. 1 parses them "
+                 "in this process.",
+            default=1,
             type=int,
         )
 
@@ -49,6 +121,7 @@ class Command(VerboseCommand):
         self.date_fields = []
         self.court_fields = []
         self.nullable_fields = None
+        self.courts = None
 
     @staticmethod
     def ensure_file_ok(file_path):
@@ -116,36 +189,99 @@ class Command(VerboseCommand):
         self.ensure_file_ok(options['input_file'])
         self.ensure_filetype_ok(options['filetype'])
         self.filetype = options['filetype']
+        if self.filetype in [CV_OLD, CR_OLD, APP_OLD, BANKR_2017]:
+            raise NotImplementedError("This file type not yet implemented.")
         self.build_field_data()
+        self.build_court_map()
 
         logger.info("Importing IDB file at: %s" % options['input_file'])
-        f = io.open(options['input_file'], mode='r', encoding='cp1252',
-                    newline="\r\n")
-        col_headers = f.next().strip().split('\t')
-        for i, line in enumerate(f):
-            sys.stdout.write('\rDoing line: %s' % i)
-            sys.stdout.flush()
-            if i < options['start_line']:
-                continue
+        with open(options['input_file'], 'rb') as f:
+            lines = iter_lines(f)
+            _, header = next(lines)
+            col_headers = header.decode('cp1252').strip().split('\t')
+            if options['start_offset']:
+                lines = iter_lines(f, options['start_offset'])
+            self.import_lines(lines, col_headers, options['batch_size'],
+                              options['processes'])
+
+    def import_lines(self, lines, col_headers, batch_size, processes):
+        """Parse lines in chunks and insert their rows in batches.
+
+        :param lines: An iterable of (end offset, line) tuples from iter_lines.
+        :param col_headers: The column headers of the file.
+        :param batch_size: How many lines to parse and insert at a time.
+        :param processes: How many processes to parse lines with.
+        """
+        def chunks():
+            chunk = []
+            for end_offset, line in lines:
+                chunk.append(line)
+                if len(chunk) >= batch_size:
+                    yield end_offset, chunk
+                    chunk = []
+            if chunk:
+                yield end_offset, chunk
+
+        # Parsing is the slow part, so it's done in a pool of processes when
+        # there's more than one. Only a few chunks are handed to the pool at a
+        # time, so the file isn't read into memory faster than rows are
+        # inserted. Results are taken in the order the chunks were sent, so
+        # their offsets always line up.
+        def parse_in_pool(pool):
+            pending = deque()
+            for end_offset, chunk in chunks():
+                pending.append((end_offset, pool.apply_async(
+                    parse_chunk, ((self.filetype, col_headers, chunk),))))
+                if len(pending) >= 2 * processes:
+                    end_offset, result = pending.popleft()
+                    yield end_offset, result.get()
+            while pending:
+                end_offset, result = pending.popleft()
+                yield end_offset, result.get()
+
+        pool = None
+        if processes > 1:
+            # Each process must make its own DB connections.
+            close_db_connections()
+            pool = Pool(processes=processes, initializer=close_db_connections)
+            results = parse_in_pool(pool)
+        else:
+            results = ((end_offset, self.parse_lines(chunk, col_headers))
+                       for end_offset, chunk in chunks())
+
+        total = 0
+        try:
+            for end_offset, rows in results:
+                items = [self.make_item(row) for row in rows]
+                FjcIntegratedDatabase.objects.bulk_create(
+                    [item for item in items if item is not None])
+                total += len(rows)
+                logger.info("Imported %s rows. Resume from offset %s." %
+                            (total, end_offset))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def parse_lines(self, lines, col_headers):
+        """Convert raw lines into normalized row dicts, all but their courts.
 
-            row = self.make_csv_row_dict(line, col_headers)
-            if options['filetype'] == CR_2017 and row['SOURCE'] != 'CMECF':
+        :param lines: A list of lines, as bytes.
+        :param col_headers: The column headers of the file.
+        :return: A list of row dicts.
+        """
+        rows = []
+        for line in lines:
+            row = self.make_csv_row_dict(line.decode('cp1252'), col_headers)
+            if self.filetype == CR_2017 and row['SOURCE'] != 'CMECF':
                 continue
 
             self.normalize_nulls(row)
-            self.normalize_court_fields(row)
             self.normalize_booleans(row)
             self.normalize_dates(row)
             self.normalize_ints(row)
-            if options['filetype'] in [CV_OLD, CR_OLD, APP_OLD, BANKR_2017]:
-                raise NotImplementedError("This file type not yet implemented.")
-            elif options['filetype'] == CV_2017:
-                self.import_row(row, CV_2017)
-            elif options['filetype'] == CR_2017:
-                self.import_row(row, CR_2017)
-            elif options['filetype'] == APP_2017:
-                self.import_appellate_row(row, APP_2017)
-        f.close()
+            rows.append(row)
+        return rows
 
     def normalize_nulls(self, row):
         """The IDB uses the value -8 to indicate a null value. Fix this
@@ -195,38 +331,50 @@ class Command(VerboseCommand):
             row['CIRCUIT'] = row['CIRCUIT'][1]
 
         if row['CIRCUIT']:
-            matches = Court.objects.filter(jurisdiction=Court.FEDERAL_APPELLATE,
-                                           fjc_court_id=row['CIRCUIT'])
-            if matches.count() == 1:
-                row['CIRCUIT'] = matches[0]
-            else:
-                raise Exception("Unable to match CIRCUIT column value %s to "
-                                "Court object" % row['CIRCUIT'])
+            row['CIRCUIT'] = self.get_court(Court.FEDERAL_APPELLATE,
+                                            row['CIRCUIT'], 'CIRCUIT')
 
         if row['DISTRICT']:
             if self.filetype == BANKR_2017:
-                matches = Court.objects.filter(
-                    jurisdiction=Court.FEDERAL_BANKRUPTCY,
-                    fjc_court_id=row['DISTRICT'],
-                )
+                jurisdiction = Court.FEDERAL_BANKRUPTCY
             else:
-                matches = Court.objects.filter(
-                    jurisdiction=Court.FEDERAL_DISTRICT,
-                    fjc_court_id=row['DISTRICT'],
-                )
+                jurisdiction = Court.FEDERAL_DISTRICT
+            row['DISTRICT'] = self.get_court(jurisdiction, row['DISTRICT'],
+                                             'DISTRICT')
 
-            if matches.count() == 1:
-                row['DISTRICT'] = matches[0]
-            else:
-                raise Exception("Unable to match DISTRICT column value %s to "
-                                "Court object" % row['DISTRICT'])
+    def build_court_map(self):
+        """Load every court with an FJC ID, so that rows can be matched to
+        courts without querying for them.
+        """
+        self.courts = {}
+        for court in Court.objects.exclude(fjc_court_id=''):
+            key = (court.jurisdiction, court.fjc_court_id)
+            self.courts.setdefault(key, []).append(court)
+
+    def get_court(self, jurisdiction, fjc_court_id, column):
+        matches = self.courts.get((jurisdiction, fjc_court_id), [])
+        if len(matches) == 1:
+            return matches[0]
+        raise Exception("Unable to match %s column value %s to Court "
+                        "object" % (column, fjc_court_id))
+
+    def make_item(self, row):
+        """Make an unsaved FjcIntegratedDatabase object from a row.
+
+        :return: The object, or None if the row's filetype isn't imported.
+        """
+        self.normalize_court_fields(row)
+        if self.filetype in [CV_2017, CR_2017]:
+            return self.import_row(row, self.filetype)
+        elif self.filetype == APP_2017:
+            return self.import_appellate_row(row, self.filetype)
 
     def import_row(self, row, source):
         values = {}
         for k, v in row.items():
             if k in self.field_mappings:
                 values[self.field_mappings[k]] = v
-        FjcIntegratedDatabase.objects.create(
+        return FjcIntegratedDatabase(
             dataset_source=source,
             **values
         )
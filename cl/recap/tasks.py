@@ -2,12 +2,14 @@
 import hashlib
 import logging
 import os
+from collections import OrderedDict, defaultdict
 from datetime import timedelta
 
 from celery.canvas import chain
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.utils import timezone
 from django.utils.timezone import now
@@ -15,6 +17,7 @@ from juriscraper.lib.string_utils import CaseNameTweaker
 from juriscraper.pacer import DocketReport, AttachmentPage, DocketHistoryReport
 
 from cl.celery import app
+from cl.lib.db_tools import bulk_update
 from cl.lib.import_lib import get_candidate_judges
 from cl.lib.pacer import map_cl_to_pacer_id, normalize_attorney_contact, \
     normalize_attorney_role, get_blocked_status
@@ -26,7 +29,8 @@ from cl.recap.models import ProcessingQueue, PacerHtmlFiles, APPELLATE_DOCKET, \
     APPELLATE_ATTACHMENT_PAGE, DOCKET_HISTORY_REPORT, PDF, ATTACHMENT_PAGE, \
     DOCKET
 from cl.scrapers.tasks import get_page_count, extract_recap_pdf
-from cl.search.models import Docket, RECAPDocument, DocketEntry
+from cl.search.models import Docket, RECAPDocument, DocketEntry, \
+    IndexChange
 from cl.search.tasks import add_or_update_recap_document, \
     add_or_update_recap_docket
 
@@ -229,110 +233,264 @@ def process_recap_pdf(self, pk):
 
     if not existing_document and not pq.debug:
         extract_recap_pdf(rd.pk)
-        add_or_update_recap_document([rd.pk], force_commit=False)
+        if not settings.INDEX_CHANGE_LOG_ENABLED:
+            add_or_update_recap_document([rd.pk], force_commit=False)
 
     mark_pq_successful(pq, d_id=rd.docket_entry.docket_id,
                        de_id=rd.docket_entry_id, rd_id=rd.pk)
     return rd
 
 
-def add_attorney(atty, p, d):
-    """Add/update an attorney.
+# The most attorney organizations to remember the pks of in each worker.
+# Popular firms appear on thousands of dockets, so most lookups hit.
+ORG_CACHE_SIZE = 10000
+_org_pks = OrderedDict()
 
-    Given an attorney node, and a party and a docket object, add the attorney
-    to the database or link the attorney to the new docket. Also add/update the
-    attorney organization, and the attorney's role in the case.
 
+def get_org_pks(org_infos):
+    """Get the pks of attorney organizations, creating the ones that don't
+    exist yet.
+
+    Recently used organizations are remembered by lookup_key, so only the
+    ones that haven't been seen lately cost a query.
+
+    :param org_infos: A dict mapping lookup_keys to the fields of the
+    organizations, as made by normalize_attorney_contact.
+    :return: A dict mapping the lookup_keys to pks.
+    """
+    pks = {}
+    for key in org_infos.keys():
+        pk = _org_pks.pop(key, None)
+        if pk is not None:
+            pks[key] = pk
+
+    missing = set(org_infos.keys()) - set(pks.keys())
+    if missing:
+        pks.update(AttorneyOrganization.objects.filter(
+            lookup_key__in=missing,
+        ).values_list('lookup_key', 'pk'))
+    for key in missing - set(pks.keys()):
+        try:
+            with transaction.atomic():
+                org = AttorneyOrganization.objects.create(**org_infos[key])
+        except IntegrityError:
+            # Race condition. Item was created after get. Try again.
+            org = AttorneyOrganization.objects.get(lookup_key=key)
+        pks[key] = org.pk
+
+    if not transaction.get_connection().in_atomic_block:
+        # Only remember committed organizations, so that a rolled back
+        # transaction can't leave pks that don't exist in the cache. Add them
+        # back at the most recently used end.
+        for key, pk in pks.items():
+            _org_pks[key] = pk
+        while len(_org_pks) > ORG_CACHE_SIZE:
+            _org_pks.popitem(last=False)
+    return pks
+
+
+def attorney_matches(a, atty, atty_info, org_key, org_keys):
+    """Check an attorney against the contact info of an attorney on a docket,
+    the same way that add_attorneys would query for it.
+
+    :param a: An Attorney, saved or not.
     :param atty: A dict representing an attorney, as provided by Juriscraper.
-    :param p: A Party object
+    :param atty_info: The normalized contact info of atty.
+    :param org_key: The lookup_key of atty's organization, if any.
+    :param org_keys: The lookup_keys of a's organizations.
+    """
+    lookups = [
+        (a.phone, atty_info['phone']),
+        (a.fax, atty_info['fax']),
+        (a.email, atty_info['email']),
+        (a.contact_raw, atty['contact']),
+    ]
+    lookups = [(value, lookup) for value, lookup in lookups if lookup]
+    if not lookups and not org_key:
+        # Nothing to go on but the name.
+        return True
+    return (any(value == lookup for value, lookup in lookups) or
+            (org_key and org_key in org_keys))
+
+
+def add_attorneys(d, attorneys):
+    """Add/update attorneys, linking them to their parties on a docket.
+
+    Given attorney nodes, and the parties they represent on a docket, add the
+    attorneys to the database or link them to the docket. Also add/update their
+    organizations, and their roles in the case.
+
+    Attorneys appear once for every party they represent, so each distinct
+    attorney is normalized and matched once. Matching happens in memory
+    against every attorney with the same name, loaded in a single query, and
+    the results are written with bulk queries.
+
     :param d: A Docket object
-    :return: None if there's an error, or an Attorney object if not.
+    :param attorneys: A list of (atty, party) tuples, where atty is a dict
+    representing an attorney, as provided by Juriscraper, and party is a saved
+    Party object.
+    :return: A list with the Attorney object for each tuple, or None where
+    there was an error.
     """
     newest_docket_date = max([dt for dt in [d.date_filed, d.date_terminated,
                                             d.date_last_filing] if dt])
-    atty_org_info, atty_info = normalize_attorney_contact(
-        atty['contact'],
-        fallback_name=atty['name'],
-    )
-    try:
-        q = Q()
-        fields = {
-            ('phone', atty_info['phone']),
-            ('fax', atty_info['fax']),
-            ('email', atty_info['email']),
-            ('contact_raw', atty['contact']),
-            ('organizations__lookup_key', atty_org_info.get('lookup_key')),
-        }
-        for field, lookup in fields:
-            if lookup:
-                q |= Q(**{field: lookup})
-        a, created = Attorney.objects.filter(
-            Q(name=atty['name']) & q,
-        ).distinct().get_or_create(
-            defaults={
-                'name': atty['name'],
-                'date_sourced': newest_docket_date,
-                'contact_raw': atty['contact'],
-            },
-        )
-    except Attorney.MultipleObjectsReturned:
-        logger.info("Got too many results for attorney: '%s'. Punting." % atty)
-        return None
+    parsed = OrderedDict()
+    for atty, _ in attorneys:
+        key = (atty['name'], atty['contact'])
+        if key not in parsed:
+            parsed[key] = normalize_attorney_contact(
+                atty['contact'],
+                fallback_name=atty['name'],
+            )
 
-    # Associate the attorney with an org and update their contact info.
-    if atty['contact']:
-        if atty_org_info:
-            logger.info("Adding organization information to '%s': '%s'" %
-                        (atty['name'], atty_org_info))
-            try:
-                org = AttorneyOrganization.objects.get(
-                    lookup_key=atty_org_info['lookup_key'],
-                )
-            except AttorneyOrganization.DoesNotExist:
+    candidates = defaultdict(list)
+    by_pk = {}
+    for a in Attorney.objects.filter(name__in=set(k[0] for k in parsed)):
+        candidates[a.name].append(a)
+        by_pk[a.pk] = a
+    # The lookup_keys of each attorney's organizations, by id(attorney), since
+    # new attorneys don't have pks yet.
+    org_keys = defaultdict(set)
+    for a_pk, org_key in AttorneyOrganizationAssociation.objects.filter(
+            attorney__name__in=candidates.keys()).values_list(
+            'attorney_id', 'attorney_organization__lookup_key').distinct():
+        org_keys[id(by_pk[a_pk])].add(org_key)
+
+    # Match each distinct attorney in the order they appear, so that later
+    # ones can match attorneys made for earlier ones.
+    resolved = {}
+    to_create = []
+    to_update = {}
+    org_infos = {}
+    for key, (atty_org_info, atty_info) in parsed.items():
+        atty = {'name': key[0], 'contact': key[1]}
+        org_key = atty_org_info.get('lookup_key')
+        matches = [a for a in candidates[atty['name']] if attorney_matches(
+            a, atty, atty_info, org_key, org_keys[id(a)])]
+        if len(matches) > 1:
+            logger.info("Got too many results for attorney: '%s'. Punting." %
+                        atty)
+            resolved[key] = None
+            continue
+        elif matches:
+            a = matches[0]
+        else:
+            a = Attorney(
+                name=atty['name'],
+                date_sourced=newest_docket_date,
+                contact_raw=atty['contact'],
+            )
+            candidates[atty['name']].append(a)
+            to_create.append(a)
+        resolved[key] = a
+
+        # Associate the attorney with an org and update their contact info.
+        if atty['contact']:
+            if atty_org_info:
+                logger.info("Adding organization information to '%s': '%s'" %
+                            (atty['name'], atty_org_info))
+                org_infos[org_key] = atty_org_info
+                org_keys[id(a)].add(org_key)
+
+            docket_info_is_newer = (a.date_sourced <= newest_docket_date)
+            if atty_info and docket_info_is_newer:
+                logger.info("Updating atty info because %s is more recent "
+                            "than %s." % (newest_docket_date, a.date_sourced))
+                a.date_sourced = newest_docket_date
+                a.contact_raw = atty['contact']
+                a.email = atty_info['email']
+                a.phone = atty_info['phone']
+                a.fax = atty_info['fax']
+                if a.pk is not None:
+                    to_update[a.pk] = a
+
+    if to_create:
+        try:
+            with transaction.atomic():
+                Attorney.objects.bulk_create(to_create)
+        except IntegrityError:
+            # Race condition. Some were created after our query. Create the
+            # rest one at a time.
+            for a in to_create:
                 try:
-                    org = AttorneyOrganization.objects.create(**atty_org_info)
+                    with transaction.atomic():
+                        a.save()
                 except IntegrityError:
-                    # Race condition. Item was created after get. Try again.
-                    org = AttorneyOrganization.objects.get(
-                        lookup_key=atty_org_info['lookup_key'],
-                    )
+                    pass
+        # bulk_create doesn't set primary keys, so get them.
+        pks = dict(((name, contact_raw), pk) for pk, name, contact_raw in
+                   Attorney.objects.filter(
+                       name__in=set(a.name for a in to_create),
+                   ).values_list('pk', 'name', 'contact_raw'))
+        for a in to_create:
+            a.pk = pks[(a.name, a.contact_raw)]
+    for a in to_update.values():
+        a.date_modified = now()
+    bulk_update(to_update.values(), ['date_sourced', 'contact_raw', 'email',
+                                     'phone', 'fax', 'date_modified'])
+
+    # Add the attorneys to their organizations.
+    org_pks = get_org_pks(org_infos)
+    associations = set()
+    for key, (atty_org_info, _) in parsed.items():
+        a = resolved[key]
+        if a is not None and key[1] and atty_org_info:
+            associations.add((a.pk, org_pks[atty_org_info['lookup_key']]))
+    associations -= set(AttorneyOrganizationAssociation.objects.filter(
+        docket=d,
+    ).values_list('attorney_id', 'attorney_organization_id'))
+    AttorneyOrganizationAssociation.objects.bulk_create([
+        AttorneyOrganizationAssociation(
+            attorney_id=a_pk,
+            attorney_organization_id=org_pk,
+            docket=d,
+        ) for a_pk, org_pk in associations
+    ])
 
-            # Add the attorney to the organization
-            AttorneyOrganizationAssociation.objects.get_or_create(
-                attorney=a,
-                attorney_organization=org,
-                docket=d,
-            )
+    # Do roles. Delete the old roles, replace with new.
+    roles = OrderedDict()
+    for atty, p in attorneys:
+        a = resolved[(atty['name'], atty['contact'])]
+        if a is None:
+            continue
+        atty_roles = [normalize_attorney_role(r) for r in atty['roles']]
+        atty_roles = filter(lambda r: r['role'] is not None, atty_roles)
+        atty_roles = remove_duplicate_dicts(atty_roles)
+        if len(atty_roles) > 0:
+            logger.info("Linking attorney '%s' to party '%s' via %s roles: %s"
+                        % (atty['name'], p.name, len(atty_roles), atty_roles))
+        else:
+            logger.info("No role data parsed. Linking via 'UNKNOWN' role.")
+            atty_roles = [{'role': Role.UNKNOWN, 'date_action': None}]
+        roles[(a.pk, p.pk)] = atty_roles
+    if roles:
+        Role.objects.filter(pk__in=[
+            pk for pk, a_pk, p_pk in Role.objects.filter(docket=d).values_list(
+                'pk', 'attorney_id', 'party_id') if (a_pk, p_pk) in roles
+        ]).delete()
+        Role.objects.bulk_create([
+            Role(attorney_id=a_pk, party_id=p_pk, docket=d, **atty_role)
+            for (a_pk, p_pk), atty_roles in roles.items()
+            for atty_role in atty_roles
+        ])
+
+    return [resolved[(atty['name'], atty['contact'])] for atty, _ in
+            attorneys]
 
-        docket_info_is_newer = (a.date_sourced <= newest_docket_date)
-        if atty_info and docket_info_is_newer:
-            logger.info("Updating atty info because %s is more recent than %s."
-                        % (newest_docket_date, a.date_sourced))
-            a.date_sourced = newest_docket_date
-            a.contact_raw = atty['contact']
-            a.email = atty_info['email']
-            a.phone = atty_info['phone']
-            a.fax = atty_info['fax']
-            a.save()
-
-    # Do roles
-    atty_roles = [normalize_attorney_role(r) for r in atty['roles']]
-    atty_roles = filter(lambda r: r['role'] is not None, atty_roles)
-    atty_roles = remove_duplicate_dicts(atty_roles)
-    if len(atty_roles) > 0:
-        logger.info("Linking attorney '%s' to party '%s' via %s roles: %s" %
-                    (atty['name'], p.name, len(atty_roles), atty_roles))
-    else:
-        logger.info("No role data parsed. Linking via 'UNKNOWN' role.")
-        atty_roles = [{'role': Role.UNKNOWN, 'date_action': None}]
-
-    # Delete the old roles, replace with new.
-    Role.objects.filter(attorney=a, party=p, docket=d).delete()
-    Role.objects.bulk_create([
-        Role(attorney=a, party=p, docket=d, **atty_role) for
-        atty_role in atty_roles
-    ])
-    return a
+
+def add_attorney(atty, p, d):
+    """Add/update an attorney.
+
+    Given an attorney node, and a party and a docket object, add the attorney
+    to the database or link the attorney to the new docket. Also add/update the
+    attorney organization, and the attorney's role in the case.
+
+    :param atty: A dict representing an attorney, as provided by Juriscraper.
+    :param p: A Party object
+    :param d: A Docket object
+    :return: None if there's an error, or an Attorney object if not.
+    """
+    return add_attorneys(d, [(atty, p)])[0]
 
 
 def find_docket_object(court_id, pacer_case_id, docket_number):
@@ -409,106 +567,237 @@ def update_docket_metadata(d, docket_data):
 
 
 def add_docket_entries(d, docket_entries, tag=None):
-    """Update or create the docket entries and documents."""
-    rds_created = []
-    needs_solr_update = False
-    for docket_entry in docket_entries:
-        try:
-            de, de_created = DocketEntry.objects.get_or_create(
-                docket=d,
-                entry_number=docket_entry['document_number'],
-            )
-        except DocketEntry.MultipleObjectsReturned:
-            logger.error(
-                "Multiple docket entries found for document entry number '%s' "
-                "while processing '%s'" % (docket_entry['document_number'], d)
-            )
-            continue
-
-        de.description = docket_entry['description'] or de.description
-        de.date_filed = docket_entry['date_filed'] or de.date_filed
-        de.save()
-        if tag is not None:
-            de.tags.add(tag)
-
-        if de_created:
-            needs_solr_update = True
-
-        # Then make the RECAPDocument object. Try to find it. If we do, update
-        # the pacer_doc_id field if it's blank. If we can't find it, create it
-        # or throw an error.
-        params = {
-            'docket_entry': de,
-            # No attachments when uploading dockets.
-            'document_type': RECAPDocument.PACER_DOCUMENT,
-            'document_number': docket_entry['document_number'],
-        }
-        try:
-            rd = RECAPDocument.objects.get(**params)
-        except RECAPDocument.DoesNotExist:
+    """Update or create the docket entries and documents.
+
+    Rather than querying for every row of the docket, the docket's existing
+    entries and main documents are loaded at once and merged with the parsed
+    rows in memory. The differences are then written with bulk queries in a
+    single transaction.
+
+    :param d: The docket the entries belong to. It must already be saved.
+    :param docket_entries: The docket entries from the parsed docket. This is
+    typically the docket_data['docket_entries'] field.
+    :param tag: A Tag to add to the entries and to their existing documents.
+    :return: A tuple of a list of the RECAPDocuments that were created, and
+    whether any docket entries were created.
+    """
+    with transaction.atomic():
+        # Lock the docket, so that another upload of it can't add entries
+        # between loading them here and writing the changes.
+        Docket.objects.select_for_update().filter(pk=d.pk).exists()
+
+        entries = defaultdict(list)
+        for de in DocketEntry.objects.filter(docket=d):
+            entries[de.entry_number].append(de)
+        rds = defaultdict(list)
+        for rd in RECAPDocument.objects.filter(
+                docket_entry__docket=d,
+                document_type=RECAPDocument.PACER_DOCUMENT):
+            rds[(rd.docket_entry_id, rd.document_number)].append(rd)
+
+        de_to_create = OrderedDict()
+        de_to_update = {}
+        rd_to_update = {}
+        # Parsed rows for the documents that need creating, by entry number.
+        rd_to_create = OrderedDict()
+        rds_to_tag = set()
+        entry_numbers = set()
+        for docket_entry in docket_entries:
             try:
-                rd = RECAPDocument.objects.create(
-                    pacer_doc_id=docket_entry['pacer_doc_id'],
-                    is_available=False,
-                    **params
+                entry_number = int(docket_entry['document_number'])
+            except (TypeError, ValueError):
+                # Minute entries and the like have no number, and entries
+                # can't be saved without one.
+                logger.error(
+                    "Skipping docket entry without a valid entry number "
+                    "'%s' while processing '%s'" %
+                    (docket_entry['document_number'], d)
+                )
+                continue
+            existing = entries.get(entry_number, [])
+            if len(existing) > 1:
+                logger.error(
+                    "Multiple docket entries found for document entry number "
+                    "'%s' while processing '%s'" % (entry_number, d)
                 )
-            except ValidationError:
-                # Happens from race conditions.
                 continue
-            rds_created.append(rd)
-        except RECAPDocument.MultipleObjectsReturned:
-            logger.error(
-                "Multiple recap documents found for document entry number'%s' "
-                "while processing '%s'" % (docket_entry['document_number'], d)
+            entry_numbers.add(entry_number)
+            if existing:
+                de = existing[0]
+            else:
+                de = de_to_create.setdefault(entry_number, DocketEntry(
+                    docket=d,
+                    entry_number=entry_number,
+                ))
+
+            description = docket_entry['description'] or de.description
+            date_filed = docket_entry['date_filed'] or de.date_filed
+            if de.pk is not None and (description != de.description or
+                                      date_filed != de.date_filed):
+                de_to_update[de.pk] = de
+            de.description = description
+            de.date_filed = date_filed
+
+            # Then find the RECAPDocument. If it exists, update its pacer_doc_id
+            # if it's blank. Otherwise, create it.
+            existing = rds.get((de.pk, str(entry_number)), [])
+            if len(existing) > 1:
+                logger.error(
+                    "Multiple recap documents found for document entry number "
+                    "'%s' while processing '%s'" % (entry_number, d)
+                )
+            elif existing:
+                rd = existing[0]
+                pacer_doc_id = (rd.pacer_doc_id or
+                                docket_entry['pacer_doc_id'] or '')
+                description = (docket_entry.get('short_description') or
+                               rd.description)
+                if (pacer_doc_id != rd.pacer_doc_id or
+                        description != rd.description):
+                    rd.pacer_doc_id = pacer_doc_id
+                    rd.description = description
+                    rd_to_update[rd.pk] = rd
+                rds_to_tag.add(rd.pk)
+            elif entry_number not in rd_to_create:
+                rd_to_create[entry_number] = docket_entry
+
+        timestamp = now()
+        for obj in de_to_update.values() + rd_to_update.values():
+            obj.date_modified = timestamp
+        bulk_update(de_to_update.values(),
+                    ['description', 'date_filed', 'date_modified'])
+        bulk_update(rd_to_update.values(),
+                    ['pacer_doc_id', 'description', 'date_modified'])
+        de_pks = dict((n, entries[n][0].pk) for n in entry_numbers if
+                      n not in de_to_create)
+        if de_to_create:
+            DocketEntry.objects.bulk_create(de_to_create.values())
+            # bulk_create doesn't set primary keys, so get them.
+            de_pks.update(DocketEntry.objects.filter(
+                docket=d,
+                entry_number__in=de_to_create.keys(),
+            ).values_list('entry_number', 'pk'))
+
+        rds_created = []
+        if rd_to_create:
+            RECAPDocument.objects.bulk_create([
+                RECAPDocument(
+                    docket_entry_id=de_pks[entry_number],
+                    # No attachments when uploading dockets.
+                    document_type=RECAPDocument.PACER_DOCUMENT,
+                    document_number=str(entry_number),
+                    pacer_doc_id=docket_entry['pacer_doc_id'] or '',
+                    is_available=False,
+                ) for entry_number, docket_entry in rd_to_create.items()
+            ])
+            existing_rd_pks = set(rd.pk for rd_list in rds.values() for rd in
+                                  rd_list)
+            rds_created = [rd for rd in RECAPDocument.objects.filter(
+                docket_entry_id__in=[de_pks[n] for n in rd_to_create.keys()],
+                document_type=RECAPDocument.PACER_DOCUMENT,
+            ).order_by('pk') if rd.pk not in existing_rd_pks]
+
+        if tag is not None:
+            de_ids = set(de_pks[n] for n in entry_numbers)
+            DocketEntry.tags.through.objects.bulk_create([
+                DocketEntry.tags.through(docketentry_id=pk, tag_id=tag.pk)
+                for pk in de_ids - set(tag.docket_entries.filter(
+                    pk__in=de_ids).values_list('pk', flat=True))
+            ])
+            RECAPDocument.tags.through.objects.bulk_create([
+                RECAPDocument.tags.through(recapdocument_id=pk, tag_id=tag.pk)
+                for pk in rds_to_tag - set(tag.recap_documents.filter(
+                    pk__in=rds_to_tag).values_list('pk', flat=True))
+            ])
+
+        if settings.INDEX_CHANGE_LOG_ENABLED:
+            # Bulk queries don't send signals, so log the changes here.
+            IndexChange.objects.bulk_create(
+                [IndexChange(item_type='search.DocketEntry', item_pk=pk,
+                             reason=IndexChange.SAVE)
+                 for pk in set(de_to_update) |
+                 set(de_pks[n] for n in de_to_create.keys())] +
+                [IndexChange(item_type='search.RECAPDocument', item_pk=rd.pk,
+                             reason=IndexChange.SAVE)
+                 for rd in rd_to_update.values() + rds_created]
             )
-            continue
-        else:
-            rd.pacer_doc_id = rd.pacer_doc_id or docket_entry['pacer_doc_id']
-            rd.description = docket_entry.get('short_description') or rd.description
-            if tag is not None:
-                rd.tags.add(tag)
 
-    return rds_created, needs_solr_update
+    return rds_created, bool(de_to_create)
 
 
 def add_parties_and_attorneys(d, parties):
     """Add parties and attorneys from the docket data to the docket.
 
+    The parties, their types on the docket and their attorneys are each looked
+    up with a few queries for the whole docket, instead of several queries per
+    party and attorney.
+
     :param d: The docket to update
     :param parties: The parties to update the docket with, with their associated
     attorney objects. This is typically the docket_data['parties'] field.
     :return: None
     """
+    names = set(party['name'] for party in parties)
+    existing = defaultdict(list)
+    for p in Party.objects.filter(name__in=names):
+        existing[p.name].append(p)
+
+    # Create the new parties, with the last extra_info given for each name.
+    new_parties = OrderedDict()
     for party in parties:
+        if not existing[party['name']]:
+            p = new_parties.setdefault(party['name'], Party(
+                name=party['name'],
+                extra_info=party['extra_info'],
+            ))
+            p.extra_info = party['extra_info'] or p.extra_info
+    if new_parties:
         try:
-            p = Party.objects.get(name=party['name'])
-        except Party.DoesNotExist:
-            try:
-                p = Party.objects.create(
-                    name=party['name'],
-                    extra_info=party['extra_info'],
-                )
-            except IntegrityError:
-                # Race condition. Object was created after our get and before
-                # our create. Try to get it again.
-                p = Party.objects.get(
-                    name=party['name'],
-                    extra_info=party['extra_info'],
-                )
-        except Party.MultipleObjectsReturned:
-            continue
-        else:
-            if party['extra_info']:
-                p.extra_info = party['extra_info']
-                p.save()
-
-        # If the party type doesn't exist, make a new one.
-        if not p.party_types.filter(docket=d, name=party['type']).exists():
-            PartyType.objects.create(docket=d, party=p, name=party['type'])
+            with transaction.atomic():
+                Party.objects.bulk_create(new_parties.values())
+        except IntegrityError:
+            # Race condition. Some were created after our query. Create the
+            # rest one at a time.
+            for p in new_parties.values():
+                try:
+                    with transaction.atomic():
+                        p.save()
+                except IntegrityError:
+                    pass
+        # bulk_create doesn't set primary keys, so get them.
+        for p in Party.objects.filter(name__in=new_parties.keys()):
+            existing[p.name].append(p)
 
-        # Attorneys
-        for atty in party.get('attorneys', []):
-            add_attorney(atty, p, d)
+    resolved = []
+    to_update = {}
+    for party in parties:
+        matches = existing[party['name']]
+        if len(matches) != 1:
+            continue
+        p = matches[0]
+        if party['extra_info'] and p.extra_info != party['extra_info']:
+            p.extra_info = party['extra_info']
+            to_update[p.pk] = p
+        resolved.append((party, p))
+    for p in to_update.values():
+        p.date_modified = now()
+    bulk_update(to_update.values(), ['extra_info', 'date_modified'])
+
+    # If the party type doesn't exist, make a new one.
+    party_types = set(PartyType.objects.filter(docket=d).values_list(
+        'party_id', 'name'))
+    new_party_types = OrderedDict()
+    for party, p in resolved:
+        if (p.pk, party['type']) not in party_types:
+            new_party_types[(p.pk, party['type'])] = PartyType(
+                docket=d, party=p, name=party['type'])
+    PartyType.objects.bulk_create(new_party_types.values())
+
+    # Attorneys
+    attorneys = [(atty, p) for party, p in resolved for atty in
+                 party.get('attorneys', [])]
+    if attorneys:
+        add_attorneys(d, attorneys)
 
 
 def process_orphan_documents(rds_created, court_id, docket_date):
@@ -713,8 +1002,11 @@ def process_recap_attachment(self, pk):
                 if needs_save:
                     rd.save()
 
-                # Do *not* do this async — that can cause race conditions.
-                add_or_update_recap_document([rd.pk], force_commit=False)
+                if not settings.INDEX_CHANGE_LOG_ENABLED:
+                    # Do *not* do this async — that can cause race
+                    # conditions.
+                    add_or_update_recap_document([rd.pk],
+                                                 force_commit=False)
 
     mark_pq_successful(pq, d_id=de.docket_id, de_id=de.pk)
     process_orphan_documents(rds_created, pq.court_id,
@@ -1,9 +1,10 @@
 # coding=utf-8
+import io
 import json
 import os
 
 import mock
-from datetime import date
+from datetime import date, timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import User
@@ -11,6 +12,7 @@ from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.utils.timezone import now
 from rest_framework.status import (
     HTTP_200_OK,
     HTTP_201_CREATED,
@@ -20,12 +22,15 @@ from rest_framework.status import (
 from rest_framework.test import APIClient
 
 from cl.people_db.models import Party, AttorneyOrganizationAssociation, \
-    Attorney, Role
+    Attorney, Role, PartyType
 from cl.recap.models import ProcessingQueue, DOCKET, ATTACHMENT_PAGE, PDF
 from cl.recap.tasks import process_recap_pdf, add_attorney, \
-    process_recap_docket, process_recap_attachment
-from cl.search.models import Docket, RECAPDocument, DocketEntry
-from cl.recap.management.commands.import_idb import Command
+    process_recap_docket, process_recap_attachment, add_docket_entries, \
+    add_parties_and_attorneys
+from cl.search.models import Docket, RECAPDocument, DocketEntry, Tag
+from cl.recap.management.commands.cl_process_recap_queue import \
+    Command as RecapQueueCommand, get_busy_cases, plan_uploads
+from cl.recap.management.commands.import_idb import Command, iter_lines
 
 
 @mock.patch('cl.recap.views.process_recap_upload')
@@ -260,7 +265,7 @@ class DebugRecapUploadtest(TestCase):
         self.assertEqual(RECAPDocument.objects.count(), 0)
         mock.assert_not_called()
 
-    @mock.patch('cl.recap.tasks.add_attorney')
+    @mock.patch('cl.recap.tasks.add_attorneys')
     def test_debug_does_not_create_docket(self, add_atty_mock):
         """If debug is passed, do we avoid creating a docket?"""
         pq = ProcessingQueue.objects.create(
@@ -518,8 +523,30 @@ class RecapAddAttorneyTest(TestCase):
         self.assertEqual(roles.count(), 2)
         self.assertNotIn(r, roles)
 
-
-@mock.patch('cl.recap.tasks.add_attorney')
+    def test_parties_and_attorneys_are_batched(self):
+        """Is an attorney who represents several parties added once, with
+        roles for each party, and does adding the same parties again avoid
+        duplicates?"""
+        parties = [{
+            'name': name,
+            'extra_info': '',
+            'type': 'Plaintiff',
+            'attorneys': [self.atty],
+        } for name in ('Party One', 'Party Two')]
+        add_parties_and_attorneys(self.d, parties)
+        add_parties_and_attorneys(self.d, parties)
+
+        self.assertEqual(2, Party.objects.filter(
+            name__in=['Party One', 'Party Two']).count())
+        self.assertEqual(2, PartyType.objects.filter(docket=self.d).count())
+        a = Attorney.objects.get(name=self.atty_name)
+        self.assertEqual(1, AttorneyOrganizationAssociation.objects.filter(
+            attorney=a, docket=self.d).count())
+        # Two roles for each of the two parties.
+        self.assertEqual(4, a.roles.filter(docket=self.d).count())
+
+
+@mock.patch('cl.recap.tasks.add_attorneys')
 class RecapDocketTaskTest(TestCase):
     def setUp(self):
         self.user = User.objects.get(username='recap')
@@ -613,6 +640,70 @@ class RecapDocketTaskTest(TestCase):
         self.assertEqual(pq.status, pq.PROCESSING_SUCCESSFUL)
 
 
+class RecapAddDocketEntriesTest(TestCase):
+    def setUp(self):
+        self.d = Docket.objects.create(
+            source=Docket.RECAP,
+            pacer_case_id='asdf',
+            court_id='scotus',
+        )
+        self.de = DocketEntry.objects.create(
+            docket=self.d,
+            entry_number=1,
+            description='Old description',
+        )
+        self.rd = RECAPDocument.objects.create(
+            docket_entry=self.de,
+            document_number='1',
+            document_type=RECAPDocument.PACER_DOCUMENT,
+        )
+        self.docket_entries = [{
+            'document_number': n,
+            'description': 'Entry %s' % n,
+            'date_filed': date(2017, 1, n),
+            'pacer_doc_id': '0350423105%s' % n,
+        } for n in (1, 2, 3)]
+
+    def test_merging_entries(self):
+        """Are new entries and documents created, and existing ones updated,
+        without duplicates?"""
+        tag = Tag.objects.create(name='test-tag')
+        rds_created, de_created = add_docket_entries(
+            self.d, self.docket_entries, tag=tag)
+        self.assertTrue(de_created)
+        self.assertEqual(['2', '3'],
+                         sorted(rd.document_number for rd in rds_created))
+        self.assertEqual(3, self.d.docket_entries.count())
+        self.de.refresh_from_db()
+        self.assertEqual('Entry 1', self.de.description)
+        self.rd.refresh_from_db()
+        self.assertEqual('03504231051', self.rd.pacer_doc_id)
+        self.assertEqual(3, tag.docket_entries.count())
+        self.assertEqual([self.rd.pk], list(
+            tag.recap_documents.values_list('pk', flat=True)))
+
+        # Doing it again changes nothing.
+        rds_created, de_created = add_docket_entries(
+            self.d, self.docket_entries, tag=tag)
+        self.assertEqual(([], False), (rds_created, de_created))
+        self.assertEqual(3, RECAPDocument.objects.filter(
+            docket_entry__docket=self.d).count())
+        self.assertEqual(3, tag.docket_entries.count())
+
+    def test_unnumbered_entries_are_skipped(self):
+        """Do entries without a number get skipped, without stopping the
+        rest of the docket from being merged?"""
+        unnumbered = [dict(self.docket_entries[0], document_number=n)
+                      for n in (None, '', 'A')]
+        rds_created, de_created = add_docket_entries(
+            self.d, unnumbered + self.docket_entries[1:])
+        self.assertTrue(de_created)
+        self.assertEqual(['2', '3'],
+                         sorted(rd.document_number for rd in rds_created))
+        self.assertEqual([1, 2, 3], sorted(
+            self.d.docket_entries.values_list('entry_number', flat=True)))
+
+
 @mock.patch('cl.recap.tasks.add_or_update_recap_document')
 class RecapAttachmentPageTaskTest(TestCase):
     def setUp(self):
@@ -668,6 +759,64 @@ class RecapAttachmentPageTaskTest(TestCase):
         self.assertEqual(self.pq.status, self.pq.QUEUED_FOR_RETRY)
 
 
+class RecapQueueSchedulingTest(TestCase):
+    """Are queued uploads ordered properly?"""
+
+    @staticmethod
+    def make_pq(pk, upload_type, pacer_case_id='1234'):
+        return ProcessingQueue(pk=pk, court_id='scotus',
+                               upload_type=upload_type,
+                               pacer_case_id=pacer_case_id)
+
+    def test_dockets_go_first_one_at_a_time(self):
+        """Are dockets processed first, and are repeated uploads of a docket
+        processed in order rather than dropped?"""
+        pdf = self.make_pq(1, PDF, pacer_case_id='999')
+        old_docket = self.make_pq(2, DOCKET)
+        new_docket = self.make_pq(3, DOCKET)
+        to_process, held = plan_uploads(
+            [pdf, old_docket, new_docket], set())
+        self.assertEqual(to_process, [old_docket, pdf])
+        self.assertEqual(held, [new_docket])
+
+        # Once the older one is done, the newer one goes.
+        to_process, held = plan_uploads([new_docket], set())
+        self.assertEqual((to_process, held), ([new_docket], []))
+
+    def test_pdfs_wait_for_their_dockets(self):
+        pdf = self.make_pq(1, PDF)
+        docket = self.make_pq(2, DOCKET)
+        to_process, held = plan_uploads([pdf, docket], set())
+        self.assertEqual(to_process, [docket])
+        self.assertEqual(held, [pdf])
+
+        # Once the docket is in progress, the PDF keeps waiting for it.
+        to_process, held = plan_uploads([pdf], {('scotus', '1234')})
+        self.assertEqual((to_process, held), ([], [pdf]))
+
+        # And once it's done, the PDF goes.
+        to_process, held = plan_uploads([pdf], set())
+        self.assertEqual((to_process, held), ([pdf], []))
+
+    @mock.patch('cl.recap.management.commands.cl_process_recap_queue.'
+                'process_recap_upload')
+    def test_claimed_dockets_make_their_case_busy(self, process_mock):
+        """Is a docket that waited a long time in the queue counted as in
+        progress once it's claimed?"""
+        pq = ProcessingQueue.objects.create(
+            court_id='scotus',
+            uploader=User.objects.get(username='recap'),
+            pacer_case_id='1234',
+            upload_type=DOCKET,
+        )
+        ProcessingQueue.objects.filter(pk=pq.pk).update(
+            date_modified=now() - timedelta(days=1))
+        max_age = timedelta(minutes=30)
+        self.assertEqual(set(), get_busy_cases(max_age))
+        RecapQueueCommand.process_uploads([pq])
+        self.assertEqual({('scotus', '1234')}, get_busy_cases(max_age))
+
+
 class RecapUploadAuthenticationTest(TestCase):
 
     def setUp(self):
@@ -716,3 +865,13 @@ class IdbImportTest(TestCase):
                 qa[1],
             )
 
+    def test_reading_lines_from_an_offset(self):
+        f = io.BytesIO(b'a\tb\r\nc\nd\te\r\nf\tg')
+        lines = list(iter_lines(f, block_size=3))
+        self.assertEqual(lines, [
+            (5, b'a\tb'),
+            (12, b'c\nd\te'),
+            (15, b'f\tg'),
+        ])
+        # Resuming from the offset of a line gets the lines after it.
+        self.assertEqual(list(iter_lines(f, start_offset=5)), lines[1:])
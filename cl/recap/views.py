@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework.viewsets import ModelViewSet
 
 from cl.api.utils import RECAPUploaders, LoggingMixin, RECAPUsersReadOnly, \
@@ -22,7 +23,8 @@ class PacerProcessingQueueViewSet(LoggingMixin, ModelViewSet):
 
     def perform_create(self, serializer):
         pq = serializer.save(uploader=self.request.user)
-        process_recap_upload(pq)
+        if not settings.RECAP_SCHEDULE_UPLOADS:
+            process_recap_upload(pq)
 
 
 class PacerDocIdLookupViewSet(LoggingMixin, ModelViewSet):
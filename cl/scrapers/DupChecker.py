@@ -1,7 +1,63 @@
+import threading
+from collections import OrderedDict
+
 from cl.scrapers.models import UrlHash
 
 from juriscraper.AbstractSite import logger
 
+# The number of download URLs to remember for each court and type of item.
+RECENT_ITEMS_SIZE = 1000
+
+
+class RecentItems(object):
+    """A bounded, least-recently-used map of the download URLs of items we
+    have to the sha1s of their content.
+    """
+    def __init__(self, max_size=RECENT_ITEMS_SIZE):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    def __contains__(self, download_url):
+        return download_url in self.items
+
+    def get(self, download_url):
+        sha1 = self.items.pop(download_url, None)
+        if sha1 is not None:
+            # Move it to the most recently used end.
+            self.items[download_url] = sha1
+        return sha1
+
+    def add(self, download_url, sha1):
+        self.items.pop(download_url, None)
+        self.items[download_url] = sha1
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def discard(self, download_url):
+        self.items.pop(download_url, None)
+
+
+# Recent items are kept for the life of the process, so that a daemon can
+# skip downloading unchanged items without a query. Other processes can
+# delete items in the meantime, so they are only used to skip downloads.
+# Whether an item is a duplicate is always confirmed against the database.
+_recent_items = {}
+_recent_items_lock = threading.Lock()
+
+
+def get_recent_items(court_id, object_type):
+    key = (court_id, object_type._meta.app_label,
+           object_type._meta.object_name)
+    with _recent_items_lock:
+        if key not in _recent_items:
+            _recent_items[key] = RecentItems()
+        return _recent_items[key]
+
+
+def clear_recent_items():
+    with _recent_items_lock:
+        _recent_items.clear()
+
 
 class DupChecker(dict):
     def __init__(self, court, full_crawl=False, dup_threshold=5,
@@ -13,6 +69,9 @@ class DupChecker(dict):
         self.dup_count = 0
         self.last_found_date = None
         self.emulate_break = False
+        self.recent_items = None
+        self.known_sha1s = set()
+        self.known_urls = set()
         super(DupChecker, self).__init__(*args, **kwargs)
 
     def _increment(self, current_date):
@@ -67,6 +126,66 @@ class DupChecker(dict):
             # no matter what.
             return False
 
+    def prefetch(self, object_type, download_urls):
+        """Look up which of a site's items we already have, so that press_on
+        doesn't need a query for each of them and unchanged items needn't be
+        downloaded.
+
+        URLs that were seen recently by this process needn't be downloaded,
+        but press_on still checks the database for them, since they may have
+        been deleted. The rest are looked up with a single query.
+
+        :param object_type: The model of the items, Opinion or Audio.
+        :param download_urls: The download URLs of the site's items.
+        """
+        self.recent_items = get_recent_items(self.court.pk, object_type)
+        unknown_urls = set(url for url in download_urls if
+                           url and url not in self.recent_items)
+        self.known_urls = set()
+        self.known_sha1s = set()
+        if unknown_urls:
+            for url, sha1 in object_type.objects.filter(
+                    download_url__in=unknown_urls,
+            ).values_list('download_url', 'sha1'):
+                self.recent_items.add(url, sha1)
+                self.known_urls.add(url)
+                self.known_sha1s.add(sha1)
+
+    def get_known_sha1s(self, download_urls):
+        """Get the sha1s of the items we already have, so they needn't be
+        downloaded.
+
+        Items at known URLs are assumed to be unchanged. That isn't assumed
+        during full crawls, which always download everything.
+
+        :param download_urls: The download URLs of the site's items.
+        :return: A dict mapping the download URLs of items we have to their
+        sha1s.
+        """
+        if self.full_crawl or self.recent_items is None:
+            return {}
+        known = {}
+        for url in download_urls:
+            sha1 = self.recent_items.get(url)
+            if sha1 is not None:
+                known[url] = sha1
+        return known
+
+    def remember(self, download_url, sha1):
+        """Note that we have an item, so it needn't be downloaded again."""
+        if self.recent_items is not None and download_url:
+            self.recent_items.add(download_url, sha1)
+            self.known_urls.add(download_url)
+            self.known_sha1s.add(sha1)
+
+    def forget(self, download_url):
+        """Note that an item we thought we had is gone, for example because
+        it was deleted, so it's downloaded the next time it's seen.
+        """
+        if self.recent_items is not None:
+            self.recent_items.discard(download_url)
+        self.known_urls.discard(download_url)
+
     def press_on(self, object_type, current_date, next_date, lookup_value,
                  lookup_by='sha1'):
         """Checks if a we have an `object_type` with identical content in the CL
@@ -93,11 +212,15 @@ class DupChecker(dict):
         if self.emulate_break:
             return False
 
-        # check for a duplicate in the db.
+        # check for a duplicate in what was queried for this crawl, then in
+        # the db.
         if lookup_by == 'sha1':
-            exists = object_type.objects.filter(sha1=lookup_value).exists()
+            exists = (lookup_value in self.known_sha1s or
+                      object_type.objects.filter(sha1=lookup_value).exists())
         elif lookup_by == 'download_url':
-            exists = object_type.objects.filter(download_url=lookup_value).exists()
+            exists = (lookup_value in self.known_urls or
+                      object_type.objects.filter(
+                          download_url=lookup_value).exists())
         else:
             raise NotImplementedError('Unknown lookup_by parameter.')
 
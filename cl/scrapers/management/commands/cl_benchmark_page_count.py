@@ -0,0 +1,87 @@
+import os
+import time
+
+from PyPDF2 import PdfFileReader
+from django.conf import settings
+
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.lib.pdf_utils import PDFParseError, count_pages
+
+
+def find_pdfs(directory):
+    for root, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if filename.lower().endswith('.pdf'):
+                yield os.path.join(root, filename)
+
+
+def count_with_pypdf2(path):
+    return int(PdfFileReader(path).getNumPages())
+
+
+def time_counts(f, paths, repeat):
+    """Count the pages of every file with f, repeat times over.
+
+    :return: A tuple of the seconds taken and a dict mapping paths to their
+    counts, or to the exception f raised.
+    """
+    counts = {}
+    t1 = time.time()
+    for _ in range(repeat):
+        for path in paths:
+            try:
+                counts[path] = f(path)
+            except Exception as e:
+                counts[path] = e
+    return time.time() - t1, counts
+
+
+class Command(VerboseCommand):
+    help = ('Compare the speed and accuracy of counting PDF pages with PyPDF2 '
+            'and with the streaming page counter.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=os.path.join(settings.MEDIA_ROOT, 'test'),
+            help="A directory of PDFs to count the pages of. Defaults to the "
+                 "test assets.",
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help="How many times to count each file.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        paths = list(find_pdfs(options['path']))
+        repeat = options['repeat']
+        logger.info("Benchmarking with %s PDFs, %s times each." %
+                    (len(paths), repeat))
+
+        pypdf2_seconds, expected = time_counts(count_with_pypdf2, paths,
+                                               repeat)
+        fast_seconds, actual = time_counts(count_pages, paths, repeat)
+
+        fallbacks = [p for p in paths if isinstance(actual[p], PDFParseError)]
+        wrong = [p for p in paths if p not in fallbacks and
+                 actual[p] != expected[p]]
+        logger.info("  PyPDF2: %.2f ms per file" %
+                    (pypdf2_seconds * 1000 / (len(paths) * repeat or 1)))
+        logger.info("  Streaming: %.2f ms per file, %.1fx faster" % (
+            fast_seconds * 1000 / (len(paths) * repeat or 1),
+            pypdf2_seconds / (fast_seconds or 1),
+        ))
+        logger.info("  %s of %s files need the PyPDF2 fallback." %
+                    (len(fallbacks), len(paths)))
+        for path in fallbacks:
+            logger.info("    %s: %s" % (path, actual[path]))
+        if wrong:
+            logger.warn("  Counts differed for %s files:" % len(wrong))
+            for path in wrong:
+                logger.warn("    %s: %s, but PyPDF2 says %s" %
+                            (path, actual[path], expected[path]))
+        else:
+            logger.info("  All other counts matched PyPDF2.")
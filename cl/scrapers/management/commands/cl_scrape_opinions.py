@@ -4,9 +4,13 @@ import signal
 import sys
 import time
 import traceback
+from collections import defaultdict
 from datetime import date
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
 
 from celery.task.sets import subtask
+from django import db
 from django.core.files.base import ContentFile
 from django.core.management.base import CommandError
 from django.utils.encoding import force_bytes
@@ -21,7 +25,8 @@ from cl.scrapers.DupChecker import DupChecker
 from cl.scrapers.models import ErrorLog
 from cl.scrapers.tasks import extract_doc_content, extract_by_ocr
 from cl.scrapers.utils import (
-    get_extension, get_binary_content, signal_handler
+    get_binary_content, get_extension, signal_handler, iter_downloads,
+    CourtStats,
 )
 from cl.search.models import Court
 from cl.search.models import Docket
@@ -38,6 +43,7 @@ class Command(VerboseCommand):
     def __init__(self, stdout=None, stderr=None, no_color=False):
         super(Command, self).__init__(stdout=None, stderr=None, no_color=False)
         self.cnt = CaseNameTweaker()
+        self.downloads_per_court = 2
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -76,6 +82,28 @@ class Command(VerboseCommand):
             default=False,
             help="Disable duplicate aborting.",
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help="The number of courts to scrape at the same time. Each "
+                 "court is still scraped at most once per --rate minutes.",
+        )
+        parser.add_argument(
+            '--host-concurrency',
+            type=int,
+            default=1,
+            help="The number of courts hosted on the same server that can be "
+                 "scraped at the same time.",
+        )
+        parser.add_argument(
+            '--downloads-per-court',
+            type=int,
+            default=2,
+            help="The number of downloads to run at once within a court, so "
+                 "that the next items download while the current one is "
+                 "processed.",
+        )
 
     def make_objects(self, item, court, sha1_hash, content):
         """Takes the meta data from the scraper and associates it with objects.
@@ -176,21 +204,34 @@ class Command(VerboseCommand):
         if not abort:
             if site.cookies:
                 logger.info("Using cookies: %s" % site.cookies)
-            for i, item in enumerate(site):
-                msg, r = get_binary_content(
-                    item['download_urls'],
-                    site.cookies,
-                    site._get_adapter_instance(),
-                    method=site.method
-                )
+            download_urls = [item['download_urls'] for item in site]
+            dup_checker.prefetch(Opinion, download_urls)
+            known_sha1s = dup_checker.get_known_sha1s(download_urls)
+
+            stats = CourtStats(site.court_id)
+            downloads = iter_downloads(
+                site, self.downloads_per_court, stats,
+                skip=lambda item: item['download_urls'] in known_sha1s,
+            )
+            for i, item, msg, r in downloads:
+                stats.items += 1
                 if msg:
                     logger.warn(msg)
                     ErrorLog(log_level='WARNING',
                              court=court,
                              message=msg).save()
+                    stats.errors += 1
                     continue
 
-                content = site.cleanup_content(r.content)
+                if r is None:
+                    # We have this item already, so it wasn't downloaded.
+                    content = None
+                    sha1_hash = known_sha1s[item['download_urls']]
+                else:
+                    content = site.cleanup_content(r.content)
+                    # request.content is sometimes a str, sometimes unicode,
+                    # so force it all to be bytes, pleasing hashlib.
+                    sha1_hash = hashlib.sha1(force_bytes(content)).hexdigest()
 
                 current_date = item['case_dates']
                 try:
@@ -198,9 +239,6 @@ class Command(VerboseCommand):
                 except IndexError:
                     next_date = None
 
-                # request.content is sometimes a str, sometimes unicode, so
-                # force it all to be bytes, pleasing hashlib.
-                sha1_hash = hashlib.sha1(force_bytes(content)).hexdigest()
                 if (court_str == 'nev' and
                         item['precedential_statuses'] == 'Unpublished'):
                     # Nevada's non-precedential cases have different SHA1
@@ -216,6 +254,23 @@ class Command(VerboseCommand):
                 if dup_checker.emulate_break:
                     break
 
+                if onwards and content is None:
+                    # We had this item when it was last seen, so it wasn't
+                    # downloaded, but it has since been deleted.
+                    dup_checker.forget(item['download_urls'])
+                    msg, r = get_binary_content(item['download_urls'],
+                                                site.cookies,
+                                                method=site.method)
+                    if msg:
+                        logger.warn(msg)
+                        ErrorLog(log_level='WARNING',
+                                 court=court,
+                                 message=msg).save()
+                        stats.errors += 1
+                        continue
+                    content = site.cleanup_content(r.content)
+                    sha1_hash = hashlib.sha1(force_bytes(content)).hexdigest()
+
                 if onwards:
                     # Not a duplicate, carry on
                     logger.info('Adding new document found at: %s' %
@@ -228,6 +283,7 @@ class Command(VerboseCommand):
 
                     if error:
                         download_error = True
+                        stats.errors += 1
                         continue
 
                     self.save_everything(
@@ -238,6 +294,8 @@ class Command(VerboseCommand):
                         },
                         index=False
                     )
+                    dup_checker.remember(item['download_urls'], sha1_hash)
+                    stats.added += 1
                     extract_doc_content.delay(
                         opinion.pk,
                         callback=subtask(extract_by_ocr),
@@ -249,6 +307,10 @@ class Command(VerboseCommand):
                         name=item['case_names'].encode('utf-8'),
                     ))
 
+            # Stop any downloads that are still running.
+            downloads.close()
+            stats.log()
+
             # Update the hash if everything finishes properly.
             logger.info("%s: Successfully crawled opinions." % site.court_id)
             if not download_error and not full_crawl:
@@ -259,30 +321,14 @@ class Command(VerboseCommand):
         site = mod.Site().parse()
         self.scrape_court(site, full_crawl)
 
-    def handle(self, *args, **options):
-        super(Command, self).handle(*args, **options)
-        global die_now
-
-        # this line is used for handling SIGTERM (CTRL+4), so things can die
-        # safely
-        signal.signal(signal.SIGTERM, signal_handler)
-
-        module_strings = build_module_list(options['court_id'])
-        if not len(module_strings):
-            raise CommandError('Unable to import module or package. Aborting.')
-
-        logger.info("Starting up the scraper.")
-        num_courts = len(module_strings)
-        wait = (options['rate'] * 60) / num_courts
-        i = 0
-        while i < num_courts:
-            # this catches SIGTERM, so the code can be killed safely.
-            if die_now:
-                logger.info("The scraper has stopped.")
-                sys.exit(1)
-
-            package, module = module_strings[i].rsplit('.', 1)
+    def scrape_module(self, module_string, full_crawl):
+        """Import and scrape a single Juriscraper module, logging any errors.
 
+        This runs in a worker thread, so it closes its database connection
+        when it's done.
+        """
+        package, module = module_string.rsplit('.', 1)
+        try:
             mod = __import__(
                 "%s.%s" % (package, module),
                 globals(),
@@ -291,7 +337,7 @@ class Command(VerboseCommand):
             )
             # noinspection PyBroadException
             try:
-                self.parse_and_scrape_site(mod, options['full_crawl'])
+                self.parse_and_scrape_site(mod, full_crawl)
             except Exception as e:
                 # noinspection PyBroadException
                 try:
@@ -313,16 +359,106 @@ class Command(VerboseCommand):
                     # This is very important. Without this, an exception
                     # above will crash the caller.
                     pass
-            finally:
-                time.sleep(wait)
-                last_court_in_list = (i == (num_courts - 1))
-                if last_court_in_list and options['daemon']:
-                    # Start over...
-                    logger.info("All jurisdictions done. Looping back to "
-                                "the beginning because daemon mode is enabled.")
-                    i = 0
-                else:
-                    i += 1
+        finally:
+            db.connection.close()
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        global die_now
+
+        # this line is used for handling SIGTERM (CTRL+4), so things can die
+        # safely
+        signal.signal(signal.SIGTERM, signal_handler)
 
+        module_strings = build_module_list(options['court_id'])
+        if not len(module_strings):
+            raise CommandError('Unable to import module or package. Aborting.')
+
+        logger.info("Starting up the scraper.")
+        self.downloads_per_court = options['downloads_per_court']
+        num_courts = len(module_strings)
+        interval = options['rate'] * 60
+        workers = options['workers']
+        # Spread the first crawl of each court over the interval. After that,
+        # each court is crawled again one interval after its last crawl began.
+        start = time.time()
+        scheduled = [ScheduledCourt(module_string,
+                                    start + interval * i / num_courts)
+                     for i, module_string in enumerate(module_strings)]
+        running = []
+        running_by_host = defaultdict(int)
+        pool = ThreadPool(workers)
+        while scheduled or running:
+            # this catches SIGTERM, so the code can be killed safely.
+            if die_now:
+                logger.info("The scraper has stopped.")
+                sys.exit(1)
+
+            for court, result in running[:]:
+                if not result.ready():
+                    continue
+                running.remove((court, result))
+                running_by_host[court.host] -= 1
+                if options['daemon']:
+                    court.next_run = court.last_run + interval
+                    scheduled.append(court)
+                    if len(scheduled) == num_courts:
+                        logger.info("All jurisdictions done. Looping back "
+                                    "to the beginning because daemon mode "
+                                    "is enabled.")
+
+            scheduled.sort(key=lambda c: c.next_run)
+            for court in scheduled[:]:
+                if len(running) >= workers or court.next_run > time.time():
+                    break
+                if running_by_host[court.host] >= options['host_concurrency']:
+                    # Be polite to shared servers; try the next court.
+                    continue
+                scheduled.remove(court)
+                court.last_run = time.time()
+                running_by_host[court.host] += 1
+                running.append((court, pool.apply_async(
+                    self.scrape_module,
+                    (court.module_string, options['full_crawl']),
+                )))
+
+            time.sleep(1)
+
+        pool.close()
+        pool.join()
         logger.info("The scraper has stopped.")
         sys.exit(0)
+
+
+class ScheduledCourt(object):
+    """A court module and when it should next be crawled."""
+    def __init__(self, module_string, next_run):
+        self.module_string = module_string
+        self.next_run = next_run
+        self.last_run = None
+        self._host = None
+
+    @property
+    def host(self):
+        """The court's host, worked out when the court is first due, since
+        that means building its Site. Doing it for every court at startup
+        would hold up the first crawls.
+        """
+        if self._host is None:
+            self._host = get_host(self.module_string)
+        return self._host
+
+
+def get_host(module_string):
+    """Get the server a court's scraper crawls, so that courts on the same
+    server aren't crawled too many at a time.
+
+    Falls back to the module itself if its URL can't be determined.
+    """
+    package, module = module_string.rsplit('.', 1)
+    # noinspection PyBroadException
+    try:
+        mod = __import__(module_string, globals(), locals(), [module])
+        return urlparse(mod.Site().url).netloc or module_string
+    except Exception:
+        return module_string
@@ -15,7 +15,8 @@ from cl.scrapers.DupChecker import DupChecker
 from cl.scrapers.management.commands import cl_scrape_opinions
 from cl.scrapers.models import ErrorLog
 from cl.scrapers.tasks import process_audio_file
-from cl.scrapers.utils import get_extension, get_binary_content
+from cl.scrapers.utils import get_binary_content, get_extension, \
+    iter_downloads, CourtStats
 from cl.search.models import Court, Docket
 
 
@@ -106,21 +107,34 @@ class Command(cl_scrape_opinions.Command):
         if not abort:
             if site.cookies:
                 logger.info("Using cookies: %s" % site.cookies)
-            for i, item in enumerate(site):
-                msg, r = get_binary_content(
-                    item['download_urls'],
-                    site.cookies,
-                    site._get_adapter_instance(),
-                    method=site.method
-                )
+            download_urls = [item['download_urls'] for item in site]
+            dup_checker.prefetch(Audio, download_urls)
+            known_sha1s = dup_checker.get_known_sha1s(download_urls)
+
+            stats = CourtStats(site.court_id)
+            downloads = iter_downloads(
+                site, self.downloads_per_court, stats,
+                skip=lambda item: item['download_urls'] in known_sha1s,
+            )
+            for i, item, msg, r in downloads:
+                stats.items += 1
                 if msg:
                     logger.warn(msg)
                     ErrorLog(log_level='WARNING',
                              court=court,
                              message=msg).save()
+                    stats.errors += 1
                     continue
 
-                content = site.cleanup_content(r.content)
+                if r is None:
+                    # We have this item already, so it wasn't downloaded.
+                    content = None
+                    sha1_hash = known_sha1s[item['download_urls']]
+                else:
+                    content = site.cleanup_content(r.content)
+                    # request.content is sometimes a str, sometimes unicode,
+                    # so force it all to be bytes, pleasing hashlib.
+                    sha1_hash = hashlib.sha1(force_bytes(content)).hexdigest()
 
                 current_date = item['case_dates']
                 try:
@@ -128,9 +142,6 @@ class Command(cl_scrape_opinions.Command):
                 except IndexError:
                     next_date = None
 
-                # request.content is sometimes a str, sometimes unicode, so
-                # force it all to be bytes, pleasing hashlib.
-                sha1_hash = hashlib.sha1(force_bytes(content)).hexdigest()
                 onwards = dup_checker.press_on(
                     Audio,
                     current_date,
@@ -141,6 +152,23 @@ class Command(cl_scrape_opinions.Command):
                 if dup_checker.emulate_break:
                     break
 
+                if onwards and content is None:
+                    # We had this item when it was last seen, so it wasn't
+                    # downloaded, but it has since been deleted.
+                    dup_checker.forget(item['download_urls'])
+                    msg, r = get_binary_content(item['download_urls'],
+                                                site.cookies,
+                                                method=site.method)
+                    if msg:
+                        logger.warn(msg)
+                        ErrorLog(log_level='WARNING',
+                                 court=court,
+                                 message=msg).save()
+                        stats.errors += 1
+                        continue
+                    content = site.cleanup_content(r.content)
+                    sha1_hash = hashlib.sha1(force_bytes(content)).hexdigest()
+
                 if onwards:
                     # Not a duplicate, carry on
                     logger.info('Adding new document found at: %s' %
@@ -153,6 +181,7 @@ class Command(cl_scrape_opinions.Command):
 
                     if error:
                         download_error = True
+                        stats.errors += 1
                         continue
 
                     self.save_everything(
@@ -162,6 +191,8 @@ class Command(cl_scrape_opinions.Command):
                         },
                         index=False,
                     )
+                    dup_checker.remember(item['download_urls'], sha1_hash)
+                    stats.added += 1
                     process_audio_file.apply_async(
                         (audio_file.pk,),
                         countdown=random.randint(0, 3600)
@@ -174,6 +205,10 @@ class Command(cl_scrape_opinions.Command):
                         )
                     )
 
+            # Stop any downloads that are still running.
+            downloads.close()
+            stats.log()
+
             # Update the hash if everything finishes properly.
             logger.info("%s: Successfully crawled oral arguments." %
                         site.court_id)
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import logging
 import os
+import shutil
 import subprocess
+import threading
+import time
 import traceback
 import uuid
-from tempfile import NamedTemporaryFile
+from multiprocessing.pool import ThreadPool
+from tempfile import NamedTemporaryFile, mkdtemp
 
 import eyed3
 from PyPDF2 import PdfFileReader
@@ -22,15 +27,22 @@ from cl.audio.models import Audio
 from cl.celery import app
 from cl.citations.tasks import update_document_by_id
 from cl.custom_filters.templatetags.text_filters import best_case_name
+from cl.lib.extraction_cache import cache_extraction, get_cached_extraction, \
+    get_file_sha1
 from cl.lib.mojibake import fix_mojibake
+from cl.lib.pdf_utils import PDFParseError, count_pages
 from cl.lib.recap_utils import needs_ocr
 from cl.lib.string_utils import anonymize, trunc
-from cl.lib.utils import is_iter
+from cl.lib.utils import is_iter, mkdir_p
 from cl.scrapers.models import ErrorLog
 from cl.search.models import Opinion, RECAPDocument
 
 DEVNULL = open('/dev/null', 'w')
 
+EXTRACTION_FAILED_MSG = u'Unable to extract document content.'
+
+logger = logging.getLogger(__name__)
+
 
 def get_clean_body_content(content):
     """Parse out the body from an html string, clean it up, and send it along.
@@ -100,7 +112,7 @@ def extract_from_pdf(doc, path, callback=None):
         if success:
             doc.extracted_by_ocr = True
         elif content == '' or not success:
-            content = 'Unable to extract document content.'
+            content = EXTRACTION_FAILED_MSG
     elif 'e' not in content:
         # It's a corrupt PDF from ca9. Fix it.
         content = fix_mojibake(unicode(content, 'utf-8', errors='ignore'))
@@ -152,14 +164,21 @@ def extract_from_wpd(opinion, path):
     return opinion, content, err
 
 
-def convert_file_to_txt(path):
+def convert_file_to_txt(path, children=None):
+    """OCR an image with tesseract.
+
+    :param path: The path to the image.
+    :param children: A ChildProcesses object to track tesseract in, if any.
+    :return: The text.
+    """
     tesseract_command = ['tesseract', path, 'stdout', '-l', 'eng']
     p = subprocess.Popen(
         tesseract_command,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
     )
-    return p.communicate()[0].decode('utf-8')
+    stdout, _ = communicate(p, children)
+    return stdout.decode('utf-8')
 
 
 def get_page_count(path, extension):
@@ -170,6 +189,11 @@ def get_page_count(path, extension):
     :return: The number of pages if possible, else return None
     """
     if extension == 'pdf':
+        try:
+            return count_pages(path)
+        except (PDFParseError, EnvironmentError, ValueError):
+            # Fall back to a full parse, which handles more kinds of PDFs.
+            pass
         try:
             reader = PdfFileReader(path)
             return int(reader.getNumPages())
@@ -213,23 +237,39 @@ def extract_doc_content(pk, callback=None, citation_countdown=0):
     path = opinion.local_path.path
 
     extension = path.split('.')[-1]
-    if extension == 'doc':
-        content, err = extract_from_doc(path)
-    elif extension == 'html':
-        content, err = extract_from_html(path)
-    elif extension == 'pdf':
-        opinion, content, err = extract_from_pdf(opinion, path, callback)
-    elif extension == 'txt':
-        content, err = extract_from_txt(path)
-    elif extension == 'wpd':
-        opinion, content, err = extract_from_wpd(opinion, path)
+    cached = get_cached_extraction('opinion', opinion.sha1)
+    if cached is not None:
+        content, err = cached['content'], False
+        opinion.page_count = cached['page_count']
+        if cached['extracted_by_ocr']:
+            opinion.extracted_by_ocr = True
+        if extension == 'wpd' and 'not for publication' in content.lower():
+            opinion.precedential_status = "Unpublished"
     else:
-        print ('*****Unable to extract content due to unknown extension: %s '
-               'on opinion: %s****' % (extension, opinion))
-        return 2
+        if extension == 'doc':
+            content, err = extract_from_doc(path)
+        elif extension == 'html':
+            content, err = extract_from_html(path)
+        elif extension == 'pdf':
+            opinion, content, err = extract_from_pdf(opinion, path, callback)
+        elif extension == 'txt':
+            content, err = extract_from_txt(path)
+        elif extension == 'wpd':
+            opinion, content, err = extract_from_wpd(opinion, path)
+        else:
+            print ('*****Unable to extract content due to unknown extension: '
+                   '%s on opinion: %s****' % (extension, opinion))
+            return 2
+
+        # Do page count, if possible
+        opinion.page_count = get_page_count(path, extension)
 
-    # Do page count, if possible
-    opinion.page_count = get_page_count(path, extension)
+        if not err and content.strip() and content != EXTRACTION_FAILED_MSG:
+            cache_extraction('opinion', opinion.sha1, {
+                'content': content,
+                'page_count': opinion.page_count,
+                'extracted_by_ocr': opinion.extracted_by_ocr,
+            })
 
     # Do blocked status
     if extension in ['html', 'wpd']:
@@ -286,6 +326,19 @@ def extract_recap_pdf(pks, skip_ocr=False, check_if_needed=True):
             processed.append(pk)
             continue
         path = rd.filepath_local.path
+        sha1 = None
+        if settings.EXTRACTION_CACHE_DIR:
+            sha1 = rd.sha1 or get_file_sha1(path)
+        cached = get_cached_extraction('recap', sha1)
+        if cached is not None:
+            # OCR results are cached too, so even with skip_ocr, an earlier
+            # OCR of the same file is used.
+            rd.ocr_status = cached['ocr_status']
+            rd.plain_text, _ = anonymize(cached['content'])
+            rd.save(index=False, do_extraction=False)
+            processed.append(pk)
+            continue
+
         process = make_pdftotext_process(path)
         content, err = process.communicate()
 
@@ -296,7 +349,7 @@ def extract_recap_pdf(pks, skip_ocr=False, check_if_needed=True):
                 if success:
                     rd.ocr_status = RECAPDocument.OCR_COMPLETE
                 elif content == u'' or not success:
-                    content = u'Unable to extract document content.'
+                    content = EXTRACTION_FAILED_MSG
                     rd.ocr_status = RECAPDocument.OCR_FAILED
             else:
                 content = u''
@@ -304,6 +357,12 @@ def extract_recap_pdf(pks, skip_ocr=False, check_if_needed=True):
         else:
             rd.ocr_status = RECAPDocument.OCR_UNNECESSARY
 
+        if rd.ocr_status in (RECAPDocument.OCR_COMPLETE,
+                             RECAPDocument.OCR_UNNECESSARY):
+            cache_extraction('recap', sha1, {
+                'content': content,
+                'ocr_status': rd.ocr_status,
+            })
         rd.plain_text, _ = anonymize(content)
         # Do not do indexing here. Creates race condition in celery.
         rd.save(index=False, do_extraction=False)
@@ -312,13 +371,20 @@ def extract_recap_pdf(pks, skip_ocr=False, check_if_needed=True):
     return processed
 
 
-def rasterize_pdf(path, destination):
+def rasterize_pdf(path, destination, first_page=None, last_page=None,
+                  children=None):
     """Convert the PDF into a multipage Tiff file.
 
     This function uses ghostscript for processing and borrows heavily from:
 
         https://github.com/jbarlow83/OCRmyPDF/blob/636d1903b35fed6b07a01af53769fea81f388b82/ocrmypdf/ghostscript.py#L11
 
+    :param path: The path to the PDF.
+    :param destination: Where to save the Tiff. If it contains a format like
+    "%04d", each page is saved to its own file, numbered from one.
+    :param first_page: The first page to rasterize, counting from one.
+    :param last_page: The last page to rasterize.
+    :param children: A ChildProcesses object to track gs in, if any.
     """
     # gs docs, see: http://ghostscript.com/doc/7.07/Use.htm
     # gs devices, see: http://ghostscript.com/doc/current/Devices.htm
@@ -336,12 +402,15 @@ def rasterize_pdf(path, destination):
         '-sDEVICE=tiffgray',
         '-sCompression=lzw',
         '-r300x300',  # Set the resolution to 300 DPI.
-        '-o', destination,
-        path,
     ]
+    if first_page is not None:
+        gs.append('-dFirstPage=%s' % first_page)
+    if last_page is not None:
+        gs.append('-dLastPage=%s' % last_page)
+    gs.extend(['-o', destination, path])
     p = subprocess.Popen(gs, close_fds=True, stdout=subprocess.PIPE,
                          stderr=subprocess.PIPE, universal_newlines=True)
-    stdout, stderr = p.communicate()
+    stdout, stderr = communicate(p, children)
     return stdout, stderr, p.returncode
 
 
@@ -362,20 +431,274 @@ def cleanup_ocr_text(txt):
     return txt
 
 
-@app.task
-def extract_by_ocr(path):
-    """Extract the contents of a PDF using OCR."""
-    fail_msg = (u"Unable to extract the content from this file. Please try "
-                u"reading the original.")
-    with NamedTemporaryFile(prefix='ocr_', suffix=".tiff") as tmp:
-        out, err, returncode = rasterize_pdf(path, tmp.name)
+class RasterizationError(Exception):
+    pass
+
+
+class ChildProcesses(object):
+    """The processes that the threads of a page-parallel OCR run are waiting
+    on, so that they can all be killed if the run fails or is abandoned.
+
+    Threads can't be stopped from outside, but killing the process a thread
+    waits on lets it finish at once. Processes started after kill_all are
+    killed as soon as they're added.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.killed = False
+
+    def add(self, process):
+        with self.lock:
+            self.processes.add(process)
+            if not self.killed:
+                return
+        kill_process(process)
+
+    def remove(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+    def kill_all(self):
+        with self.lock:
+            self.killed = True
+            processes = list(self.processes)
+        for process in processes:
+            kill_process(process)
+
+
+def kill_process(process):
+    try:
+        process.kill()
+    except OSError:
+        # It already exited.
+        pass
+
+
+def communicate(process, children=None):
+    """Wait for a process to finish, tracking it in children while it runs.
+
+    :return: The process's stdout and stderr.
+    """
+    if children is None:
+        return process.communicate()
+    children.add(process)
+    try:
+        return process.communicate()
+    finally:
+        children.remove(process)
+
+
+class OCRStats(object):
+    """Timings for the pages of a page-parallel OCR run, for sizing the OCR
+    queue.
+    """
+    def __init__(self):
+        self.start = time.time()
+        # Tuples of (page number, rasterize seconds, OCR seconds, resumed)
+        self.pages = []
+
+    def add(self, page, rasterize_seconds, ocr_seconds, resumed):
+        self.pages.append((page, rasterize_seconds, ocr_seconds, resumed))
+
+    def summary(self):
+        done = [p for p in self.pages if not p[3]]
+        page_seconds = [p[1] + p[2] for p in done]
+        return {
+            'pages': len(self.pages),
+            'resumed_pages': len(self.pages) - len(done),
+            'rasterize_seconds': sum(p[1] for p in done),
+            'ocr_seconds': sum(p[2] for p in done),
+            'mean_page_seconds': (sum(page_seconds) / len(page_seconds)
+                                  if page_seconds else 0),
+            'max_page_seconds': max(page_seconds) if page_seconds else 0,
+            'wall_seconds': time.time() - self.start,
+        }
+
+    def log(self, path):
+        summary = self.summary()
+        summary['path'] = path
+        logger.info(
+            "OCRed %(pages)s pages of %(path)s (%(resumed_pages)s resumed) in "
+            "%(wall_seconds).1fs. Rasterizing took %(rasterize_seconds).1fs "
+            "and OCR took %(ocr_seconds).1fs in total, or "
+            "%(mean_page_seconds).1fs per page on average and "
+            "%(max_page_seconds).1fs at most." % summary
+        )
+
+
+def get_checkpoint_path(checkpoint_dir, page):
+    return os.path.join(checkpoint_dir, 'page_%04d.txt' % page)
+
+
+def ocr_page_range(path, first_page, last_page, checkpoint_dir=None,
+                   children=None):
+    """Rasterize and OCR a range of pages of a PDF.
+
+    If checkpoint_dir is given, the text of each page is saved there as soon
+    as it is done, and pages that were saved by an earlier, interrupted run are
+    not done again.
+
+    :param path: The path to the PDF.
+    :param first_page: The first page to OCR, counting from one.
+    :param last_page: The last page to OCR.
+    :param checkpoint_dir: A directory for the text of finished pages.
+    :param children: A ChildProcesses object to track gs and tesseract in, if
+    any.
+    :return: A list of (page number, text, rasterize seconds, OCR seconds,
+    resumed) tuples, one per page.
+    """
+    texts = {}
+    if checkpoint_dir is not None:
+        for page in range(first_page, last_page + 1):
+            checkpoint_path = get_checkpoint_path(checkpoint_dir, page)
+            if os.path.isfile(checkpoint_path):
+                with open(checkpoint_path) as f:
+                    texts[page] = f.read().decode('utf-8')
+    todo = [page for page in range(first_page, last_page + 1)
+            if page not in texts]
+
+    results = [(page, texts[page], 0, 0, True) for page in
+               range(first_page, todo[0] if todo else last_page + 1)]
+    if not todo:
+        return results
+
+    tmp_dir = mkdtemp(prefix='ocr_')
+    try:
+        # Pages after the first missing one are rasterized again even if they
+        # were saved, since that's one gs process instead of several.
+        t1 = time.time()
+        out, err, returncode = rasterize_pdf(
+            path, os.path.join(tmp_dir, 'page_%04d.tiff'),
+            first_page=todo[0], last_page=last_page, children=children,
+        )
         if returncode != 0:
-            return False, fail_msg
+            raise RasterizationError(err)
+        rasterize_seconds = (time.time() - t1) / (last_page - todo[0] + 1)
+
+        for i, page in enumerate(range(todo[0], last_page + 1), start=1):
+            if page in texts:
+                results.append((page, texts[page], 0, 0, True))
+                continue
+            t1 = time.time()
+            txt = convert_file_to_txt(
+                os.path.join(tmp_dir, 'page_%04d.tiff' % i), children)
+            results.append((page, txt, rasterize_seconds, time.time() - t1,
+                            False))
+            if checkpoint_dir is not None:
+                # Write and move into place, so a crash never leaves half a
+                # page behind.
+                checkpoint_path = get_checkpoint_path(checkpoint_dir, page)
+                with open('%s.tmp' % checkpoint_path, 'w') as f:
+                    f.write(txt.encode('utf-8'))
+                os.rename('%s.tmp' % checkpoint_path, checkpoint_path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def iter_ocr_pages(path, page_count, processes, pages_per_chunk,
+                   checkpoint_dir=None, stats=None):
+    """OCR a PDF a chunk of pages at a time, with several chunks in progress
+    at once, yielding the text of each page in order as it becomes available.
+
+    :param path: The path to the PDF.
+    :param page_count: The number of pages in the PDF.
+    :param processes: How many chunks to work on at once.
+    :param pages_per_chunk: How many pages to rasterize and OCR together.
+    :param checkpoint_dir: A directory for saving finished pages so that a
+    later call can resume where this one left off. See ocr_page_range.
+    :param stats: An OCRStats object to record the timing of each page in.
+    :return: Yields tuples of (page number, text). Raises RasterizationError
+    if ghostscript fails on any chunk.
+    """
+    children = ChildProcesses()
+    chunks = [(path, first, min(first + pages_per_chunk - 1, page_count),
+               checkpoint_dir, children)
+              for first in range(1, page_count + 1, pages_per_chunk)]
+    # gs and tesseract do the work in their own processes, so threads are
+    # enough to keep several of them busy. Unlike a process pool, threads
+    # also work inside celery's daemonic worker processes.
+    pool = ThreadPool(processes)
+    try:
+        for results in pool.imap(lambda args: ocr_page_range(*args), chunks):
+            for page, txt, rasterize_seconds, ocr_seconds, resumed in results:
+                if stats is not None:
+                    stats.add(page, rasterize_seconds, ocr_seconds, resumed)
+                yield page, txt
+    finally:
+        # Terminating the pool doesn't stop the threads that are running, so
+        # kill what they're waiting on. Otherwise a failed chunk leaves the
+        # other chunks' gs and tesseract processes running to the end.
+        children.kill_all()
+        pool.terminate()
+
+
+def get_ocr_checkpoint_dir(path):
+    """Get the directory where page-parallel OCR of a file saves its progress,
+    keyed by the file's content so that it survives renames.
+
+    :return: The path of the directory, or None if resuming is disabled.
+    """
+    if not settings.OCR_CHECKPOINT_DIR:
+        return None
+    checkpoint_dir = os.path.join(settings.OCR_CHECKPOINT_DIR,
+                                  get_file_sha1(path))
+    mkdir_p(checkpoint_dir)
+    return checkpoint_dir
 
-        txt = convert_file_to_txt(tmp.name)
-        txt = cleanup_ocr_text(txt)
 
-    return True, txt
+@app.task
+def extract_by_ocr(path, processes=None, pages_per_chunk=None, stats=None):
+    """Extract the contents of a PDF using OCR.
+
+    Short PDFs, or any PDF when processes is 1, are rasterized to a single
+    multipage Tiff and OCRed by one tesseract process. Longer ones are split
+    into chunks of pages that are rasterized and OCRed in parallel. See
+    iter_ocr_pages.
+
+    :param path: The path to the PDF.
+    :param processes: How many chunks to work on at once. Defaults to the
+    OCR_PROCESSES setting.
+    :param pages_per_chunk: How many pages are in a chunk. Defaults to the
+    OCR_PAGES_PER_CHUNK setting.
+    :param stats: An OCRStats object to record page timings in. One is made
+    and logged if not provided.
+    """
+    fail_msg = (u"Unable to extract the content from this file. Please try "
+                u"reading the original.")
+    processes = processes or settings.OCR_PROCESSES
+    pages_per_chunk = pages_per_chunk or settings.OCR_PAGES_PER_CHUNK
+    page_count = None
+    if processes > 1:
+        page_count = get_page_count(path, 'pdf')
+
+    if page_count is None or page_count <= pages_per_chunk:
+        with NamedTemporaryFile(prefix='ocr_', suffix=".tiff") as tmp:
+            out, err, returncode = rasterize_pdf(path, tmp.name)
+            if returncode != 0:
+                return False, fail_msg
+
+            txt = convert_file_to_txt(tmp.name)
+            txt = cleanup_ocr_text(txt)
+
+        return True, txt
+
+    log_stats = stats is None
+    stats = stats or OCRStats()
+    checkpoint_dir = get_ocr_checkpoint_dir(path)
+    try:
+        txt = u''.join(txt for _, txt in iter_ocr_pages(
+            path, page_count, processes, pages_per_chunk,
+            checkpoint_dir=checkpoint_dir, stats=stats,
+        ))
+    except RasterizationError:
+        return False, fail_msg
+    if log_stats:
+        stats.log(path)
+    if checkpoint_dir is not None:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    return True, cleanup_ocr_text(txt)
 
 
 def set_mp3_meta_data(audio_obj, mp3_path):
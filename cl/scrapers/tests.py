@@ -1,30 +1,42 @@
 # coding=utf-8
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
 from datetime import timedelta
 
+import mock
 from celery.task.sets import subtask
 from django.conf import settings
-from django.test import TestCase, override_settings
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.utils.timezone import now
 
 from cl.audio.models import Audio
 from cl.lib.test_helpers import IndexedSolrTestCase
-from cl.scrapers.DupChecker import DupChecker
+from cl.scrapers.DupChecker import DupChecker, clear_recent_items
 from cl.scrapers.management.commands import (
     cl_report_scrape_status, cl_scrape_opinions, cl_scrape_oral_arguments
 )
 from cl.scrapers.models import UrlHash, ErrorLog
 from cl.scrapers.tasks import (
-    extract_from_txt, extract_doc_content, extract_by_ocr, process_audio_file
+    extract_from_txt, extract_doc_content, extract_by_ocr, process_audio_file,
+    iter_ocr_pages, ocr_page_range, OCRStats, ChildProcesses
 )
 from cl.scrapers.test_assets import test_opinion_scraper, test_oral_arg_scraper
-from cl.scrapers.utils import get_extension
+from cl.scrapers.utils import get_extension, iter_downloads
 from cl.search.models import Court, Opinion
 
 
 class IngestionTest(IndexedSolrTestCase):
     fixtures = ['test_court.json']
 
+    def setUp(self):
+        super(IngestionTest, self).setUp()
+        # Items remembered by other tests may no longer be in the database.
+        clear_recent_items()
+
     def test_ingest_opinions(self):
         """Can we successfully ingest opinions at a high level?"""
         site = test_opinion_scraper.Site()
@@ -94,6 +106,52 @@ class ExtractionTest(TestCase):
                       "Issue extracting/encoding text from file at: %s" % path)
 
 
+class PageParallelOCRTest(TestCase):
+    path = os.path.join(settings.MEDIA_ROOT, 'test', 'search',
+                        'opinion_pdf_image_based.pdf')
+
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def test_ocr_by_page(self):
+        """Do pages OCRed in chunks come back in order, with timings, and are
+        they saved for resuming?"""
+        stats = OCRStats()
+        pages = list(iter_ocr_pages(self.path, 1, 2, 1,
+                                    checkpoint_dir=self.checkpoint_dir,
+                                    stats=stats))
+        self.assertEqual([page for page, _ in pages], [1])
+        self.assertIn('intelligence', pages[0][1].lower())
+        self.assertEqual(stats.summary()['pages'], 1)
+        self.assertEqual(stats.summary()['resumed_pages'], 0)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.checkpoint_dir, 'page_0001.txt')))
+
+    def test_resuming_from_checkpoint(self):
+        """Are pages that were already done read back instead of OCRed?"""
+        with open(os.path.join(self.checkpoint_dir, 'page_0001.txt'),
+                  'w') as f:
+            f.write('Saved text')
+        results = ocr_page_range(self.path, 1, 1,
+                                 checkpoint_dir=self.checkpoint_dir)
+        self.assertEqual(results, [(1, u'Saved text', 0, 0, True)])
+
+    def test_killing_child_processes(self):
+        """Are tracked processes killed when a run fails, along with any
+        that start afterwards?"""
+        children = ChildProcesses()
+        p = subprocess.Popen(['sleep', '30'])
+        children.add(p)
+        children.kill_all()
+        self.assertNotEqual(0, p.wait())
+        p = subprocess.Popen(['sleep', '30'])
+        children.add(p)
+        self.assertNotEqual(0, p.wait())
+
+
 class ReportScrapeStatusTest(TestCase):
     fixtures = ['test_court.json', 'judge_judy.json',
                 'test_objects_search.json']
@@ -132,6 +190,7 @@ class DupcheckerTest(TestCase):
     fixtures = ['test_court.json']
 
     def setUp(self):
+        clear_recent_items()
         self.court = Court.objects.get(pk='test')
         self.dup_checkers = [DupChecker(self.court, full_crawl=True),
                              DupChecker(self.court, full_crawl=False)]
@@ -238,6 +297,7 @@ class DupcheckerWithFixturesTest(TestCase):
 
     def setUp(self):
         super(DupcheckerWithFixturesTest, self).setUp()
+        clear_recent_items()
         self.court = Court.objects.get(pk='test')
 
         # Set the dup_threshold to zero for these tests
@@ -315,6 +375,49 @@ class DupcheckerWithFixturesTest(TestCase):
                     "We should have hit a break but didn't."
                 )
 
+    def test_prefetching_known_items(self):
+        """Are known items found with one query and skipped after that?"""
+        url = 'http://example.com/opinion.pdf'
+        Opinion.objects.filter(pk=1).update(download_url=url)
+        dup_checker = DupChecker(self.court, full_crawl=False)
+        with self.assertNumQueries(1):
+            dup_checker.prefetch(Opinion, [url, 'http://example.com/new.pdf'])
+        self.assertEqual({url: self.content_hash},
+                         dup_checker.get_known_sha1s([url]))
+        with self.assertNumQueries(0):
+            onwards = dup_checker.press_on(Opinion, now(), None,
+                                           lookup_value=self.content_hash)
+        self.assertFalse(onwards)
+
+        # Recently seen URLs don't need a query the next time.
+        dup_checker = DupChecker(self.court, full_crawl=False)
+        with self.assertNumQueries(0):
+            dup_checker.prefetch(Opinion, [url])
+        # Full crawls download everything.
+        dup_checker = DupChecker(self.court, full_crawl=True)
+        dup_checker.prefetch(Opinion, [url])
+        self.assertEqual({}, dup_checker.get_known_sha1s([url]))
+
+    def test_recent_items_are_confirmed(self):
+        """If an item seen recently is gone from the database, is it still
+        found to be new?
+        """
+        url = 'http://example.com/opinion.pdf'
+        Opinion.objects.filter(pk=1).update(download_url=url)
+        DupChecker(self.court).prefetch(Opinion, [url])
+        Opinion.objects.filter(pk=1).update(download_url='')
+
+        dup_checker = DupChecker(self.court, full_crawl=False)
+        dup_checker.prefetch(Opinion, [url])
+        # The download is skipped, but the database has the last word.
+        self.assertEqual({url: self.content_hash},
+                         dup_checker.get_known_sha1s([url]))
+        self.assertTrue(dup_checker.press_on(Opinion, now(), None,
+                                             lookup_value=url,
+                                             lookup_by='download_url'))
+        dup_checker.forget(url)
+        self.assertEqual({}, dup_checker.get_known_sha1s([url]))
+
 
 @override_settings(
     MEDIA_ROOT=os.path.join(settings.INSTALL_ROOT, 'cl/assets/media/test/')
@@ -345,3 +448,107 @@ class AudioFileTaskTest(TestCase):
             msg='We should end up with the proper duration of about %s. '
                 'Instead we got %s.' % (correct_duration, measured_duration)
         )
+
+
+class FakeSite(list):
+    """Just enough of a parsed Juriscraper Site for iter_downloads."""
+    court_id = 'juriscraper.opinions.united_states.federal_appellate.ca1'
+    cookies = {}
+    method = 'GET'
+
+    def __init__(self, count):
+        super(FakeSite, self).__init__(
+            {'download_urls': 'http://example.com/%s.pdf' % i}
+            for i in range(count)
+        )
+
+    def _get_adapter_instance(self):
+        return None
+
+
+@mock.patch('cl.scrapers.utils.get_adapter')
+class IterDownloadsTest(SimpleTestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.started = []
+        self.active = 0
+        self.max_active = 0
+
+    def fake_download(self, delay=lambda url: 0, wait=None):
+        """Make a get_binary_content stand-in that records what it was asked
+        for and how many downloads ran at once.
+        """
+        def download(url, cookies, adapter, method='GET'):
+            with self.lock:
+                self.started.append(url)
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+            if wait is not None and not url.endswith('/0.pdf'):
+                wait.wait()
+            time.sleep(delay(url))
+            with self.lock:
+                self.active -= 1
+            return '', url
+        return download
+
+    def test_items_are_yielded_in_order(self, get_adapter):
+        """Are items yielded in the site's order, even when later downloads
+        finish first, and are no more than lookahead run at once?
+        """
+        site = FakeSite(6)
+        # The first items take the longest.
+        delay = lambda url: 0.05 - 0.01 * int(url[-5])
+        with mock.patch('cl.scrapers.utils.get_binary_content',
+                        side_effect=self.fake_download(delay)):
+            results = list(iter_downloads(site, lookahead=3))
+        self.assertEqual([(i, item, '', item['download_urls'])
+                          for i, item in enumerate(site)], results)
+        self.assertLessEqual(self.max_active, 3)
+
+    def test_skipped_items_are_not_downloaded(self, get_adapter):
+        """Are skipped items yielded in place without being downloaded?"""
+        site = FakeSite(4)
+        skip = lambda item: item['download_urls'].endswith(('1.pdf', '2.pdf'))
+        with mock.patch('cl.scrapers.utils.get_binary_content',
+                        side_effect=self.fake_download()):
+            results = list(iter_downloads(site, skip=skip))
+        self.assertEqual([0, 1, 2, 3], [r[0] for r in results])
+        self.assertEqual([None, None], [r[3] for r in results[1:3]])
+        self.assertEqual(
+            sorted([site[0]['download_urls'], site[3]['download_urls']]),
+            sorted(self.started),
+        )
+
+    def test_closing_stops_new_downloads(self, get_adapter):
+        """Once the caller stops iterating, are no more downloads started?"""
+        site = FakeSite(6)
+        release = threading.Event()
+        with mock.patch('cl.scrapers.utils.get_binary_content',
+                        side_effect=self.fake_download(wait=release)):
+            downloads = iter_downloads(site, lookahead=2)
+            try:
+                next(downloads)
+                downloads.close()
+            finally:
+                release.set()
+            time.sleep(0.1)
+        # The second download may have been dropped before a thread took it.
+        self.assertIn(site[0]['download_urls'], self.started)
+        self.assertLessEqual(
+            set(self.started),
+            set(item['download_urls'] for item in site[:2]),
+        )
+
+    def test_downloads_share_the_court_adapter(self, get_adapter):
+        """Do all of a court's downloads use the adapter kept for that court,
+        so that they share its connections?
+        """
+        site = FakeSite(3)
+        with mock.patch('cl.scrapers.utils.get_binary_content',
+                        side_effect=self.fake_download()) as download:
+            list(iter_downloads(site))
+        self.assertEqual(3, get_adapter.call_count)
+        for call in get_adapter.call_args_list:
+            self.assertEqual(site.court_id, call[1]['key'])
+        for call in download.call_args_list:
+            self.assertIs(get_adapter.return_value, call[0][2])
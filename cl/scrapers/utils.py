@@ -1,9 +1,11 @@
 import mimetypes
 import os
+import time
 import traceback
+from collections import deque
+from multiprocessing.pool import ThreadPool
 from urlparse import urljoin
 
-import requests
 import sys
 from django.conf import settings
 from juriscraper.AbstractSite import logger
@@ -11,6 +13,7 @@ from juriscraper.lib.test_utils import MockRequest
 from lxml import html
 
 from cl.lib import magic
+from cl.lib.http_pool import conditional_get, get_adapter, get_session
 from cl.lib.celery_utils import CeleryThrottle
 from cl.scrapers.tasks import extract_recap_pdf
 from cl.search.models import RECAPDocument
@@ -82,13 +85,14 @@ def get_extension(content):
     return extension
 
 
-def get_binary_content(download_url, cookies, adapter, method='GET'):
+def get_binary_content(download_url, cookies, adapter=None, method='GET'):
     """ Downloads the file, covering a few special cases such as invalid SSL
     certificates and empty file errors.
 
     :param download_url: The URL for the item you wish to download.
     :param cookies: Cookies that might be necessary to download the item.
-    :param adapter: An HTTPAdapter for use when getting content.
+    :param adapter: An HTTPAdapter for use when getting content. If None,
+    the pooled adapter for the URL's host is used.
     :param method: The HTTP method used to get the item, or "LOCAL" to get an
     item during testing
     :return: Two values. The first is a msg indicating any errors encountered.
@@ -111,17 +115,19 @@ def get_binary_content(download_url, cookies, adapter, method='GET'):
         else:
             # Note that we do a GET even if site.method is POST. This is
             # deliberate.
-            s = requests.session()
-            s.mount('https://', adapter)
+            s = get_session(download_url, adapter=adapter)
             headers = {'User-Agent': 'CourtListener'}
-
-            r = s.get(
-                download_url,
-                verify=False,  # WA has a certificate we don't understand
-                headers=headers,
-                cookies=cookies,
-                timeout=300,
-            )
+            kwargs = {
+                'verify': False,  # WA has a certificate we don't understand
+                'headers': headers,
+                'cookies': cookies,
+                'timeout': 300,
+            }
+            if settings.HTTP_CACHE_DIR:
+                r = conditional_get(s, download_url, settings.HTTP_CACHE_DIR,
+                                    **kwargs)
+            else:
+                r = s.get(download_url, **kwargs)
 
             # test for empty files (thank you CA1)
             if len(r.content) == 0:
@@ -142,6 +148,88 @@ def get_binary_content(download_url, cookies, adapter, method='GET'):
     return '', r
 
 
+def iter_downloads(site, lookahead=2, stats=None, skip=None):
+    """Download the items of a site in the background, keeping up to
+    lookahead downloads in flight ahead of the item being processed.
+
+    Items are yielded in the order of the site. If the caller stops iterating
+    early, for example because it found a duplicate, no further downloads are
+    started and the pool is shut down when the generator is closed or garbage
+    collected.
+
+    :param site: A parsed Juriscraper Site object.
+    :param lookahead: The number of downloads to run at once.
+    :param stats: A CourtStats object to record download times in, if any.
+    :param skip: A function that takes an item and returns True if it
+    shouldn't be downloaded. Skipped items are yielded with an empty message
+    and a response of None.
+    :return: Yields tuples of the index of the item, the item, and the two
+    values returned by get_binary_content.
+    """
+    def download(item):
+        t1 = time.time()
+        # Share connections with the other downloads from this court.
+        adapter = get_adapter(
+            item['download_urls'],
+            key=site.court_id,
+            adapter_factory=site._get_adapter_instance,
+        ) if item['download_urls'] else None
+        result = get_binary_content(
+            item['download_urls'],
+            site.cookies,
+            adapter,
+            method=site.method
+        )
+        return result, time.time() - t1
+
+    pool = ThreadPool(lookahead)
+    pending = deque()
+    items = enumerate(site)
+    try:
+        while True:
+            for i, item in items:
+                if skip is not None and skip(item):
+                    pending.append((i, item, None))
+                    continue
+                pending.append((i, item, pool.apply_async(download, (item,))))
+                if len(pending) >= lookahead:
+                    break
+            if not pending:
+                break
+            i, item, result = pending.popleft()
+            if result is None:
+                yield i, item, '', None
+                continue
+            (msg, r), elapsed = result.get()
+            if stats is not None:
+                stats.download_times.append(elapsed)
+            yield i, item, msg, r
+    finally:
+        pool.terminate()
+
+
+class CourtStats(object):
+    """Progress and latency metrics for one crawl of a court."""
+    def __init__(self, court_id):
+        self.court_id = court_id
+        self.start = time.time()
+        self.items = 0
+        self.added = 0
+        self.errors = 0
+        self.download_times = []
+
+    def log(self):
+        downloads = self.download_times or [0]
+        logger.info(
+            "%s: %s items, %s added, %s errors in %.1fs. Downloads took "
+            "%.2fs on average and %.2fs at most." % (
+                self.court_id, self.items, self.added, self.errors,
+                time.time() - self.start,
+                sum(downloads) / len(downloads), max(downloads),
+            )
+        )
+
+
 def signal_handler(signal, frame):
     # Trigger this with CTRL+4
     logger.info('**************')
@@ -1,7 +1,10 @@
+import re
+
 from django.conf import settings
+from django.utils.encoding import force_text
 
 from cl.lib import search_utils
-from cl.lib.scorched_utils import ExtraSolrInterface
+from cl.lib.scorched_utils import get_solr_interface
 from cl.search import forms
 
 
@@ -45,6 +48,102 @@ def get_object_list(request=None, **kwargs):
     return sl
 
 
+def get_solr_conn(type):
+    """Get the Solr interface for a type of search."""
+    if type == 'o':
+        return get_solr_interface(settings.SOLR_OPINION_URL, mode='r')
+    elif type == 'oa':
+        return get_solr_interface(settings.SOLR_AUDIO_URL, mode='r')
+    elif type == 'r':
+        return get_solr_interface(settings.SOLR_RECAP_URL, mode='r')
+    elif type == 'p':
+        return get_solr_interface(settings.SOLR_PEOPLE_URL, mode='r')
+
+
+def add_tie_breaker(sort):
+    """Make a sort total by ending it with the unique key, as Solr requires
+    for cursors.
+    """
+    sort = sort or 'score desc'
+    fields = [clause.split()[0] for clause in sort.split(',') if
+              clause.strip()]
+    if 'id' not in fields:
+        sort = '%s, id asc' % sort
+    return sort
+
+
+def get_results(r):
+    """Get the documents of a Solr response as SolrObjects, with their text
+    snippets pulled up a level.
+    """
+    if r.group_field is None:
+        docs = r.result.docs
+    else:
+        # Flatten group results.
+        docs = [doc for group in getattr(r.groups, r.group_field)['groups']
+                for doc in group['doclist']['docs']]
+    results = []
+    for doc in docs:
+        doc['snippet'] = '&hellip;'.join(doc['solr_highlights']['text'])
+        results.append(SolrObject(initial=doc))
+    return results
+
+
+# Solr cursors are '*' or base64. Checking the format first means that most
+# bad cursors don't need a trip to Solr to be rejected.
+cursor_mark_re = re.compile(r'^(\*|[A-Za-z0-9+/]+=*)$')
+
+
+def is_cursor_error(e):
+    """Whether a SolrError was caused by a bad cursor, rather than something
+    like a bad query or a core that's down.
+
+    :param e: A SolrError, whose argument is the response from Solr.
+    """
+    detail = e.args[0] if e.args else ''
+    detail = getattr(detail, 'text', detail)
+    return 'cursorMark' in force_text(detail, errors='replace')
+
+
+class CursorPage(object):
+    """A page of search results fetched with a Solr cursor.
+
+    Solr cursors hold their place in the sort order, so fetching a page costs
+    the same no matter how deep it is, unlike start/rows paging, which makes
+    Solr collect and sort every result before the page.
+    """
+
+    def __init__(self, cd, cursor_mark, rows):
+        """
+        :param cd: The cleaned data of a SearchForm.
+        :param cursor_mark: The cursor from the last page, or '*' for the
+        first one.
+        :param rows: The number of results on a page.
+        """
+        main_query = search_utils.build_main_query(
+            cd,
+            highlight='text',
+            facet=False,
+            group=False,
+        )
+        main_query.update({
+            'caller': 'api_search_cursor',
+            'sort': add_tie_breaker(main_query.get('sort')),
+            'rows': rows,
+            'cursorMark': cursor_mark,
+        })
+        main_query.pop('start', None)
+        self.conn = get_solr_conn(cd['type'])
+        r = self.conn.query().add_extra(**main_query).execute()
+        self.results = get_results(r)
+        self.count = r.result.numFound
+        if r.next_cursor_mark == cursor_mark:
+            # Solr returns the same cursor once there are no more results.
+            self.next_cursor_mark = None
+        else:
+            self.next_cursor_mark = r.next_cursor_mark
+
+
 class SolrList(object):
     """This implements a yielding list object that fetches items as they are
     queried.
@@ -57,26 +156,7 @@ class SolrList(object):
         self.limit = limit
         self.type = type
         self._item_cache = []
-        if self.type == 'o':
-            self.conn = ExtraSolrInterface(
-                settings.SOLR_OPINION_URL,
-                mode='r',
-            )
-        elif self.type == 'oa':
-            self.conn = ExtraSolrInterface(
-                settings.SOLR_AUDIO_URL,
-                mode='r',
-            )
-        elif self.type == 'r':
-            self.conn = ExtraSolrInterface(
-                settings.SOLR_RECAP_URL,
-                mode='r',
-            )
-        elif self.type == 'p':
-            self.conn = ExtraSolrInterface(
-                settings.SOLR_PEOPLE_URL,
-                mode='r',
-            )
+        self.conn = get_solr_conn(self.type)
         self._length = length
 
     def __len__(self):
@@ -97,20 +177,7 @@ class SolrList(object):
     def __getitem__(self, item):
         self.main_query['start'] = self.offset
         r = self.conn.query().add_extra(**self.main_query).execute()
-
-        if r.group_field is None:
-            # Pull the text snippet up a level
-            for result in r.result.docs:
-                result['snippet'] = '&hellip;'.join(
-                        result['solr_highlights']['text'])
-                self._item_cache.append(SolrObject(initial=result))
-        else:
-            # Flatten group results, and pull up the text snippet as above.
-            for group in getattr(r.groups, r.group_field)['groups']:
-                for doc in group['doclist']['docs']:
-                    doc['snippet'] = '&hellip;'.join(
-                        doc['solr_highlights']['text'])
-                    self._item_cache.append(SolrObject(initial=doc))
+        self._item_cache.extend(get_results(r))
 
         # Now, assuming our _item_cache is all set, we just get the item.
         if isinstance(item, slice):
@@ -1,4 +1,8 @@
+from collections import OrderedDict
+
 from rest_framework import status, pagination, viewsets, permissions, response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from scorched.exc import SolrError
 
 from cl.api.utils import LoggingMixin, RECAPUsersReadOnly
 from cl.search import api_utils
@@ -125,6 +129,9 @@ class SearchViewSet(LoggingMixin, viewsets.ViewSet):
             if cd['q'] == '':
                 cd['q'] = '*'  # Get everything
 
+            if 'cursor' in request.GET:
+                return self.list_with_cursor(request, cd)
+
             paginator = pagination.PageNumberPagination()
             sl = api_utils.get_object_list(request, cd=cd, paginator=paginator)
 
@@ -141,3 +148,46 @@ class SearchViewSet(LoggingMixin, viewsets.ViewSet):
             search_form.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    @staticmethod
+    def list_with_cursor(request, cd):
+        """Page through results with cursors instead of page numbers.
+
+        Start with cursor=*, then follow the next links, which hold an opaque
+        cursor. Pages cost the same however deep they are. The total number
+        of results is only included on the first page, if count=on is
+        requested.
+        """
+        invalid_cursor = response.Response(
+            {'cursor': ['Invalid cursor.']},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+        cursor_mark = request.GET['cursor'] or '*'
+        if not api_utils.cursor_mark_re.match(cursor_mark):
+            return invalid_cursor
+        page_size = pagination.PageNumberPagination.page_size
+        try:
+            page = api_utils.CursorPage(cd, cursor_mark, page_size)
+        except SolrError as e:
+            if api_utils.is_cursor_error(e):
+                return invalid_cursor
+            raise
+
+        data = OrderedDict()
+        if request.GET.get('count') == 'on':
+            data['count'] = page.count
+        if page.next_cursor_mark is None:
+            data['next'] = None
+        else:
+            # The count is only wanted once, on the first page.
+            url = request.build_absolute_uri()
+            for param in ('page', 'count'):
+                url = remove_query_param(url, param)
+            data['next'] = replace_query_param(url, 'cursor',
+                                               page.next_cursor_mark)
+        data['results'] = SearchResultSerializer(
+            page.results,
+            many=True,
+            context={'schema': page.conn.schema}
+        ).data
+        return response.Response(data)
@@ -0,0 +1,148 @@
+import os
+import resource
+import shutil
+import tempfile
+import time
+from multiprocessing import Process, Queue
+
+import igraph
+import numpy as np
+
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.lib.pagerank import make_csr_graph, pagerank
+
+
+def make_edges(node_count, edge_count, seed):
+    """Make a random citation graph, where older nodes are cited more.
+
+    :return: Arrays of citing and cited nodes.
+    """
+    rng = np.random.RandomState(seed)
+    citing = rng.randint(1, node_count, size=edge_count)
+    # Skew citations towards low pks, as with old, well-known cases.
+    cited = (citing * rng.power(0.5, size=edge_count)).astype(np.int64)
+    return citing, cited
+
+
+def iter_chunks(citing, cited, chunk_size):
+    """Yield edges in chunks of tuples, like a database cursor would."""
+    for i in range(0, len(citing), chunk_size):
+        yield list(zip(citing[i:i + chunk_size].tolist(),
+                       cited[i:i + chunk_size].tolist()))
+
+
+def prepare_cold(citing, cited, options):
+    return citing, cited, None
+
+
+def prepare_warm(citing, cited, options):
+    """Compute pagerank, then add some citations, so that the new graph's
+    pagerank can be computed starting from the first scores.
+    """
+    scores, _ = pagerank(make_csr_graph(iter_chunks(citing, cited, 100000)))
+    new_count = int(len(citing) * options['new_fraction'])
+    new_citing, new_cited = make_edges(options['nodes'], new_count,
+                                       options['seed'] + 1)
+    return (np.concatenate([citing, new_citing]),
+            np.concatenate([cited, new_cited]),
+            scores)
+
+
+def run_igraph(citing, cited, initial):
+    edges = [e for chunk in iter_chunks(citing, cited, 100000)
+             for e in chunk]
+    g = igraph.Graph(directed=True, edges=edges)
+    return np.array(g.pagerank()), None
+
+
+def run_csr(citing, cited, initial):
+    graph = make_csr_graph(iter_chunks(citing, cited, 100000))
+    if initial is not None:
+        initial = np.resize(initial, graph.node_count)
+    return pagerank(graph, initial=initial)
+
+
+RUNNERS = (
+    ('igraph', prepare_cold, run_igraph),
+    ('csr', prepare_cold, run_csr),
+    ('csr-warm', prepare_warm, run_csr),
+)
+
+
+def measure(name, options, out_dir, queue):
+    """Run a benchmark in its own process, so that its peak memory use can be
+    measured apart from the others.
+    """
+    _, prepare, run = dict((r[0], r) for r in RUNNERS)[name]
+    citing, cited = make_edges(options['nodes'], options['edges'],
+                               options['seed'])
+    citing, cited, initial = prepare(citing, cited, options)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t1 = time.time()
+    scores, iterations = run(citing, cited, initial)
+    elapsed = time.time() - t1
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    np.save(os.path.join(out_dir, '%s.npy' % name), scores)
+    # ru_maxrss is in kilobytes on Linux. It only counts the memory used
+    # beyond the peak before the run, which is an underestimate when the
+    # preparation used more.
+    queue.put((elapsed, (peak_rss - base_rss) / 1024.0, iterations))
+
+
+class Command(VerboseCommand):
+    help = ('Compare the time and memory that igraph and the sparse power '
+            'iteration in cl.lib.pagerank take to compute pagerank, on a '
+            'random graph.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--nodes',
+            type=int,
+            default=1000000,
+            help="The number of nodes in the graph.",
+        )
+        parser.add_argument(
+            '--edges',
+            type=int,
+            default=10000000,
+            help="The number of edges in the graph.",
+        )
+        parser.add_argument(
+            '--new-fraction',
+            type=float,
+            default=0.01,
+            help="For the warm start benchmark, the number of edges to add "
+                 "after the first run, as a fraction of --edges.",
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help="The seed of the random graph.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        logger.info("Benchmarking pagerank with %s nodes and %s edges." %
+                    (options['nodes'], options['edges']))
+        out_dir = tempfile.mkdtemp()
+        try:
+            for name, _, _ in RUNNERS:
+                queue = Queue()
+                p = Process(target=measure,
+                            args=(name, options, out_dir, queue))
+                p.start()
+                elapsed, memory, iterations = queue.get()
+                p.join()
+                logger.info("%s: %.2fs, %.1f MB peak memory%s." % (
+                    name, elapsed, memory,
+                    ', %s iterations' % iterations if iterations else '',
+                ))
+
+            igraph_scores = np.load(os.path.join(out_dir, 'igraph.npy'))
+            csr_scores = np.load(os.path.join(out_dir, 'csr.npy'))
+            logger.info("The largest difference between the igraph and csr "
+                        "scores is %s." %
+                        np.abs(igraph_scores - csr_scores).max())
+        finally:
+            shutil.rmtree(out_dir)
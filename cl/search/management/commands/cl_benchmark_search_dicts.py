@@ -0,0 +1,140 @@
+import time
+
+from django.db import connection
+from django.template import loader
+from django.test.utils import CaptureQueriesContext
+
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.search.models import Docket, Opinion
+from cl.search.tasks import make_opinion_search_dicts
+
+
+def sort_lists(search_dict):
+    """Sort the list values of a search dict so that dicts made with
+    differently ordered queries can be compared.
+    """
+    return {k: sorted(v) if isinstance(v, list) else v for k, v in
+            search_dict.items()}
+
+
+def opinions_one_by_one(pks):
+    return [o.as_search_dict() for o in Opinion.objects.filter(pk__in=pks)]
+
+
+class Command(VerboseCommand):
+    help = ('Compare the speed and number of queries of the different ways '
+            'that search dicts can be made.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type',
+            choices=('opinions', 'recap-text'),
+            default='opinions',
+            help="What to benchmark. 'opinions' compares making opinion "
+                 "search dicts one by one and in bulk. 'recap-text' compares "
+                 "making the text field of RECAP dockets with the "
+                 "dockets_text.txt template and without it.",
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=1000,
+            help="The number of items to make search dicts for. For "
+                 "recap-text, the number of dockets.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help="The number of items to make search dicts for at once.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        if options['type'] == 'opinions':
+            self.benchmark_opinions(options)
+        elif options['type'] == 'recap-text':
+            self.benchmark_recap_text(options)
+
+    @staticmethod
+    def benchmark_opinions(options):
+        pks = list(Opinion.objects.order_by('pk').values_list(
+            'pk', flat=True)[:options['count']])
+        batch_size = options['batch_size']
+        batches = [pks[i:i + batch_size] for i in
+                   range(0, len(pks), batch_size)]
+        logger.info("Benchmarking opinions with %s items in batches of %s." %
+                    (len(pks), batch_size))
+
+        results = {}
+        for name, f in (('one_by_one', opinions_one_by_one),
+                        ('bulk', make_opinion_search_dicts)):
+            search_dicts = []
+            query_count = 0
+            elapsed = 0
+            for batch in batches:
+                # Capture each batch separately; Django only keeps the last
+                # few thousand queries.
+                with CaptureQueriesContext(connection) as queries:
+                    t1 = time.time()
+                    search_dicts.extend(f(batch))
+                    elapsed += time.time() - t1
+                query_count += len(queries)
+            results[name] = search_dicts
+            logger.info("  %s: %.1f queries/doc, %.1f docs/sec" % (
+                name,
+                query_count * 1.0 / (len(search_dicts) or 1),
+                len(search_dicts) / (elapsed or 1),
+            ))
+
+        one_by_one = {d['id']: sort_lists(d) for d in results['one_by_one']}
+        bulk = {d['id']: sort_lists(d) for d in results['bulk']}
+        mismatches = [pk for pk in one_by_one if one_by_one[pk] != bulk.get(pk)]
+        if mismatches:
+            logger.warn("  Search dicts differed for %s items: %s" %
+                        (len(mismatches), mismatches[:20]))
+        else:
+            logger.info("  Search dicts were identical.")
+
+    @staticmethod
+    def benchmark_recap_text(options):
+        dockets = Docket.objects.filter(
+            source__in=Docket.RECAP_SOURCES,
+        ).select_related(
+            'court',
+            'assigned_to',
+            'referred_to',
+        ).prefetch_related(
+            'docket_entries__recap_documents',
+        ).order_by('pk')[:options['count']]
+        rds = [rd for d in dockets for de in d.docket_entries.all() for rd in
+               de.recap_documents.all()]
+        logger.info("Benchmarking RECAP text with %s documents on %s "
+                    "dockets." % (len(rds), len(dockets)))
+
+        t1 = time.time()
+        template_texts = []
+        for rd in rds:
+            template = loader.get_template('indexes/dockets_text.txt')
+            template_texts.append(template.render({'item': rd}))
+        elapsed = time.time() - t1
+        logger.info("  template: %.1f docs/sec" % (len(rds) / (elapsed or 1)))
+
+        t1 = time.time()
+        texts = []
+        docket_texts = {}
+        for rd in rds:
+            docket = rd.docket_entry.docket
+            if docket.pk not in docket_texts:
+                docket_texts[docket.pk] = docket.get_search_text()
+            texts.append(rd.get_search_text(docket_texts[docket.pk]))
+        elapsed = time.time() - t1
+        logger.info("  assembled: %.1f docs/sec" % (len(rds) / (elapsed or 1)))
+
+        mismatches = [rd.pk for rd, expected, actual in
+                      zip(rds, template_texts, texts) if expected != actual]
+        if mismatches:
+            logger.warn("  Text differed for %s items: %s" %
+                        (len(mismatches), mismatches[:20]))
+        else:
+            logger.info("  Text was identical.")
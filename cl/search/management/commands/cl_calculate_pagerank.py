@@ -1,69 +1,56 @@
-import logging
 import os
 import pwd
 import shutil
 
-import igraph
 from django.conf import settings
+from django.db import connection, transaction
 
 from cl.lib.command_utils import VerboseCommand, logger
+from cl.lib.pagerank import make_csr_graph, pagerank, read_scores, \
+    write_scores, MAX_ITERATIONS, TOLERANCE
 from cl.lib.solr_core_admin import get_data_dir, \
     reload_pagerank_external_file_cache
 from cl.lib.utils import mkdir_p
 from cl.search.models import Opinion, OpinionsCited
 
 
-def make_and_populate_nx_graph():
-    """Create a new igraph object and populate it.
+def stream_rows(sql, chunk_size=100000):
+    """Run a query with a server-side cursor, yielding its rows in chunks.
 
-    This pulls all of the inter-opinion citations into memory then passes all of
-    them to igraph as a directed graph.
-    """
-    g = igraph.Graph(directed=True, edges=list(
-        OpinionsCited.objects.values_list(
-            'citing_opinion',
-            'cited_opinion',
-        ))
-    )
-    return g
-
-
-def make_sorted_pr_file(pr_results, result_file_path):
-    """Convert the pagerank results list into something Solr can use.
-
-    Solr uses a file of the form:
-
-        1=0.387789712299
-        2=0.214810626172
-        3=0.397399661529
+    Django's iterator() still has the database driver fetch every row at
+    once, which for the citation table is hundreds of millions of them.
 
-    The IDs must be sorted for performance, and every ID should be listed. This
-    function takes the pagerank results and converts them into a file like this,
-    using the os's `sort` executable for fastest sorting.
+    Must be called in a transaction, which named cursors need.
     """
-    temp_extension = '.tmp'
-    min_value = min(pr_results)
-    with open(result_file_path + temp_extension, 'w') as f:
-        # pr_results has a score for every value between 0 and our highest
-        # opinion id that has citations. Write a file that only contains values
-        # matching valid Opinions.
-        for pk in Opinion.objects.values_list('pk', flat=True):
-            try:
-                score = pr_results[pk]
-            except IndexError:
-                # Happens because some items don't have citations, thus aren't
-                # in network.
-                score = min_value
-            f.write('{}={}\n'.format(pk, score))
-
-    # For improved Solr performance, sort the temp file, creating a new file
-    # without the temp_extension value.
-    os.system('sort -n %s%s > %s' % (
-        result_file_path,
-        temp_extension,
-        result_file_path,
-    ))
-    os.remove(result_file_path + temp_extension)
+    connection.ensure_connection()
+    cursor = connection.connection.cursor(name='cl_calculate_pagerank')
+    cursor.itersize = chunk_size
+    try:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def make_csr_graph_from_db():
+    """Make a CSRGraph of every citation between opinions."""
+    sql = 'SELECT citing_opinion_id, cited_opinion_id FROM %s' % \
+        OpinionsCited._meta.db_table
+    with transaction.atomic():
+        return make_csr_graph(stream_rows(sql))
+
+
+def iter_opinion_pks():
+    """Yield the pk of every opinion, in order."""
+    sql = 'SELECT id FROM %s ORDER BY id' % Opinion._meta.db_table
+    with transaction.atomic():
+        for rows in stream_rows(sql):
+            for row in rows:
+                yield row[0]
 
 
 def cp_pr_file_to_bulk_dir(result_file_path, chown):
@@ -85,13 +72,49 @@ class Command(VerboseCommand):
     help = 'Calculate pagerank value for every case'
     RESULT_FILE_PATH = get_data_dir('collection1') + "external_pagerank"
 
-    def do_pagerank(self, chown=True):
-        g = make_and_populate_nx_graph()
-        pr_results = g.pagerank()
-        make_sorted_pr_file(pr_results, self.RESULT_FILE_PATH)
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-iterations',
+            type=int,
+            default=MAX_ITERATIONS,
+            help="The most iterations to run before giving up on converging.",
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=TOLERANCE,
+            help="Stop once the scores change by less than this, in total, "
+                 "from one iteration to the next.",
+        )
+        parser.add_argument(
+            '--no-warm-start',
+            action='store_true',
+            default=False,
+            help="Start from even scores, instead of from the scores of the "
+                 "last run.",
+        )
+
+    def do_pagerank(self, chown=True, max_iterations=MAX_ITERATIONS,
+                    tolerance=TOLERANCE, warm_start=True):
+        graph = make_csr_graph_from_db()
+        logger.info("Loaded %s citations between %s nodes, using %s MB." %
+                    (len(graph.indices), graph.node_count,
+                     graph.nbytes / 1024 / 1024))
+        initial = None
+        if warm_start:
+            initial = read_scores(self.RESULT_FILE_PATH, graph.node_count)
+        scores, iterations = pagerank(graph, initial=initial,
+                                      max_iterations=max_iterations,
+                                      tolerance=tolerance)
+        logger.info("Pagerank took %s iterations, starting from %s." %
+                    (iterations, 'the last run' if initial is not None else
+                     'even scores'))
+        write_scores(self.RESULT_FILE_PATH, scores, iter_opinion_pks())
         reload_pagerank_external_file_cache()
         cp_pr_file_to_bulk_dir(self.RESULT_FILE_PATH, chown)
 
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
-        self.do_pagerank()
+        self.do_pagerank(max_iterations=options['max_iterations'],
+                         tolerance=options['tolerance'],
+                         warm_start=not options['no_warm_start'])
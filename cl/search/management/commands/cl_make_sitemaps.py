@@ -0,0 +1,157 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+
+from django.core.urlresolvers import reverse
+
+from cl.audio.models import Audio
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.lib.utils import mkdir_p
+from cl.search.models import Docket, Opinion
+from cl.sitemap import items_per_sitemap, make_url_items, render_sitemap, \
+    get_static_sitemap_dir, get_static_sitemap_path, \
+    get_static_sitemap_state, get_static_sitemap_state_path
+
+
+def opinion_items(after_pk, count):
+    opinions = Opinion.objects.filter(pk__gt=after_pk).order_by('pk')
+    for pk, cluster_id, slug, local_path, date_modified in \
+            opinions.values_list('pk', 'cluster_id', 'cluster__slug',
+                                 'local_path', 'date_modified')[:count]:
+        yield pk, make_url_items(
+            reverse('view_case', args=[cluster_id, slug]),
+            local_path, date_modified, 'monthly', ['pdf', 'doc', 'wpd'],
+        )
+
+
+def recap_items(after_pk, count):
+    dockets = Docket.objects.filter(
+        pk__gt=after_pk,
+        source__in=Docket.RECAP_SOURCES,
+    ).order_by('pk')
+    for pk, slug, date_modified in dockets.values_list(
+            'pk', 'slug', 'date_modified')[:count]:
+        yield pk, make_url_items(
+            reverse('view_docket', args=[pk, slug]),
+            None, date_modified, 'weekly', [],
+        )
+
+
+def oral_argument_items(after_pk, count):
+    audio_files = Audio.objects.filter(
+        pk__gt=after_pk,
+        processing_complete=True,
+    ).order_by('pk')
+    for pk, slug, local_path, date_modified in audio_files.values_list(
+            'pk', 'docket__slug', 'local_path_mp3', 'date_modified')[:count]:
+        yield pk, make_url_items(
+            reverse('view_audio_file', args=[pk, slug]),
+            local_path, date_modified, 'monthly', ['mp3'],
+        )
+
+
+SECTIONS = {
+    'opinions': opinion_items,
+    'recap': recap_items,
+    'oral-arguments': oral_argument_items,
+}
+
+
+def write_atomically(path, content):
+    """Write a file so that readers never see it half written."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, path)
+
+
+def write_page(section, page, urls):
+    content = io.BytesIO()
+    # A fixed mtime keeps the file the same if its items are.
+    gz = gzip.GzipFile(fileobj=content, mode='wb', mtime=0)
+    gz.write(render_sitemap(urls))
+    gz.close()
+    write_atomically(get_static_sitemap_path(section, page),
+                     content.getvalue())
+
+
+def save_state(section, last_pks):
+    write_atomically(get_static_sitemap_state_path(section),
+                     json.dumps({'last_pks': last_pks}))
+
+
+def make_section(section, full=False):
+    """Write the pages of a section's sitemap to gzipped files.
+
+    Items are read in order of their pks, a page at a time, with each query
+    starting after the last pk of the page before, so that no query has to
+    skip over earlier items. Since new items get higher pks, later runs only
+    need to rewrite the last page and add pages after it.
+
+    :param section: One of the keys of SECTIONS.
+    :param full: Whether to rewrite every page, instead of only the last page
+    and any new ones. Rewriting every page picks up deleted items.
+    :return: The number of pages written.
+    """
+    get_items = SECTIONS[section]
+    mkdir_p(get_static_sitemap_dir(section))
+    state = None if full else get_static_sitemap_state(section)
+    if state is None:
+        last_pks = []
+    else:
+        # Redo the last page, which may have had room for new items.
+        last_pks = state['last_pks'][:-1]
+
+    written = 0
+    while True:
+        after_pk = last_pks[-1] if last_pks else 0
+        urls = []
+        last_pk = None
+        for last_pk, items in get_items(after_pk, items_per_sitemap):
+            urls.extend(items)
+        if last_pk is None and last_pks:
+            break
+        write_page(section, len(last_pks) + 1, urls)
+        written += 1
+        last_pks.append(last_pk or 0)
+        if not full:
+            # The state is saved as pages are added, so the views only ever
+            # link to pages that exist. Full runs keep serving the old pages
+            # until they are done.
+            save_state(section, last_pks)
+        if last_pk is None:
+            # An empty section still gets one empty page.
+            break
+    save_state(section, last_pks)
+    return written
+
+
+class Command(VerboseCommand):
+    help = ('Write the sitemaps of opinions, RECAP dockets and oral arguments '
+            'to gzipped files, so they can be served without querying Solr.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sections',
+            nargs='*',
+            choices=sorted(SECTIONS.keys()),
+            default=sorted(SECTIONS.keys()),
+            help="The sitemaps to make. Defaults to all of them.",
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            default=False,
+            help="Rewrite every page, instead of only the pages with new "
+                 "items.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        for section in options['sections']:
+            written = make_section(section, options['full'])
+            logger.info("Wrote %s pages of the %s sitemap." %
+                        (written, section))
@@ -0,0 +1,180 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from cl.audio.models import Audio
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.lib.scorched_utils import get_solr_interface
+from cl.people_db.models import Person
+from cl.search.models import Docket, IndexChange, Opinion, RECAPDocument
+from cl.search.tasks import get_search_dict_chunks
+
+
+def coalesce_changes(changes):
+    """Reduce a list of changes to the latest reason for each item.
+
+    :param changes: An iterable of IndexChange objects, in the order they
+    happened.
+    :return: A dict mapping item types to dicts that map item pks to the most
+    recent reason they changed.
+    """
+    latest = defaultdict(dict)
+    for change in changes:
+        latest[change.item_type][change.item_pk] = change.reason
+    return latest
+
+
+def get_pks_with_reason(latest, item_type, reason):
+    return set(pk for pk, r in latest[item_type].items() if r == reason)
+
+
+def get_index_lag():
+    """How far the index trails the database.
+
+    :return: A timedelta for how long the oldest unprocessed change has been
+    waiting, or a zero timedelta if nothing is waiting.
+    """
+    oldest = IndexChange.objects.order_by('date_created').only(
+        'date_created').first()
+    if oldest is None:
+        return timedelta(0)
+    return now() - oldest.date_created
+
+
+def get_solr_operations(changes):
+    """Work out the minimal set of updates and deletions each Solr core needs
+    to reflect a batch of changes.
+
+    Changes to items whose fields are copied into other items' search dicts
+    are expanded to those items. For example, a saved cluster means that its
+    opinions need updating, and a saved RECAP docket means every document on
+    it needs updating.
+
+    :param changes: An iterable of IndexChange objects.
+    :return: A tuple of two dicts. The first maps (Solr URL, model) pairs to
+    the pks that need to be added or updated. The second maps Solr URLs to
+    the pks that need to be deleted.
+    """
+    latest = coalesce_changes(changes)
+
+    def saved(item_type):
+        return get_pks_with_reason(latest, item_type, IndexChange.SAVE)
+
+    def deleted(item_type):
+        return get_pks_with_reason(latest, item_type, IndexChange.DELETE)
+
+    docket_pks = saved('search.Docket')
+    opinion_pks = saved('search.Opinion')
+    opinion_pks.update(Opinion.objects.filter(
+        cluster_id__in=saved('search.OpinionCluster'),
+    ).values_list('pk', flat=True))
+    opinion_pks.update(Opinion.objects.filter(
+        cluster__docket_id__in=docket_pks,
+    ).values_list('pk', flat=True))
+
+    audio_pks = saved('audio.Audio')
+    audio_pks.update(Audio.objects.filter(
+        docket_id__in=docket_pks,
+    ).values_list('pk', flat=True))
+
+    rd_pks = saved('search.RECAPDocument')
+    rd_pks.update(RECAPDocument.objects.filter(
+        docket_entry_id__in=saved('search.DocketEntry'),
+    ).values_list('pk', flat=True))
+    # Documents on saved dockets are updated with their docket.
+    rd_pks.difference_update(RECAPDocument.objects.filter(
+        docket_entry__docket_id__in=docket_pks,
+    ).values_list('pk', flat=True))
+
+    updates = {
+        (settings.SOLR_OPINION_URL, Opinion): opinion_pks,
+        (settings.SOLR_AUDIO_URL, Audio): audio_pks,
+        (settings.SOLR_PEOPLE_URL, Person): saved('people_db.Person'),
+        (settings.SOLR_RECAP_URL, RECAPDocument): rd_pks,
+        (settings.SOLR_RECAP_URL, Docket): docket_pks,
+    }
+    deletions = {
+        settings.SOLR_OPINION_URL: deleted('search.Opinion'),
+        settings.SOLR_AUDIO_URL: deleted('audio.Audio'),
+        settings.SOLR_PEOPLE_URL: deleted('people_db.Person'),
+        settings.SOLR_RECAP_URL: deleted('search.RECAPDocument'),
+    }
+    return updates, deletions
+
+
+class Command(VerboseCommand):
+    help = ('Update Solr with the items that were saved or deleted since the '
+            'last run, as recorded in the IndexChange log.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--daemon',
+            action='store_true',
+            default=False,
+            help="Run forever, waiting for new changes when there are none.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help="The number of changes to coalesce and process at a time.",
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=0,
+            help="Only process changes that are at least this many seconds "
+                 "old. Waiting lets bursts of edits to the same item be "
+                 "coalesced into a single update.",
+        )
+        parser.add_argument(
+            '--wait',
+            type=int,
+            default=10,
+            help="In daemon mode, the number of seconds to wait when there "
+                 "are no changes to process.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        while True:
+            changes = list(IndexChange.objects.filter(
+                date_created__lte=now() - timedelta(seconds=options['min_age'])
+            ).order_by('pk')[:options['batch_size']])
+            if changes:
+                self.process_changes(changes)
+                IndexChange.objects.filter(
+                    pk__in=[change.pk for change in changes],
+                ).delete()
+            # Counting the waiting changes would scan the whole table, which
+            # is largest when the consumer is already behind.
+            logger.info("Processed %s changes. Index lag: %s." % (
+                len(changes), get_index_lag()))
+
+            if len(changes) < options['batch_size']:
+                if not options['daemon']:
+                    break
+                time.sleep(options['wait'])
+
+    @staticmethod
+    def process_changes(changes):
+        updates, deletions = get_solr_operations(changes)
+        for (solr_url, obj_type), pks in updates.items():
+            if not pks:
+                continue
+            si = get_solr_interface(solr_url, mode='w')
+            pks = sorted(pks)
+            for i in range(0, len(pks), 500):
+                for chunk in get_search_dict_chunks(obj_type, pks[i:i + 500]):
+                    si.add(chunk)
+            logger.info("Updated %s %s items." % (len(pks), obj_type.__name__))
+
+        for solr_url, pks in deletions.items():
+            if not pks:
+                continue
+            si = get_solr_interface(solr_url, mode='w')
+            si.delete_by_ids(list(pks))
+            logger.info("Deleted %s items from %s." % (len(pks), solr_url))
@@ -1,21 +1,26 @@
 import ast
 import sys
+import time
+from multiprocessing import Pool
 
+import redis
 from django.conf import settings
+from django.db import connections
 from six.moves import input
 
 from cl.audio.models import Audio
 from cl.lib.command_utils import VerboseCommand, logger
 from cl.lib.argparse_types import valid_date_time, valid_obj_type
 from cl.lib.celery_utils import CeleryThrottle
-from cl.lib.db_tools import queryset_generator
-from cl.lib.scorched_utils import ExtraSolrInterface
+from cl.lib.db_tools import queryset_generator, get_pk_ranges
+from cl.lib.scorched_utils import ExtraSolrInterface, get_solr_interface
 from cl.lib.timer import print_timing
 from cl.people_db.models import Person
 from cl.search.models import Opinion, RECAPDocument, Docket
 from cl.search.tasks import (delete_items, add_or_update_audio_files,
-                             add_or_update_opinions, add_or_update_items,
-                             add_or_update_people, add_or_update_recap_document)
+                             add_or_update_opinions, add_or_update_items_by_pk,
+                             add_or_update_people, add_or_update_recap_document,
+                             get_index_queryset, get_search_dict_chunks)
 
 VALID_OBJ_TYPES = ('opinions', 'audio', 'people', 'recap', 'recap-dockets')
 
@@ -47,6 +52,74 @@ def proceed_with_deletion(out, count, noinput):
     return proceed
 
 
+def get_progress_key(obj_type, solr_url):
+    """Get the redis key where the progress of a parallel reindex is kept."""
+    return 'cl_update_index.progress:%s:%s' % (obj_type.__name__, solr_url)
+
+
+def close_db_connections():
+    """Close DB connections so they are not shared across forked processes."""
+    for conn in connections.all():
+        conn.close()
+
+
+def index_pk_range(args):
+    """Add or update every item within a range of primary keys in Solr.
+
+    This is run in a worker process by the --workers mode of the update
+    command. Items are loaded in batches of primary keys, converted to search
+    dicts with their related objects prefetched, and then sent directly to
+    Solr. After each batch is sent, the last primary key it contained is saved
+    in redis so that if the process crashes, the range can be resumed where it
+    left off.
+
+    :param args: A tuple of the object type, the first and last primary keys of
+    the range (inclusive), the last primary key that was already completed in
+    the range, the Solr URL, the batch size, and the redis key where progress
+    is tracked.
+    :return: A tuple of the range and the number of items processed.
+    """
+    (obj_type, first_pk, last_pk, done_pk, solr_url, batch_size,
+     progress_key) = args
+    si = get_solr_interface(solr_url, mode='w')
+    r = redis.StrictRedis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DATABASES['CACHE'],
+    )
+    range_name = '%s-%s' % (first_pk, last_pk)
+    qs = get_index_queryset(obj_type)
+    processed_count = 0
+    t1 = time.time()
+    while done_pk < last_pk:
+        pks = list(qs.filter(
+            pk__gt=done_pk,
+            pk__lte=last_pk,
+        ).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+
+        for chunk in get_search_dict_chunks(obj_type, pks):
+            si.add(chunk)
+
+        done_pk = pks[-1]
+        processed_count += len(pks)
+        r.hset(progress_key, range_name, done_pk)
+        logger.info("Range %s: indexed through pk %s (%d items, %.0f%%, "
+                    "%.1f items/sec)" % (
+                        range_name,
+                        done_pk,
+                        processed_count,
+                        (done_pk - first_pk + 1) * 100.0 /
+                        (last_pk - first_pk + 1),
+                        processed_count / (time.time() - t1),
+                    ))
+
+    # Mark the range as complete even if the tail of it had no items.
+    r.hset(progress_key, range_name, last_pk)
+    return range_name, processed_count
+
+
 class Command(VerboseCommand):
     help = ('Adds, updates, deletes items in an index, committing changes and '
             'optimizing it, if requested.')
@@ -147,7 +220,8 @@ class Command(VerboseCommand):
             '--datetime',
             type=valid_date_time,
             help='Take action on items newer than a date (YYYY-MM-DD) or a '
-                 'date and time (YYYY-MM-DD HH:MM:SS)'
+                 'date and time (YYYY-MM-DD HH:MM:SS). When updating, items '
+                 'modified since then are included.'
         )
 
         parser.add_argument(
@@ -157,6 +231,31 @@ class Command(VerboseCommand):
             help="For use with the --everything flag, skip this many items "
                  "before starting the processing."
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help="For use with the --everything flag. Instead of sending items "
+                 "through Celery, split the primary keys into this many "
+                 "ranges and index each of them in its own process, sending "
+                 "batches directly to Solr."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="For use with the --workers flag, the number of items each "
+                 "worker sends to Solr at a time."
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            default=False,
+            help="For use with the --workers flag. Resume a previous run that "
+                 "crashed or was stopped, restarting each range after the "
+                 "last item it sent to Solr. Without this flag, any saved "
+                 "progress is discarded."
+        )
 
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
@@ -171,7 +270,9 @@ class Command(VerboseCommand):
         if options['update']:
             if self.verbosity >= 1:
                 self.stdout.write('Running in update mode...\n')
-            if options.get('everything'):
+            if options.get('everything') and options['workers']:
+                self.add_or_update_all_in_parallel()
+            elif options.get('everything'):
                 self.add_or_update_all()
             elif options.get('datetime'):
                 self.add_or_update_by_datetime(options['datetime'])
@@ -210,14 +311,21 @@ class Command(VerboseCommand):
                               'index.\n')
             sys.exit(1)
 
-    def process_queryset(self, items, count, chunksize=50,):
-        """Chunks the queryset passed in, and dispatches it to Celery for
-        adding to the index.
+    def process_queryset(self, items, count, chunksize=100):
+        """Chunks the primary keys of a queryset, and dispatches them to Celery
+        for adding to the index.
+
+        :param items: An iterable of dicts containing the 'id' of each item.
+        :param count: The number of items in the iterable.
+        :param chunksize: The number of items to send in each task.
         """
         queue = self.options['queue']
         start_at = self.options['start_at']
-        # Set low throttle. Higher values risk crashing Redis.
-        throttle = CeleryThrottle(min_items=30, queue_name=queue)
+        obj_type_label = '%s.%s' % (self.type._meta.app_label,
+                                    self.type._meta.object_name)
+        # Tasks only carry primary keys, so the queue can be deep without
+        # risking Redis' memory.
+        throttle = CeleryThrottle(min_items=200, queue_name=queue)
         processed_count = 0
         chunk = []
         for item in items:
@@ -225,11 +333,13 @@ class Command(VerboseCommand):
             if processed_count < start_at:
                 continue
             last_item = (count == processed_count)
-            chunk.append(item)
+            chunk.append(item['id'])
             if processed_count % chunksize == 0 or last_item:
                 throttle.maybe_wait()
-                add_or_update_items.apply_async(args=(chunk, self.solr_url),
-                                                queue=queue)
+                add_or_update_items_by_pk.apply_async(
+                    args=(chunk, obj_type_label, self.solr_url),
+                    queue=queue,
+                )
                 chunk = []
                 sys.stdout.write("\rProcessed {}/{} ({:.0%})".format(
                     processed_count,
@@ -315,11 +425,13 @@ class Command(VerboseCommand):
     @print_timing
     def add_or_update_by_datetime(self, dt):
         """
-        Given a datetime, adds or updates all items newer than that time.
+        Given a datetime, adds or updates all items created or modified since
+        that time.
         """
-        self.stdout.write("Adding or updating items(s) newer than %s\n" % dt)
-        qs = self.type.objects.filter(date_created__gte=dt)
-        items = queryset_generator(qs, chunksize=5000)
+        self.stdout.write("Adding or updating items(s) modified since %s\n" %
+                          dt)
+        qs = get_index_queryset(self.type).filter(date_modified__gte=dt)
+        items = queryset_generator(qs.values('id'), chunksize=5000)
         count = qs.count()
         self.process_queryset(items, count)
 
@@ -332,37 +444,68 @@ class Command(VerboseCommand):
         If run on an existing index, existing items will be updated.
         """
         self.stdout.write("Adding or updating all items...\n")
-        if self.type == Person:
-            q = self.type.objects.filter(
-                is_alias_of=None
-            ).prefetch_related(
-                'positions',
-                'positions__predecessor',
-                'positions__supervisor',
-                'positions__appointer',
-                'positions__court',
-                'political_affiliations',
-                'aba_ratings',
-                'educations__school',
-                'aliases',
-                'race',
-            )
-            # Filter out non-judges -- they don't get searched.
-            q = [item for item in q if item.is_judge]
-            count = len(q)
-        elif self.type == RECAPDocument:
-            q = self.type.objects.all()
-            count = q.count()
-            q = queryset_generator(q, chunksize=5000)
-        elif self.type == Docket:
-            q = Docket.objects.filter(source__in=Docket.RECAP_SOURCES)
-            count = q.count()
-            q = queryset_generator(q, chunksize=5000)
+        qs = get_index_queryset(self.type)
+        count = qs.count()
+        items = queryset_generator(qs.values('id'), chunksize=5000)
+        if self.type == Docket:
+            # Each docket can have thousands of documents.
+            self.process_queryset(items, count, chunksize=10)
+        else:
+            self.process_queryset(items, count)
+
+    @print_timing
+    def add_or_update_all_in_parallel(self):
+        """Split the corpus into primary key ranges and index each range in a
+        separate process, sending items directly to Solr.
+
+        Progress for each range is saved in redis as it is made, so that a run
+        can be resumed with the --resume flag. Once every range is complete,
+        the saved progress is removed.
+        """
+        workers = self.options['workers']
+        progress_key = get_progress_key(self.type, self.solr_url)
+        r = redis.StrictRedis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DATABASES['CACHE'],
+        )
+
+        saved_progress = r.hgetall(progress_key)
+        if self.options['resume'] and saved_progress:
+            ranges = []
+            for range_name, done_pk in saved_progress.items():
+                first_pk, last_pk = [int(pk) for pk in range_name.split('-')]
+                ranges.append((first_pk, last_pk, int(done_pk)))
+            ranges.sort()
+            self.stdout.write("Resuming %s saved ranges...\n" % len(ranges))
         else:
-            q = self.type.objects.all()
-            count = q.count()
-            q = queryset_generator(q, chunksize=5000)
-        self.process_queryset(q, count)
+            r.delete(progress_key)
+            ranges = [(first_pk, last_pk, first_pk - 1) for first_pk, last_pk
+                      in get_pk_ranges(get_index_queryset(self.type), workers)]
+            for first_pk, last_pk, done_pk in ranges:
+                r.hset(progress_key, '%s-%s' % (first_pk, last_pk), done_pk)
+            self.stdout.write("Split the corpus into %s ranges...\n" %
+                              len(ranges))
+
+        args = [(self.type, first_pk, last_pk, done_pk, self.solr_url,
+                 self.options['batch_size'], progress_key) for
+                first_pk, last_pk, done_pk in ranges if done_pk < last_pk]
+
+        # Each process must make its own DB connections.
+        close_db_connections()
+        pool = Pool(processes=workers, initializer=close_db_connections)
+        total_count = 0
+        try:
+            for range_name, count in pool.imap_unordered(index_pk_range, args):
+                total_count += count
+                self.stdout.write("Completed range %s with %s items.\n" %
+                                  (range_name, count))
+        finally:
+            pool.close()
+            pool.join()
+
+        r.delete(progress_key)
+        self.stdout.write("Done. Processed %s items.\n" % total_count)
 
     @print_timing
     def optimize(self):
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0062_add_indexes_to_title_section_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexChange',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date_created', models.DateTimeField(help_text=b'The time when the change happened.', auto_now_add=True, db_index=True)),
+                ('item_type', models.CharField(help_text=b'The model of the item that changed, as app_label.ModelName, one of: search.Opinion, search.OpinionCluster, search.Docket, search.DocketEntry, search.RECAPDocument, audio.Audio, people_db.Person', max_length=50)),
+                ('item_pk', models.IntegerField(help_text=b'The pk of the item that changed.')),
+                ('reason', models.SmallIntegerField(help_text=b'Why the item needs to be updated in Solr.', choices=[(1, b'Saved'), (2, b'Deleted')])),
+            ],
+        ),
+    ]
@@ -4,14 +4,17 @@ import re
 from datetime import datetime, time
 
 from celery.canvas import chain
+from django.apps import apps
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericRelation
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse, NoReverseMatch
 from django.db import models
 from django.db.models import Prefetch
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.template import loader
-from django.utils.encoding import smart_unicode
+from django.utils.encoding import force_text, smart_unicode
 from django.utils.text import slugify
 
 from cl.custom_filters.templatetags.text_filters import best_case_name
@@ -19,7 +22,7 @@ from cl.lib import fields
 from cl.lib.model_helpers import make_upload_path, make_recap_path, \
     make_recap_pdf_path
 from cl.lib.search_index_utils import InvalidDocumentError, null_map, \
-    normalize_search_dicts
+    normalize_search_dicts, render_date_value, render_text_value
 from cl.lib.storage import IncrementingFileSystemStorage
 from cl.lib.string_utils import trunc
 
@@ -349,32 +352,88 @@ class Docket(models.Model):
                      to_attr='firms_in_docket')
         )
 
-    def as_search_list(self):
-        """Create list of search dicts from a single docket. This should be
-        faster than creating a search dict per document on the docket.
+    def get_search_text(self):
+        """Make the part of the text field of RECAP search dicts that comes
+        from the docket, its court, and its judges.
+
+        This is the same for every document on a docket, so it can be made
+        once and passed to RECAPDocument.get_search_text.
         """
-        search_list = []
+        if self.case_name_full:
+            case_name = self.case_name_full
+        elif self.case_name:
+            case_name = self.case_name
+        else:
+            case_name = self.case_name_short
+        judges = []
+        for judge in (self.assigned_to, self.referred_to):
+            if judge:
+                judges.append(u'\n        %s\n    ' %
+                              render_text_value(judge.name_full))
+            else:
+                judges.append(u'')
+
+        return (
+            u'\n\n    \n        %s\n    \n'
+            u'    %s\n    %s\n    %s\n    %s\n    %s\n    \n    %s\n'
+            u'\n\n\n\n'
+            u'\n    %s\n    %s\n    %s\n'
+            u'\n\n\n\n'
+            u'\n    %s\n\n'
+            u'\n    %s\n\n'
+        ) % (
+            render_text_value(case_name),
+            render_date_value(self.date_argued),
+            render_date_value(self.date_filed),
+            render_date_value(self.date_terminated),
+            render_text_value(self.docket_number),
+            render_text_value(self.nature_of_suit),
+            render_text_value(self.jury_demand),
+            render_text_value(self.court.full_name),
+            render_text_value(self.court.citation_string),
+            render_text_value(self.court.pk),
+            judges[0],
+            judges[1],
+        )
 
-        # Docket
+    def get_search_metadata(self):
+        """The metadata for the search dicts of RECAP documents that comes
+        from their docket.
+
+        This is the same for every document on a docket, so it can be made
+        once and passed to RECAPDocument.as_search_dict.
+        """
+        # IDs
         out = {
+            'docket_id': self.pk,
+            'court_id': self.court.pk,
+            'assigned_to_id': getattr(self.assigned_to, 'pk', None),
+            'referred_to_id': getattr(self.referred_to, 'pk', None)
+        }
+
+        # Docket
+        out.update({
             'docketNumber': self.docket_number,
             'caseName': best_case_name(self),
             'suitNature': self.nature_of_suit,
             'cause': self.cause,
             'juryDemand': self.jury_demand,
             'jurisdictionType': self.jurisdiction_type,
-        }
+        })
         if self.date_argued is not None:
             out['dateArgued'] = datetime.combine(self.date_argued, time())
         if self.date_filed is not None:
             out['dateFiled'] = datetime.combine(self.date_filed, time())
         if self.date_terminated is not None:
-            out['dateTerminated'] = datetime.combine(self.date_terminated, time())
+            out['dateTerminated'] = datetime.combine(self.date_terminated,
+                                                     time())
         try:
             out['docket_absolute_url'] = self.get_absolute_url()
         except NoReverseMatch:
-            raise InvalidDocumentError("Unable to save to index due to missing "
-                                       "absolute_url: %s" % self.pk)
+            raise InvalidDocumentError(
+                "Unable to save to index due to missing absolute_url: %s"
+                % self.pk
+            )
 
         # Judges
         if self.assigned_to is not None:
@@ -390,10 +449,10 @@ class Docket(models.Model):
         out.update({
             'court': self.court.full_name,
             'court_exact': self.court_id,  # For faceting
-            'court_citation_string': self.court.citation_string,
+            'court_citation_string': self.court.citation_string
         })
 
-        # Parties, attorneys, firms
+        # Parties, Attorneys, Firms
         out.update({
             'party_id': set(),
             'party': set(),
@@ -412,59 +471,49 @@ class Docket(models.Model):
                     out['firm_id'].add(f.pk)
                     out['firm'].add(f.name)
 
-        # Do RECAPDocument and Docket Entries in a nested loop
-        for de in self.docket_entries.all():
-            # Docket Entry
-            out['description'] = de.description
-            if de.entry_number is not None:
-                out['entry_number'] = de.entry_number
-            if de.date_filed is not None:
-                out['entry_date_filed'] = datetime.combine(de.date_filed,
-                                                           time())
-            rds = de.recap_documents.all()
-
-            if len(rds) == 0:
-                # Minute entry or other entry that lacks docs. For now, we punt.
-                # See https://github.com/freelawproject/courtlistener/issues/784
-                continue
-
-            for rd in rds:
-                # IDs
-                out.update({
-                    'id': rd.pk,
-                    'docket_entry_id': de.pk,
-                    'docket_id': self.pk,
-                    'court_id': self.court.pk,
-                    'assigned_to_id': getattr(self.assigned_to, 'pk', None),
-                    'referred_to_id': getattr(self.referred_to, 'pk', None),
-                })
-
-                # RECAPDocument
-                out.update({
-                    'short_description': rd.description,
-                    'document_type': rd.get_document_type_display(),
-                    'document_number': rd.document_number,
-                    'attachment_number': rd.attachment_number,
-                    'is_available': rd.is_available,
-                    'page_count': rd.page_count,
-                })
-                if hasattr(rd.filepath_local, 'path'):
-                    out['filepath_local'] = rd.filepath_local.path
-                try:
-                    out['absolute_url'] = rd.get_absolute_url()
-                except NoReverseMatch:
-                    raise InvalidDocumentError(
-                        "Unable to save to index due to missing absolute_url: "
-                        "%s" % self.pk
-                    )
-
-                text_template = loader.get_template('indexes/dockets_text.txt')
-                out['text'] = text_template.render({'item': rd}).translate(
-                    null_map)
-
-                search_list.append(normalize_search_dicts(out))
-
-        return search_list
+        return out
+
+    def as_search_chunks(self, chunk_size=200):
+        """Generate the search dicts for the documents on a docket in lists of
+        at most chunk_size items.
+
+        The metadata from the docket is made once, and the documents are
+        loaded from the database one chunk at a time, so memory use stays flat
+        no matter how many documents the docket has. Minute entries and other
+        entries without documents are skipped.
+        See https://github.com/freelawproject/courtlistener/issues/784
+
+        :param chunk_size: The most search dicts to yield at a time.
+        """
+        metadata = self.get_search_metadata()
+        docket_text = self.get_search_text()
+        rds = RECAPDocument.objects.filter(
+            docket_entry__docket=self,
+        ).select_related(
+            'docket_entry',
+        ).order_by('pk')
+        last_pk = 0
+        while True:
+            chunk_rds = list(rds.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk_rds:
+                break
+            chunk = []
+            for rd in chunk_rds:
+                # Avoid a query for the docket on every document.
+                rd.docket_entry.docket = self
+                chunk.append(rd.as_search_dict(docket_metadata=metadata,
+                                               docket_text=docket_text))
+            last_pk = chunk_rds[-1].pk
+            yield chunk
+
+    def as_search_list(self):
+        """Create list of search dicts from a single docket. This should be
+        faster than creating a search dict per document on the docket.
+
+        For dockets with many documents, as_search_chunks uses far less memory.
+        """
+        return [search_dict for chunk in self.as_search_chunks() for
+                search_dict in chunk]
 
 
 class DocketEntry(models.Model):
@@ -750,7 +799,7 @@ class RECAPDocument(models.Model):
             # Context extraction not done and is requested.
             from cl.scrapers.tasks import extract_recap_pdf
             tasks.append(extract_recap_pdf.si(self.pk))
-        if index:
+        if index and not settings.INDEX_CHANGE_LOG_ENABLED:
             from cl.search.tasks import add_or_update_recap_document
             tasks.append(add_or_update_recap_document.si([self.pk],
                                                          force_commit=False))
@@ -764,83 +813,37 @@ class RECAPDocument(models.Model):
         """
         id_cache = self.pk
         super(RECAPDocument, self).delete(*args, **kwargs)
-        from cl.search.tasks import delete_items
-        delete_items.delay([id_cache], settings.SOLR_RECAP_URL)
+        if not settings.INDEX_CHANGE_LOG_ENABLED:
+            from cl.search.tasks import delete_items
+            delete_items.delay([id_cache], settings.SOLR_RECAP_URL)
 
     def get_docket_metadata(self):
         """The metadata for the item that comes from the Docket."""
-        docket = self.docket_entry.docket
-        # IDs
-        out = {
-            'docket_id': docket.pk,
-            'court_id': docket.court.pk,
-            'assigned_to_id': getattr(docket.assigned_to, 'pk', None),
-            'referred_to_id': getattr(docket.referred_to, 'pk', None)
-        }
+        return self.docket_entry.docket.get_search_metadata()
 
-        # Docket
-        out.update({
-            'docketNumber': docket.docket_number,
-            'caseName': best_case_name(docket),
-            'suitNature': docket.nature_of_suit,
-            'cause': docket.cause,
-            'juryDemand': docket.jury_demand,
-            'jurisdictionType': docket.jurisdiction_type,
-        })
-        if docket.date_argued is not None:
-            out['dateArgued'] = datetime.combine(docket.date_argued, time())
-        if docket.date_filed is not None:
-            out['dateFiled'] = datetime.combine(docket.date_filed, time())
-        if docket.date_terminated is not None:
-            out['dateTerminated'] = datetime.combine(docket.date_terminated,
-                                                     time())
-        try:
-            out['docket_absolute_url'] = docket.get_absolute_url()
-        except NoReverseMatch:
-            raise InvalidDocumentError(
-                "Unable to save to index due to missing absolute_url: %s"
-                % self.pk
-            )
+    def get_search_text(self, docket_text=None):
+        """Make the text field of the search dict.
 
-        # Judges
-        if docket.assigned_to is not None:
-            out['assignedTo'] = docket.assigned_to.name_full
-        elif docket.assigned_to_str:
-            out['assignedTo'] = docket.assigned_to_str
-        if docket.referred_to is not None:
-            out['referredTo'] = docket.referred_to.name_full
-        elif docket.referred_to_str:
-            out['referredTo'] = docket.referred_to_str
+        This makes the same text as rendering the indexes/dockets_text.txt
+        template, but without the overhead of the template engine, which is
+        significant when indexing dockets with thousands of documents.
 
-        # Court
-        out.update({
-            'court': docket.court.full_name,
-            'court_exact': docket.court_id,  # For faceting
-            'court_citation_string': docket.court.citation_string
-        })
-
-        # Parties, Attorneys, Firms
-        out.update({
-            'party_id': set(),
-            'party': set(),
-            'attorney_id': set(),
-            'attorney': set(),
-            'firm_id': set(),
-            'firm': set(),
-        })
-        for p in docket.prefetched_parties:
-            out['party_id'].add(p.pk)
-            out['party'].add(p.name)
-            for a in p.attys_in_docket:
-                out['attorney_id'].add(a.pk)
-                out['attorney'].add(a.name)
-                for f in a.firms_in_docket:
-                    out['firm_id'].add(f.pk)
-                    out['firm'].add(f.name)
-
-        return out
+        :param docket_text: The part of the text that comes from the docket, as
+        made by Docket.get_search_text. If None, it is made from this item's
+        docket.
+        """
+        entry = self.docket_entry
+        if docket_text is None:
+            docket_text = entry.docket.get_search_text()
+        return u'\n\n    %s\n    %s\n\n\n\n\n%s\n%s\n\n\n%s' % (
+            force_text(entry.description),
+            render_date_value(entry.date_filed),
+            render_text_value(self.get_document_type_display()),
+            render_text_value(self.plain_text),
+            docket_text,
+        )
 
-    def as_search_dict(self, docket_metadata=None):
+    def as_search_dict(self, docket_metadata=None, docket_text=None):
         """Create a dict that can be ingested by Solr.
 
         Search results are presented as Dockets, but they're indexed as
@@ -851,9 +854,13 @@ class RECAPDocument(models.Model):
         get_docket_metadata that lets you query that information first and then
         pass it in as an argument so that it doesn't have to be queried for
         every RECAPDocument on the docket. This can provide big performance
-        boosts.
+        boosts. The same goes for the docket's part of the text field, which
+        can be made with Docket.get_search_text.
         """
-        out = docket_metadata or self.get_docket_metadata()
+        if docket_metadata is not None:
+            out = docket_metadata.copy()
+        else:
+            out = self.get_docket_metadata()
 
         # IDs
         out.update({
@@ -891,8 +898,7 @@ class RECAPDocument(models.Model):
                 time()
             )
 
-        text_template = loader.get_template('indexes/dockets_text.txt')
-        out['text'] = text_template.render({'item': self}).translate(null_map)
+        out['text'] = self.get_search_text(docket_text).translate(null_map)
 
         return normalize_search_dicts(out)
 
@@ -1393,7 +1399,7 @@ class OpinionCluster(models.Model):
     def save(self, index=True, force_commit=False, *args, **kwargs):
         self.slug = slugify(trunc(best_case_name(self), 75))
         super(OpinionCluster, self).save(*args, **kwargs)
-        if index:
+        if index and not settings.INDEX_CHANGE_LOG_ENABLED:
             from cl.search.tasks import add_or_update_cluster
             add_or_update_cluster.delay(self.pk, force_commit)
 
@@ -1404,8 +1410,9 @@ class OpinionCluster(models.Model):
         """
         id_cache = self.pk
         super(OpinionCluster, self).delete(*args, **kwargs)
-        from cl.search.tasks import delete_items
-        delete_items.delay([id_cache], settings.SOLR_OPINION_URL)
+        if not settings.INDEX_CHANGE_LOG_ENABLED:
+            from cl.search.tasks import delete_items
+            delete_items.delay([id_cache], settings.SOLR_OPINION_URL)
 
 
 class Opinion(models.Model):
@@ -1549,12 +1556,35 @@ class Opinion(models.Model):
 
     def save(self, index=True, force_commit=False, *args, **kwargs):
         super(Opinion, self).save(*args, **kwargs)
-        if index:
+        if index and not settings.INDEX_CHANGE_LOG_ENABLED:
             from cl.search.tasks import add_or_update_opinions
             add_or_update_opinions.delay([self.pk], force_commit)
 
-    def as_search_dict(self):
-        """Create a dict that can be ingested by Solr."""
+    def as_search_dict(self, related_ids=None):
+        """Create a dict that can be ingested by Solr.
+
+        Getting the IDs of the related opinions and judges takes a query apiece.
+        When making many search dicts at once, these can be queried in bulk and
+        passed in as the related_ids argument instead. See
+        cl.search.tasks.make_opinion_search_dicts.
+
+        :param related_ids: A dict with lists of IDs for the keys 'cites',
+        'joined_by_ids', 'sibling_ids', and 'non_participating_judge_ids'. If
+        None, these are queried from the database.
+        """
+        if related_ids is None:
+            related_ids = {
+                'cites': [opinion.pk for opinion in
+                          self.opinions_cited.all()],
+                'joined_by_ids': [judge.pk for judge in self.joined_by.all()],
+                'sibling_ids': [sibling.pk for sibling in
+                                self.siblings.all()],
+                'non_participating_judge_ids': [
+                    judge.pk for judge in
+                        self.cluster.non_participating_judges.all()
+                ],
+            }
+
         # IDs
         out = {
             'id': self.pk,
@@ -1565,10 +1595,10 @@ class Opinion(models.Model):
 
         # Opinion
         out.update({
-            'cites': [opinion.pk for opinion in self.opinions_cited.all()],
-            'author_id': getattr(self.author, 'pk', None),
+            'cites': related_ids['cites'],
+            'author_id': self.author_id,
             # 'per_curiam': self.per_curiam,
-            'joined_by_ids': [judge.pk for judge in self.joined_by.all()],
+            'joined_by_ids': related_ids['joined_by_ids'],
             'type': self.type,
             'download_url': self.download_url or None,
             'local_path': unicode(self.local_path),
@@ -1578,12 +1608,10 @@ class Opinion(models.Model):
         out.update({
             'caseName': best_case_name(self.cluster),
             'caseNameShort': self.cluster.case_name_short,
-            'sibling_ids': [sibling.pk for sibling in self.siblings.all()],
+            'sibling_ids': related_ids['sibling_ids'],
             'panel_ids': [judge.pk for judge in self.cluster.panel.all()],
-            'non_participating_judge_ids': [
-                judge.pk for judge in
-                    self.cluster.non_participating_judges.all()
-            ],
+            'non_participating_judge_ids': related_ids[
+                'non_participating_judge_ids'],
             'judge': self.cluster.judges,
             'lexisCite': self.cluster.lexis_cite,
             'citation': [
@@ -1680,6 +1708,90 @@ class OpinionsCited(models.Model):
         unique_together = ("citing_opinion", "cited_opinion")
 
 
+class IndexChange(models.Model):
+    """A log of items that were saved or deleted and that need to be updated
+    in Solr.
+
+    Rows are added whenever an indexed item, or an item whose fields are copied
+    into the index, is saved or deleted. The cl_process_index_changes command
+    consumes them, coalescing repeated changes to the same item.
+    """
+    SAVE = 1
+    DELETE = 2
+    REASONS = (
+        (SAVE, 'Saved'),
+        (DELETE, 'Deleted'),
+    )
+    ITEM_TYPES = (
+        'search.Opinion',
+        'search.OpinionCluster',
+        'search.Docket',
+        'search.DocketEntry',
+        'search.RECAPDocument',
+        'audio.Audio',
+        'people_db.Person',
+    )
+    date_created = models.DateTimeField(
+        help_text="The time when the change happened.",
+        auto_now_add=True,
+        db_index=True,
+    )
+    item_type = models.CharField(
+        help_text="The model of the item that changed, as "
+                  "app_label.ModelName, one of: %s" % ', '.join(ITEM_TYPES),
+        max_length=50,
+    )
+    item_pk = models.IntegerField(
+        help_text="The pk of the item that changed.",
+    )
+    reason = models.SmallIntegerField(
+        help_text="Why the item needs to be updated in Solr.",
+        choices=REASONS,
+    )
+
+    def __unicode__(self):
+        return u'%s: %s %s %s' % (self.pk, self.get_reason_display(),
+                                  self.item_type, self.item_pk)
+
+
+# Fields that aren't in any search dict, so saves that only touch them don't
+# need to be logged.
+UNINDEXED_FIELDS = {'date_last_index'}
+
+
+def log_index_change(sender, instance, reason):
+    """Add an item to the IndexChange log, if the log is enabled and it's a
+    type that matters to Solr.
+    """
+    if not settings.INDEX_CHANGE_LOG_ENABLED:
+        return
+    if sender._meta.apps is not apps:
+        # A historical model, used by migrations.
+        return
+    item_type = '%s.%s' % (sender._meta.app_label, sender._meta.object_name)
+    if item_type not in IndexChange.ITEM_TYPES:
+        return
+    IndexChange.objects.create(
+        item_type=item_type,
+        item_pk=instance.pk,
+        reason=reason,
+    )
+
+
+@receiver(post_save, dispatch_uid='log_index_change_on_save')
+def log_index_change_on_save(sender, instance=None, update_fields=None,
+                             **kwargs):
+    if update_fields and set(update_fields) <= UNINDEXED_FIELDS:
+        # Only bookkeeping changed, not anything in the index.
+        return
+    log_index_change(sender, instance, IndexChange.SAVE)
+
+
+@receiver(post_delete, dispatch_uid='log_index_change_on_delete')
+def log_index_change_on_delete(sender, instance=None, **kwargs):
+    log_index_change(sender, instance, IndexChange.DELETE)
+
+
 class Tag(models.Model):
     date_created = models.DateTimeField(
         help_text="The original creation date for the item",
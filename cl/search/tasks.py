@@ -1,35 +1,76 @@
 from __future__ import print_function
 
 import socket
+from collections import defaultdict
 from datetime import timedelta
 
-import scorched
+from django.apps import apps
 from django.conf import settings
 from django.utils.timezone import now
 
 from cl.audio.models import Audio
 from cl.celery import app
+from cl.lib.scorched_utils import get_solr_interface
 from cl.lib.search_index_utils import InvalidDocumentError
 from cl.lib.sunburnt import SolrError
 from cl.people_db.models import Person
-from cl.search.models import Opinion, OpinionCluster, RECAPDocument, Docket
+from cl.search.models import Opinion, OpinionCluster, OpinionsCited, \
+    RECAPDocument, Docket
 
 
-@app.task
-def add_or_update_items(items, solr_url=settings.SOLR_OPINION_URL):
-    """Adds an item to a solr index.
-
-    This function is for use with the update_index command. It's slightly
-    different than the commands below because it expects a Django object,
-    rather than a primary key. This rejects the standard Celery advice about
-    not passing objects around, but thread safety shouldn't be an issue since
-    this is only used by the update_index command, and we want to get the
-    objects in the task, not in its caller.
+def get_index_queryset(obj_type):
+    """Get a queryset for an object type with the related objects that its
+    search dicts need already joined or prefetched.
+
+    :param obj_type: The model class that is being indexed.
+    :return: A queryset of the indexable objects of that type.
+    """
+    if obj_type == RECAPDocument:
+        return RECAPDocument.objects.select_related(
+            'docket_entry__docket__court',
+            'docket_entry__docket__assigned_to',
+            'docket_entry__docket__referred_to',
+        )
+    elif obj_type == Docket:
+        return Docket.objects.filter(
+            source__in=Docket.RECAP_SOURCES,
+        ).select_related(
+            'court',
+            'assigned_to',
+            'referred_to',
+        )
+    elif obj_type == Audio:
+        return Audio.objects.select_related(
+            'docket__court',
+        ).prefetch_related(
+            'panel',
+        )
+    elif obj_type == Person:
+        return Person.objects.filter(
+            is_alias_of=None,
+        ).prefetch_related(
+            'positions',
+            'positions__predecessor',
+            'positions__supervisor',
+            'positions__appointer',
+            'positions__court',
+            'political_affiliations',
+            'aba_ratings',
+            'educations__school',
+            'aliases',
+            'race',
+        )
+    return obj_type.objects.all()
+
+
+def make_search_dicts(items):
+    """Convert Django objects into a list of search dicts, skipping (and
+    logging) any that cannot be converted.
+
+    :param items: An iterable of Opinion, RECAPDocument, Docket, Audio or
+    Person objects.
+    :return: A list of dicts that can be sent to Solr.
     """
-    si = scorched.SolrInterface(solr_url, mode='w')
-    if hasattr(items, "items") or not hasattr(items, "__iter__"):
-        # If it's a dict or a single item make it a list
-        items = [items]
     search_item_list = []
     for item in items:
         try:
@@ -51,11 +92,158 @@ def add_or_update_items(items, solr_url=settings.SOLR_OPINION_URL):
             print("ValueError trying to add: %s\n  %s" % (item, e))
         except InvalidDocumentError:
             print("Unable to parse: %s" % item)
+    return search_item_list
+
+
+def make_opinion_search_dicts(opinion_pks):
+    """Make the search dicts for many opinions using a fixed number of
+    queries.
+
+    Opinion.as_search_dict needs a query apiece for the opinions cited, the
+    judges joining, the sibling opinions, the panel, and the non-participating
+    judges. Instead, this gets those for all of the opinions at once, and
+    passes them in, resulting in the same search dicts.
+
+    :param opinion_pks: The primary keys of the opinions.
+    :return: A list of dicts that can be sent to Solr.
+    """
+    opinions = list(Opinion.objects.filter(
+        pk__in=opinion_pks,
+    ).select_related(
+        'cluster__docket__court',
+    ).prefetch_related(
+        'cluster__panel',
+    ))
+    opinion_pks = [opinion.pk for opinion in opinions]
+    cluster_pks = set(opinion.cluster_id for opinion in opinions)
+
+    cites = defaultdict(list)
+    for citing_pk, cited_pk in OpinionsCited.objects.filter(
+            citing_opinion_id__in=opinion_pks).values_list(
+                'citing_opinion_id', 'cited_opinion_id'):
+        cites[citing_pk].append(cited_pk)
+
+    joined_by = defaultdict(list)
+    for opinion_pk, judge_pk in Opinion.objects.filter(
+            pk__in=opinion_pks).values_list('pk', 'joined_by'):
+        if judge_pk is not None:
+            joined_by[opinion_pk].append(judge_pk)
+
+    siblings = defaultdict(list)
+    for cluster_pk, sibling_pk in Opinion.objects.filter(
+            cluster_id__in=cluster_pks).values_list('cluster_id', 'pk'):
+        siblings[cluster_pk].append(sibling_pk)
+
+    non_participating = defaultdict(list)
+    for cluster_pk, judge_pk in OpinionCluster.objects.filter(
+            pk__in=cluster_pks).values_list('pk', 'non_participating_judges'):
+        if judge_pk is not None:
+            non_participating[cluster_pk].append(judge_pk)
+
+    search_dicts = []
+    for opinion in opinions:
+        try:
+            search_dicts.append(opinion.as_search_dict(related_ids={
+                'cites': cites[opinion.pk],
+                'joined_by_ids': joined_by[opinion.pk],
+                'sibling_ids': siblings[opinion.cluster_id],
+                'non_participating_judge_ids':
+                    non_participating[opinion.cluster_id],
+            }))
+        except (AttributeError, ValueError) as e:
+            print("%s trying to add: %s\n  %s" % (type(e).__name__,
+                                                   opinion, e))
+        except InvalidDocumentError:
+            print("Unable to parse: %s" % opinion)
+    return search_dicts
+
+
+def get_search_dicts_for_pks(obj_type, item_pks):
+    """Load a batch of items by primary key and convert them to search dicts.
+
+    The items are loaded with a single queryset that joins or prefetches the
+    related objects their search dicts need.
+
+    :param obj_type: The model class of the items.
+    :param item_pks: The primary keys of the items to load.
+    :return: A list of dicts that can be sent to Solr.
+    """
+    if obj_type == Opinion:
+        return make_opinion_search_dicts(item_pks)
+
+    items = get_index_queryset(obj_type).filter(pk__in=item_pks)
+    if obj_type == Person:
+        # Filter out non-judges -- they don't get searched.
+        items = [item for item in items if item.is_judge]
+    return make_search_dicts(items)
+
 
+def get_search_dict_chunks(obj_type, item_pks):
+    """Generate the search dicts for a batch of items in lists that can be
+    sent to Solr one at a time.
+
+    Most items are converted in a single list, but dockets can have thousands
+    of documents, so their search dicts are generated a chunk at a time.
+
+    :param obj_type: The model class of the items.
+    :param item_pks: The primary keys of the items to load.
+    """
+    if obj_type != Docket:
+        yield get_search_dicts_for_pks(obj_type, item_pks)
+        return
+
+    for d in get_index_queryset(Docket).filter(pk__in=item_pks):
+        try:
+            for chunk in d.as_search_chunks():
+                yield chunk
+        except AttributeError as e:
+            print("AttributeError trying to add: %s\n  %s" % (d, e))
+        except ValueError as e:
+            print("ValueError trying to add: %s\n  %s" % (d, e))
+        except InvalidDocumentError:
+            print("Unable to parse: %s" % d)
+
+
+@app.task
+def add_or_update_items_by_pk(item_pks, obj_type_label,
+                              solr_url=settings.SOLR_OPINION_URL):
+    """Add or update a batch of items in a Solr index by primary key.
+
+    This is the task used by the update_index command. Only the primary keys
+    of the items are sent through the broker, which keeps messages tiny. The
+    task loads the items itself, with their related objects prefetched.
+
+    :param item_pks: The primary keys of the items to add or update.
+    :param obj_type_label: The label of the model of the items, as
+    "app_label.ModelName", e.g. "search.Opinion".
+    :param solr_url: The URL of the Solr core to add the items to.
+    """
+    si = get_solr_interface(solr_url, mode='w')
+    obj_type = apps.get_model(obj_type_label)
     try:
-        si.add(search_item_list)
+        for chunk in get_search_dict_chunks(obj_type, item_pks):
+            si.add(chunk)
     except socket.error as exc:
-        add_or_update_items.retry(exc=exc, countdown=120)
+        add_or_update_items_by_pk.retry(exc=exc, countdown=120)
+
+
+@app.task
+def add_or_update_items(items, solr_url=settings.SOLR_OPINION_URL):
+    """Add or update pickled items in a Solr index.
+
+    Deprecated: kept for one release so that messages queued before the
+    switch to add_or_update_items_by_pk can still be consumed. Remove it once
+    the queues have drained.
+    """
+    if hasattr(items, "items") or not hasattr(items, "__iter__"):
+        # If it's a dict or a single item make it a list
+        items = [items]
+    pks_by_label = defaultdict(list)
+    for item in items:
+        label = '%s.%s' % (item._meta.app_label, item._meta.object_name)
+        pks_by_label[label].append(item.pk)
+    for obj_type_label, item_pks in pks_by_label.items():
+        add_or_update_items_by_pk(item_pks, obj_type_label, solr_url=solr_url)
 
 
 @app.task
@@ -84,7 +272,11 @@ def add_or_update_recap_docket(data, force_commit=False,
     :param update_threshold: Items staler than this number of seconds will be
     updated. Items fresher than this number will be a no-op.
     """
-    si = scorched.SolrInterface(settings.SOLR_RECAP_URL, mode='w')
+    if settings.INDEX_CHANGE_LOG_ENABLED:
+        # The docket's changes are in the IndexChange log, so
+        # cl_process_index_changes will update it.
+        return
+    si = get_solr_interface(settings.SOLR_RECAP_URL, mode='w')
     some_time_ago = now() - timedelta(seconds=update_threshold)
     d = Docket.objects.get(pk=data['docket_pk'])
     too_fresh = d.date_last_index is not None and \
@@ -94,22 +286,23 @@ def add_or_update_recap_docket(data, force_commit=False,
         return
     else:
         try:
-            si.add(d.as_search_list())
+            # Send each chunk as it is made to keep memory use flat.
+            for chunk in d.as_search_chunks():
+                si.add(chunk)
             if force_commit:
                 si.commit()
         except SolrError as exc:
             add_or_update_recap_docket.retry(exc=exc, countdown=30)
         else:
             d.date_last_index = now()
-            d.save()
+            d.save(update_fields=['date_last_index'])
 
 
 @app.task
 def add_or_update_opinions(item_pks, force_commit=False):
-    si = scorched.SolrInterface(settings.SOLR_OPINION_URL, mode='w')
+    si = get_solr_interface(settings.SOLR_OPINION_URL, mode='w')
     try:
-        si.add([item.as_search_dict() for item in
-                Opinion.objects.filter(pk__in=item_pks)])
+        si.add(make_opinion_search_dicts(item_pks))
         if force_commit:
             si.commit()
     except SolrError as exc:
@@ -118,7 +311,7 @@ def add_or_update_opinions(item_pks, force_commit=False):
 
 @app.task
 def add_or_update_audio_files(item_pks, force_commit=False):
-    si = scorched.SolrInterface(settings.SOLR_AUDIO_URL, mode='w')
+    si = get_solr_interface(settings.SOLR_AUDIO_URL, mode='w')
     try:
         si.add([item.as_search_dict() for item in
                 Audio.objects.filter(pk__in=item_pks)])
@@ -130,7 +323,7 @@ def add_or_update_audio_files(item_pks, force_commit=False):
 
 @app.task
 def add_or_update_people(item_pks, force_commit=False):
-    si = scorched.SolrInterface(settings.SOLR_PEOPLE_URL, mode='w')
+    si = get_solr_interface(settings.SOLR_PEOPLE_URL, mode='w')
     try:
         si.add([item.as_search_dict() for item in
                 Person.objects.filter(pk__in=item_pks)])
@@ -157,7 +350,7 @@ def add_or_update_recap_document(item_pks, coalesce_docket=False,
     updates?
     :return: None
     """
-    si = scorched.SolrInterface(settings.SOLR_RECAP_URL, mode='w')
+    si = get_solr_interface(settings.SOLR_RECAP_URL, mode='w')
     rds = RECAPDocument.objects.filter(pk__in=item_pks).order_by()
     if coalesce_docket:
         try:
@@ -177,7 +370,7 @@ def add_or_update_recap_document(item_pks, coalesce_docket=False,
 
 @app.task
 def delete_items(items, solr_url, force_commit=False):
-    si = scorched.SolrInterface(solr_url, mode='w')
+    si = get_solr_interface(solr_url, mode='w')
     try:
         si.delete_by_ids(list(items))
         if force_commit:
@@ -188,10 +381,11 @@ def delete_items(items, solr_url, force_commit=False):
 
 @app.task
 def add_or_update_cluster(pk, force_commit=False):
-    si = scorched.SolrInterface(settings.SOLR_OPINION_URL, mode='w')
+    si = get_solr_interface(settings.SOLR_OPINION_URL, mode='w')
     try:
-        si.add([item.as_search_dict() for item in
-                OpinionCluster.objects.get(pk=pk).sub_opinions.all()])
+        si.add(make_opinion_search_dicts(
+            Opinion.objects.filter(cluster_id=pk).values_list('pk', flat=True)
+        ))
         if force_commit:
             si.commit()
     except SolrError as exc:
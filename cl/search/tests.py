@@ -10,10 +10,12 @@ from django.core.management import call_command
 from django.core.urlresolvers import reverse
 from django.db import IntegrityError, transaction
 from django.http import HttpRequest
+from django.template import loader
 from django.test import RequestFactory
 from django.test import TestCase, override_settings
+from django.utils.timezone import now
 from lxml import etree, html
-from rest_framework.status import HTTP_200_OK
+from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
 from timeout_decorator import timeout_decorator
 
 from cl.lib.solr_core_admin import get_data_dir
@@ -21,9 +23,12 @@ from cl.lib.test_helpers import SolrTestCase, IndexedSolrTestCase, \
     EmptySolrTestCase
 from cl.search.feeds import JurisdictionFeed
 from cl.search.management.commands.cl_calculate_pagerank import Command
+from cl.search.management.commands.cl_process_index_changes import \
+    get_solr_operations
 from cl.search.models import Court, Docket, Opinion, OpinionCluster, \
-    RECAPDocument, DocketEntry
-from cl.search.tasks import add_or_update_recap_document
+    RECAPDocument, DocketEntry, IndexChange
+from cl.search.tasks import add_or_update_recap_document, \
+    make_opinion_search_dicts
 from cl.search.views import do_search
 from cl.tests.base import BaseSeleniumTest, SELENIUM_TIMEOUT
 
@@ -158,6 +163,130 @@ class ModelTest(TestCase):
                              "try to use `strftime`...again?")
 
 
+class OpinionSearchDictTest(TestCase):
+    fixtures = ['test_objects_search.json', 'judge_judy.json']
+
+    @staticmethod
+    def _sort_lists(search_dict):
+        return {k: sorted(v) if isinstance(v, list) else v for k, v in
+                search_dict.items()}
+
+    def test_bulk_search_dicts_match_one_by_one(self):
+        """Does the bulk builder make the same dicts as the per-object
+        method?
+        """
+        pks = Opinion.objects.values_list('pk', flat=True)
+        expected = {o.pk: self._sort_lists(o.as_search_dict()) for o in
+                    Opinion.objects.all()}
+        actual = {d['id']: self._sort_lists(d) for d in
+                  make_opinion_search_dicts(pks)}
+        self.assertEqual(expected, actual)
+
+    def test_bulk_search_dicts_use_fixed_queries(self):
+        """Is the number of queries independent of the number of opinions?"""
+        pks = list(Opinion.objects.values_list('pk', flat=True))
+        with self.assertNumQueries(6):
+            make_opinion_search_dicts(pks[:1])
+        with self.assertNumQueries(6):
+            make_opinion_search_dicts(pks)
+
+
+class RECAPSearchTextTest(TestCase):
+    fixtures = ['test_objects_query_counts.json']
+
+    def test_search_text_matches_template(self):
+        """Is the RECAP text field the same as the template's output?"""
+        template = loader.get_template('indexes/dockets_text.txt')
+        for rd in RECAPDocument.objects.all():
+            self.assertEqual(template.render({'item': rd}),
+                             rd.get_search_text())
+            docket_text = rd.docket_entry.docket.get_search_text()
+            self.assertEqual(template.render({'item': rd}),
+                             rd.get_search_text(docket_text))
+
+
+class DocketSearchChunksTest(TestCase):
+    fixtures = ['test_court.json']
+
+    def setUp(self):
+        self.d = Docket.objects.create(
+            source=Docket.RECAP,
+            docket_number='asdf',
+            pacer_case_id='asdf',
+            court_id='test',
+        )
+        for i in range(1, 6):
+            de = DocketEntry.objects.create(docket=self.d, entry_number=i)
+            RECAPDocument.objects.create(
+                docket_entry=de,
+                document_type=RECAPDocument.PACER_DOCUMENT,
+                document_number=str(i),
+                pacer_doc_id=str(i),
+            )
+        # A minute entry, which has no documents.
+        DocketEntry.objects.create(docket=self.d, entry_number=6)
+
+    def test_chunks_are_bounded(self):
+        """Are search dicts generated in chunks of the requested size?"""
+        chunks = list(self.d.as_search_chunks(chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+
+    def test_chunks_match_search_dicts(self):
+        """Are the chunked search dicts the same as the per-document ones?"""
+        expected = {rd.pk: rd.as_search_dict() for rd in
+                    RECAPDocument.objects.filter(docket_entry__docket=self.d)}
+        actual = {d['id']: d for d in self.d.as_search_list()}
+        self.assertEqual(expected, actual)
+
+
+@override_settings(INDEX_CHANGE_LOG_ENABLED=True)
+class IndexChangeTest(TestCase):
+    fixtures = ['test_objects_search.json', 'judge_judy.json']
+
+    def setUp(self):
+        IndexChange.objects.all().delete()
+
+    def test_changes_are_logged(self):
+        """Are saves and deletions of indexed items logged?"""
+        o = Opinion.objects.get(pk=1)
+        o.save(index=False)
+        o.save(index=False)
+        changes = IndexChange.objects.filter(item_type='search.Opinion',
+                                             item_pk=o.pk)
+        self.assertEqual(changes.count(), 2)
+
+        Docket.objects.get(pk=1).court.save()
+        self.assertFalse(IndexChange.objects.filter(
+            item_type='search.Court').exists())
+
+    def test_bookkeeping_saves_are_not_logged(self):
+        """Are saves that only touch date_last_index left out of the log?"""
+        d = Docket.objects.get(pk=1)
+        d.date_last_index = now()
+        d.save(update_fields=['date_last_index'])
+        self.assertFalse(IndexChange.objects.exists())
+
+    def test_nothing_is_logged_when_disabled(self):
+        """Does the log stay empty when it's turned off?"""
+        with self.settings(INDEX_CHANGE_LOG_ENABLED=False):
+            Opinion.objects.get(pk=1).save(index=False)
+        self.assertFalse(IndexChange.objects.exists())
+
+    def test_changes_are_coalesced_and_expanded(self):
+        """Are repeated changes coalesced, and are clusters expanded to their
+        opinions?
+        """
+        cluster = OpinionCluster.objects.get(pk=1)
+        for _ in range(3):
+            cluster.save(index=False)
+        updates, deletions = get_solr_operations(IndexChange.objects.all())
+        self.assertEqual(
+            updates[(settings.SOLR_OPINION_URL, Opinion)],
+            set(cluster.sub_opinions.values_list('pk', flat=True)),
+        )
+        self.assertFalse(any(deletions.values()))
+
+
 class DocketValidationTest(TestCase):
     fixtures = ['test_court.json']
 
@@ -473,6 +602,24 @@ class SearchTest(IndexedSolrTestCase):
             msg="Did not get good status code from oral arguments API endpoint"
         )
 
+    def test_search_api_with_cursors(self):
+        """Can we page through every result of the search API with cursors?"""
+        path = reverse('search-list', kwargs={'version': 'v3'})
+        r = self.client.get(path, {'q': '*', 'cursor': '*', 'count': 'on'})
+        self.assertEqual(r.status_code, HTTP_200_OK)
+        count = r.data['count']
+        ids = [result['id'] for result in r.data['results']]
+        while r.data['next']:
+            r = self.client.get(r.data['next'])
+            self.assertNotIn('count', r.data)
+            ids.extend(result['id'] for result in r.data['results'])
+        self.assertEqual(len(ids), count)
+        self.assertEqual(len(set(ids)), count)
+
+        for cursor in ('not-a-cursor', 'AoE='):
+            r = self.client.get(path, {'q': '*', 'cursor': cursor})
+            self.assertEqual(r.status_code, HTTP_400_BAD_REQUEST)
+
     def test_homepage(self):
         """Is the homepage loaded when no GET parameters are provided?"""
         response = self.client.get(reverse('show_results'))
@@ -19,7 +19,7 @@ from cl.alerts.models import Alert
 from cl.audio.models import Audio
 from cl.custom_filters.templatetags.text_filters import naturalduration
 from cl.lib.bot_detector import is_bot
-from cl.lib.scorched_utils import ExtraSolrInterface
+from cl.lib.scorched_utils import get_solr_interface
 from cl.lib.search_utils import build_main_query, get_query_citation, \
     make_stats_variable, merge_form_with_courts,  make_get_string, \
     regroup_snippets
@@ -50,17 +50,17 @@ def do_search(request, rows=20, order_by=None, type=None, facet=True):
         search_form = _clean_form(request, cd, courts)
 
         if cd['type'] == 'o':
-            si = ExtraSolrInterface(settings.SOLR_OPINION_URL, mode='r')
+            si = get_solr_interface(settings.SOLR_OPINION_URL, mode='r')
             results = si.query().add_extra(**build_main_query(cd, facet=facet))
             query_citation = get_query_citation(cd)
         elif cd['type'] == 'r':
-            si = ExtraSolrInterface(settings.SOLR_RECAP_URL, mode='r')
+            si = get_solr_interface(settings.SOLR_RECAP_URL, mode='r')
             results = si.query().add_extra(**build_main_query(cd, facet=facet))
         elif cd['type'] == 'oa':
-            si = ExtraSolrInterface(settings.SOLR_AUDIO_URL, mode='r')
+            si = get_solr_interface(settings.SOLR_AUDIO_URL, mode='r')
             results = si.query().add_extra(**build_main_query(cd, facet=facet))
         elif cd['type'] == 'p':
-            si = ExtraSolrInterface(settings.SOLR_PEOPLE_URL, mode='r')
+            si = get_solr_interface(settings.SOLR_PEOPLE_URL, mode='r')
             results = si.query().add_extra(**build_main_query(cd, facet=facet))
 
         # Set up pagination
@@ -156,6 +156,12 @@ SOLR_TEST_URLS = {
     'recap': SOLR_RECAP_TEST_URL,
 }
 
+# Log saves and deletions of indexed items in the IndexChange table, for
+# cl_process_index_changes to send to Solr. When this is on, saving or
+# deleting an item no longer updates Solr by itself, so the command must be
+# running. When it's off, nothing is logged and the table stays empty.
+INDEX_CHANGE_LOG_ENABLED = False
+
 #########
 # Redis #
 #########
@@ -245,6 +251,47 @@ STATIC_ROOT = os.path.join(INSTALL_ROOT, 'cl/assets/static/')
 # Where should the bulk data be stored?
 BULK_DATA_DIR = os.path.join(INSTALL_ROOT, 'cl/assets/media/bulk-data/')
 
+# Where should responses to scraper downloads be cached, so that unchanged
+# files can be fetched with conditional requests? None disables the cache.
+HTTP_CACHE_DIR = None
+HTTP_CACHE_MAX_BYTES = 5 * 1024 ** 3
+
+# Where should the local citation index be stored? See cl.citations.
+CITATION_INDEX_PATH = os.path.join(INSTALL_ROOT,
+                                   'cl/assets/media/citation-index.txt')
+
+# Where should cl_make_sitemaps write the sitemaps for opinions, RECAP dockets
+# and oral arguments? Until it has been run, sitemaps are made from Solr.
+SITEMAP_DIR = os.path.join(MEDIA_ROOT, 'sitemaps')
+
+# Where should the text extracted from files be cached, keyed by their sha1?
+# None disables the cache. See cl.lib.extraction_cache.
+EXTRACTION_CACHE_DIR = None
+EXTRACTION_CACHE_MAX_BYTES = 5 * 1024 ** 3
+
+
+#######
+# OCR #
+#######
+# How many chunks of a scanned PDF's pages are rasterized and OCRed at once?
+# 1 OCRs every PDF in a single pass.
+OCR_PROCESSES = 1
+# How many pages are in a chunk? PDFs this short are OCRed in a single pass.
+OCR_PAGES_PER_CHUNK = 10
+# Where should chunked OCR save the pages it has finished, so it can resume
+# after a crash? None disables resuming.
+OCR_CHECKPOINT_DIR = None
+
+
+#########
+# RECAP #
+#########
+# Should RECAP uploads be left in the processing queue for the
+# cl_process_recap_queue command, instead of being processed as soon as they
+# arrive? The command processes the uploads of each docket one at a time, and
+# PDFs after the dockets they belong to.
+RECAP_SCHEDULE_UPLOADS = False
+
 
 #####################
 # Payments & Prices #
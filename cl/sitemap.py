@@ -1,13 +1,20 @@
+import gzip
+import io
+import json
+import os
+
 from django.conf import settings
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.template import loader
+from django.utils.cache import patch_vary_headers
 from django.utils.encoding import smart_str
 from django.views.decorators.cache import never_cache
 
-from cl.lib.scorched_utils import ExtraSolrInterface
+from cl.lib.scorched_utils import get_solr_interface
 
 items_per_sitemap = 250
+cl = 'https://www.courtlistener.com'
 
 
 def make_index_params(group):
@@ -63,36 +70,135 @@ def normalize_grouping(result):
         return result
 
 
+def make_url_items(path, local_path, lastmod, changefreq, low_priority_pages):
+    """Make the sitemap entries for an item, one for its page and, if it has
+    one, one for its file.
+    """
+    url_strs = ['%s%s' % (cl, path)]
+    if local_path and not local_path.endswith('.xml'):
+        url_strs.append('%s/%s' % (cl, local_path))
+
+    items = []
+    for url_str in url_strs:
+        items.append({
+            'location': url_str,
+            'changefreq': changefreq,
+            'lastmod': lastmod,
+            'priority': '0.3' if any(s in url_str for s in
+                                     low_priority_pages) else '0.5',
+        })
+    return items
+
+
+def render_sitemap(urls):
+    return smart_str(loader.render_to_string('sitemap.xml', {'urlset': urls}))
+
+
+def make_sitemap_response(xml):
+    response = HttpResponse(xml, content_type='application/xml')
+    response['X-Robots-Tag'] = 'noindex, noodp, noarchive, noimageindex'
+    return response
+
+
 def make_solr_sitemap(request, solr_url, params, changefreq, low_priority_pages,
-                      url_field):
-    solr = ExtraSolrInterface(solr_url)
+                      url_field, section=None):
+    """Make a page of a sitemap from Solr, or serve it from the files made by
+    cl_make_sitemaps if they exist for the section.
+    """
     page = int(request.GET.get('p', 1))
+    if section is not None:
+        response = serve_static_sitemap(request, section, page)
+        if response is not None:
+            return response
+
+    solr = get_solr_interface(solr_url, mode='r')
     params['start'] = (page - 1) * items_per_sitemap
     results = solr.query().add_extra(**params).execute()
 
     urls = []
-    cl = 'https://www.courtlistener.com'
     for result in results:
         result = normalize_grouping(result)
-        url_strs = ['%s%s' % (cl, result[url_field])]
-        if result.get('local_path') and \
-                not result['local_path'].endswith('.xml'):
-            url_strs.append('%s/%s' % (cl, result['local_path']))
-
-        item = {}
-        for url_str in url_strs:
-            item['location'] = url_str
-            item['changefreq'] = changefreq
-            item['lastmod'] = result['timestamp']
-            if any(s in url_str for s in low_priority_pages):
-                item['priority'] = '0.3'
-            else:
-                item['priority'] = '0.5'
-            urls.append(item.copy())
-
-    xml = smart_str(loader.render_to_string('sitemap.xml', {'urlset': urls}))
-    response = HttpResponse(xml, content_type='application/xml')
-    response['X-Robots-Tag'] = 'noindex, noodp, noarchive, noimageindex'
+        urls.extend(make_url_items(result[url_field], result.get('local_path'),
+                                   result['timestamp'], changefreq,
+                                   low_priority_pages))
+    return make_sitemap_response(render_sitemap(urls))
+
+
+def get_static_sitemap_dir(section):
+    return os.path.join(settings.SITEMAP_DIR, section)
+
+
+def get_static_sitemap_path(section, page):
+    return os.path.join(get_static_sitemap_dir(section), '%s.xml.gz' % page)
+
+
+def get_static_sitemap_state_path(section):
+    return os.path.join(get_static_sitemap_dir(section), 'state.json')
+
+
+def get_static_sitemap_state(section):
+    """Get the state of the files of a section made by cl_make_sitemaps.
+
+    :return: A dict with the list of the last pk on each page, under
+    'last_pks', or None if the section has not been made.
+    """
+    try:
+        with open(get_static_sitemap_state_path(section)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip.
+
+    Codings with a q-value of zero are refused, and a wildcard counts unless
+    gzip is listed on its own.
+
+    :param accept_encoding: The value of the header.
+    """
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        params = coding.split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[name] = q
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
+
+
+def serve_static_sitemap(request, section, page):
+    """Serve a page of a sitemap from its gzipped file.
+
+    :return: An HttpResponse, or None if the section's files have not been
+    made. Raises Http404 for pages beyond the last one.
+    """
+    state = get_static_sitemap_state(section)
+    if state is None:
+        return None
+    if not 1 <= page <= len(state['last_pks']):
+        raise Http404("No such sitemap page.")
+    with open(get_static_sitemap_path(section, page), 'rb') as f:
+        content = f.read()
+    if accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = make_sitemap_response(content)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = make_sitemap_response(
+            gzip.GzipFile(fileobj=io.BytesIO(content)).read())
+    # Caches must not give gzipped pages to clients that didn't ask for them.
+    patch_vary_headers(response, ['Accept-Encoding'])
     return response
 
 
@@ -104,16 +210,23 @@ def index_sitemap_maker(request):
     provides links items.
     """
     connection_string_sitemap_path_pairs = (
-        (settings.SOLR_OPINION_URL, reverse('opinion_sitemap'), False),
-        (settings.SOLR_RECAP_URL, reverse('recap_sitemap'), True),
-        (settings.SOLR_AUDIO_URL, reverse('oral_argument_sitemap'), False),
-        (settings.SOLR_PEOPLE_URL, reverse('people_sitemap'), False),
+        (settings.SOLR_OPINION_URL, reverse('opinion_sitemap'), False,
+         'opinions'),
+        (settings.SOLR_RECAP_URL, reverse('recap_sitemap'), True, 'recap'),
+        (settings.SOLR_AUDIO_URL, reverse('oral_argument_sitemap'), False,
+         'oral-arguments'),
+        (settings.SOLR_PEOPLE_URL, reverse('people_sitemap'), False, None),
     )
     sites = []
-    for connection_string, path, group in connection_string_sitemap_path_pairs:
-        conn = ExtraSolrInterface(connection_string)
-        count = conn.query().add_extra(**make_index_params(group)).count()
-        num_pages = count / items_per_sitemap + 1
+    for connection_string, path, group, section in \
+            connection_string_sitemap_path_pairs:
+        state = get_static_sitemap_state(section) if section else None
+        if state is not None:
+            num_pages = len(state['last_pks'])
+        else:
+            conn = get_solr_interface(connection_string, mode='r')
+            count = conn.query().add_extra(**make_index_params(group)).count()
+            num_pages = count / items_per_sitemap + 1
         for i in range(1, num_pages + 1):
             sites.append('https://www.courtlistener.com%s?p=%s' % (path, i))
 